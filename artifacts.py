@@ -0,0 +1,190 @@
+# artifacts.py
+"""
+Artefatos de debug (OCR e Selenium) gravados fora do caminho quente.
+
+Quem gera o artefato só enfileira (`salvar_artefato`) e segue; uma thread de
+fundo codifica/grava. Cada comprovante (ou evento, ex.: timeout da grade) ganha
+uma pasta própria — o “bundle” — com o que houver: imagem normalizada, texto do
+OCR, HTML da página, screenshot. O total em disco tem teto: passando dele, os
+bundles menos recentemente gravados são apagados (LRU pelo mtime da pasta).
+
+Fila cheia = artefato descartado (com aviso no log), nunca espera: debug ligado
+em produção não pode segurar o OCR nem o Selenium, nem encher o cartão SD.
+
+Variáveis:
+  DEBUG_DIR (ou OCR_DEBUG_DIR)   pasta raiz dos bundles        (padrão: _ocr_debug)
+  DEBUG_MAX_MB                   teto total em disco           (padrão: 200)
+  DEBUG_QUEUE                    itens pendentes na fila       (padrão: 32)
+"""
+import io
+import os
+import re
+import time
+import queue
+import atexit
+import shutil
+import logging
+import threading
+from typing import Callable, List, Optional, Tuple, Union
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DEBUG_DIR = os.getenv("DEBUG_DIR") or os.getenv("OCR_DEBUG_DIR") or "_ocr_debug"
+_MAX_BYTES = int(float(os.getenv("DEBUG_MAX_MB", "200") or 200) * 1024 * 1024)
+_FILA_MAX = int(os.getenv("DEBUG_QUEUE", "32") or 32)
+
+# conteúdo aceito: bytes/str prontos, imagem PIL (vira PNG na thread) ou
+# uma função que devolve bytes (codificação cara também fica fora do chamador)
+Conteudo = Union[bytes, str, Image.Image, Callable[[], bytes]]
+
+_NOME_SEGURO = re.compile(r"[^\w.\-]+")
+
+
+def _seguro(nome: str) -> str:
+    return _NOME_SEGURO.sub("_", nome).strip("._") or "x"
+
+
+def _em_bytes(dados: Conteudo) -> bytes:
+    if isinstance(dados, bytes):
+        return dados
+    if isinstance(dados, str):
+        return dados.encode("utf-8")
+    if isinstance(dados, Image.Image):
+        buf = io.BytesIO()
+        dados.save(buf, format="PNG")
+        return buf.getvalue()
+    return dados()
+
+
+class ArtifactStore:
+    """
+    Loja de artefatos com escrita assíncrona e teto de tamanho.
+
+      - salvar(bundle, nome, dados) -> True se enfileirou (não bloqueia)
+      - flush(timeout)              -> espera a fila esvaziar (testes/saída)
+      - close()                     -> flush + encerra a thread
+    """
+
+    def __init__(self, raiz: str = DEBUG_DIR, max_bytes: int = _MAX_BYTES, fila_max: int = _FILA_MAX):
+        self.raiz = raiz
+        self.max_bytes = max(0, int(max_bytes))
+        self._fila: "queue.Queue[Optional[Tuple[str, str, Conteudo]]]" = queue.Queue(maxsize=max(1, fila_max))
+        self._descartados = 0
+        # bytes gravados desde a última varredura do disco (outros processos também gravam aqui)
+        self._desde_varredura = self.max_bytes
+        self._thread = threading.Thread(target=self._loop, name="artefatos", daemon=True)
+        self._thread.start()
+
+    def salvar(self, bundle: str, nome: str, dados: Conteudo) -> bool:
+        try:
+            self._fila.put_nowait((_seguro(bundle), _seguro(nome), dados))
+            return True
+        except queue.Full:
+            self._descartados += 1
+            if self._descartados in (1, 10, 100) or self._descartados % 1000 == 0:
+                logger.warning(f"[debug] Fila de artefatos cheia — {self._descartados} descartado(s).")
+            return False
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        fim = time.monotonic() + timeout
+        while self._fila.unfinished_tasks and time.monotonic() < fim:
+            time.sleep(0.05)
+        return not self._fila.unfinished_tasks
+
+    def close(self, timeout: float = 5.0) -> None:
+        self.flush(timeout)
+        try:
+            self._fila.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=1.0)
+
+    # -----------------------
+    # thread de escrita
+    # -----------------------
+    def _loop(self) -> None:
+        while True:
+            item = self._fila.get()
+            try:
+                if item is None:
+                    return
+                self._gravar(*item)
+                if self._fila.empty() and self._desde_varredura > self.max_bytes // 20:
+                    self._podar()
+            except Exception as e:
+                logger.debug(f"[debug] Falha ao gravar artefato: {e}")
+            finally:
+                self._fila.task_done()
+
+    def _gravar(self, bundle: str, nome: str, dados: Conteudo) -> None:
+        pasta = os.path.join(self.raiz, bundle)
+        os.makedirs(pasta, exist_ok=True)
+        conteudo = _em_bytes(dados)
+        destino = os.path.join(pasta, nome)
+        tmp = destino + ".part"
+        with open(tmp, "wb") as f:
+            f.write(conteudo)
+        os.replace(tmp, destino)
+        os.utime(pasta)  # LRU: bundle recém-gravado vai para o fim da fila de poda
+        self._desde_varredura += len(conteudo)
+
+    def _bundles(self) -> List[Tuple[float, int, str]]:
+        out = []
+        try:
+            entradas = list(os.scandir(self.raiz))
+        except FileNotFoundError:
+            return out
+        for e in entradas:
+            if not e.is_dir(follow_symlinks=False):
+                continue
+            tam = 0
+            try:
+                for f in os.scandir(e.path):
+                    if f.is_file(follow_symlinks=False):
+                        tam += f.stat().st_size
+                out.append((e.stat().st_mtime, tam, e.path))
+            except FileNotFoundError:
+                continue   # outro processo podou no meio da varredura
+        return out
+
+    def _podar(self) -> None:
+        """Apaga os bundles mais antigos até o total caber no teto."""
+        self._desde_varredura = 0
+        if self.max_bytes <= 0:
+            return
+        bundles = sorted(self._bundles())
+        total = sum(t for _, t, _ in bundles)
+        removidos = 0
+        # o mais recente nunca sai (acabou de ser gravado)
+        for _, tam, caminho in bundles[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(caminho, ignore_errors=True)
+            total -= tam
+            removidos += 1
+        if removidos:
+            logger.debug(f"[debug] {removidos} bundle(s) antigo(s) removido(s) — {total / 1048576:.0f} MB em {self.raiz}")
+
+
+# -------------------------------
+# Instância do processo
+# -------------------------------
+_LOJA: Optional[ArtifactStore] = None
+_LOJA_LOCK = threading.Lock()
+
+
+def artifact_store() -> ArtifactStore:
+    """Uma loja (e uma thread) por processo — workers de OCR incluídos."""
+    global _LOJA
+    if _LOJA is None:
+        with _LOJA_LOCK:
+            if _LOJA is None:
+                _LOJA = ArtifactStore()
+                atexit.register(_LOJA.close, 2.0)
+    return _LOJA
+
+
+def salvar_artefato(bundle: str, nome: str, dados: Conteudo) -> bool:
+    return artifact_store().salvar(bundle, nome, dados)
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# bench_ocr.py
+"""
+Benchmarks do OCR.
+
+  corpus  -> roda um corpus rotulado (gabarito.json) por extrair_ocr em cada
+             caminho de pré-processamento (cv2 / numpy / pil) e mede acerto por campo,
+             latência p50/p95 e pico de RSS (do processo e dos filhos — o `tesseract`
+             do pytesseract roda fora). Gera JSON comparável entre commits.
+             Mede extrair_ocr, não extrair_dados_comprovante do watcher inline: este
+             é extrair_ocr(...).para_dados(), que só descarta a data fora da janela
+             (mês atual/anterior) — num corpus de comprovantes antigos isso zeraria o
+             acerto de data sem dizer nada do OCR. O pool (ocr_job) e o ocr_cache
+             também guardam o resultado de extrair_ocr.
+  rescale -> tempo por imagem com a normalização de resolução desligada x ligada.
+  stage   -> vazão do OcrStage (o mesmo pool do watcher) com 1..N workers, num
+             ledger temporário (LEDGER_DB) para não tocar no de produção.
+
+Uso (no Pi, com o venv ativo):
+    python bench_ocr.py corpus corpus_ocr/ --json bench/$(git rev-parse --short HEAD).json
+    python bench_ocr.py corpus corpus_ocr/ --compare bench/anterior.json
+    python bench_ocr.py rescale pasta_de_imagens --repeat 2
+    python gen_comprovantes.py corpus_sintetico/ -n 300 && python bench_ocr.py stage corpus_sintetico/ --workers 1 2 3
+
+gabarito.json (na pasta do corpus):
+    [{"arquivo": "veloe_01.png", "tipo": "pedagio",
+      "data": "2025-10-03T14:40", "valor_centavos": 1250}, ...]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import multiprocessing
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+import ocr_utils
+
+try:
+    import resource  # ausente no Windows
+except Exception:
+    resource = None
+
+try:
+    from tabulate import tabulate
+    _TAB = True
+except Exception:
+    _TAB = False
+
+_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".pdf"}
+_GABARITO = "gabarito.json"
+_PREPROCS = ("cv2", "numpy", "pil")
+
+
+def _print(rows, headers):
+    if _TAB:
+        print(tabulate(rows, headers=headers, tablefmt="github"))
+    else:
+        print(headers)
+        for r in rows:
+            print(r)
+
+
+def _arquivos(alvo: str) -> List[str]:
+    if os.path.isfile(alvo):
+        return [alvo]
+    return sorted(
+        os.path.join(alvo, f) for f in os.listdir(alvo)
+        if os.path.splitext(f)[1].lower() in _EXTS
+    )
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    """Percentil por posição mais próxima (suficiente para dezenas/centenas de amostras)."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[k]
+
+
+def _pico_rss_mb(filhos: bool = False) -> Optional[float]:
+    """Pico de RSS do processo ou, com `filhos`, do maior filho já encerrado (ex.: tesseract)."""
+    if resource is None:
+        return None
+    quem = resource.RUSAGE_CHILDREN if filhos else resource.RUSAGE_SELF
+    kb = resource.getrusage(quem).ru_maxrss  # KB no Linux
+    return round(kb / 1024, 1)
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return "?"
+
+
+# -----------------------------
+# corpus
+# -----------------------------
+def _carregar_gabarito(pasta: str) -> List[Dict[str, Any]]:
+    with open(os.path.join(pasta, _GABARITO), "r", encoding="utf-8") as f:
+        itens = json.load(f)
+    for it in itens:
+        it["caminho"] = os.path.join(pasta, it["arquivo"])
+    return [it for it in itens if os.path.exists(it["caminho"])]
+
+
+def _mesma_data(esperada: Optional[str], obtida: Optional[datetime]) -> bool:
+    if not esperada:
+        return obtida is None
+    if obtida is None:
+        return False
+    return datetime.fromisoformat(esperada).replace(second=0) == obtida.replace(second=0, microsecond=0)
+
+
+def _rodar_preproc(preproc: str, itens: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    """Roda num processo próprio (ver _filho) para o pico de RSS ser só deste caminho."""
+    ocr_utils._PREPROC = preproc
+    arquivos, tempos = [], []
+    acertos = {"tipo": 0, "data": 0, "valor": 0, "todos": 0}
+
+    for it in itens:
+        melhor, ext, erro = None, None, None
+        for _ in range(max(1, repeat)):
+            ext = None   # repetição que falhou não herda o resultado da anterior
+            t0 = time.perf_counter()
+            try:
+                ext = ocr_utils.extrair_ocr(it["caminho"])
+            except Exception as e:
+                erro = f"{type(e).__name__}: {e}"
+            dt = time.perf_counter() - t0
+            melhor = dt if melhor is None else min(melhor, dt)
+        tempos.append(melhor)
+
+        ok_tipo = ext is not None and ext.tipo == it.get("tipo")
+        ok_data = ext is not None and _mesma_data(it.get("data"), ext.data)
+        ok_valor = ext is not None and ext.valor_centavos == it.get("valor_centavos")
+        acertos["tipo"] += ok_tipo
+        acertos["data"] += ok_data
+        acertos["valor"] += ok_valor
+        acertos["todos"] += ok_tipo and ok_data and ok_valor
+
+        arquivos.append({
+            "arquivo": it["arquivo"],
+            "segundos": round(melhor, 4),
+            "tipo": ext.tipo if ext else None,
+            "data": ext.data.isoformat() if ext and ext.data else None,
+            "valor_centavos": ext.valor_centavos if ext else None,
+            "preproc": ext.preproc if ext else None,
+            "ok": {"tipo": ok_tipo, "data": ok_data, "valor": ok_valor},
+            "erro": erro,
+        })
+
+    n = max(1, len(itens))
+    return {
+        "preproc": preproc,
+        "n": len(itens),
+        "acerto": {k: round(v / n, 4) for k, v in acertos.items()},
+        "latencia_s": {
+            "p50": round(_percentil(tempos, 50), 4),
+            "p95": round(_percentil(tempos, 95), 4),
+            "media": round(statistics.mean(tempos), 4) if tempos else 0.0,
+            "total": round(sum(tempos), 3),
+        },
+        # pico_rss_mb = o maior dos dois (pytesseract: quase tudo no filho; tesserocr: no processo)
+        "pico_rss_mb": max((v for v in (_pico_rss_mb(), _pico_rss_mb(filhos=True)) if v is not None), default=None),
+        "pico_rss_proc_mb": _pico_rss_mb(),
+        "pico_rss_filhos_mb": _pico_rss_mb(filhos=True),
+        "arquivos": arquivos,
+    }
+
+
+def _filho(preproc: str, itens: List[Dict[str, Any]], repeat: int, fila) -> None:
+    try:
+        fila.put(_rodar_preproc(preproc, itens, repeat))
+    except Exception as e:
+        fila.put({"preproc": preproc, "erro": f"{type(e).__name__}: {e}"})
+
+
+def cmd_corpus(args) -> int:
+    itens = _carregar_gabarito(args.pasta)
+    if not itens:
+        print(f"Nenhum arquivo do {_GABARITO} encontrado em {args.pasta}.")
+        return 1
+
+    preprocs = [p for p in (args.preproc or _PREPROCS)]
+    if "cv2" in preprocs and not ocr_utils._HAS_CV2:
+        print("OpenCV não instalado — pulando o caminho cv2.")
+        preprocs.remove("cv2")
+    if "numpy" in preprocs and not ocr_utils._HAS_NUMPY:
+        print("NumPy não instalado — pulando o caminho numpy.")
+        preprocs.remove("numpy")
+
+    ctx = multiprocessing.get_context("spawn")
+    resultados: Dict[str, Any] = {}
+    for pp in preprocs:
+        fila = ctx.Queue()
+        proc = ctx.Process(target=_filho, args=(pp, itens, args.repeat, fila))
+        proc.start()
+        resultados[pp] = fila.get()
+        proc.join()
+
+    saida = {
+        "commit": _commit(),
+        "quando": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "maquina": platform.machine(),
+        "engine": ocr_utils.engine_id(),
+        "corpus": os.path.abspath(args.pasta),
+        "resultados": resultados,
+    }
+
+    rows = []
+    for pp, r in resultados.items():
+        if "erro" in r:
+            rows.append([pp, "-", "-", "-", "-", "-", "-", "-", r["erro"]])
+            continue
+        a, lat = r["acerto"], r["latencia_s"]
+        rows.append([
+            pp, r["n"], f"{a['tipo']:.0%}", f"{a['data']:.0%}", f"{a['valor']:.0%}",
+            f"{lat['p50']:.2f}", f"{lat['p95']:.2f}", r["pico_rss_proc_mb"] or "-",
+            r["pico_rss_filhos_mb"] or "-",
+        ])
+    _print(rows, ["preproc", "n", "tipo", "data", "valor", "p50_s", "p95_s", "rss_proc_mb", "rss_filhos_mb"])
+
+    if args.compare:
+        _comparar(args.compare, saida)
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(saida, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados gravados em {args.json}")
+    return 0
+
+
+def _comparar(path_base: str, atual: Dict[str, Any]) -> None:
+    with open(path_base, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    print(f"\nComparação com {base.get('commit', '?')} ({path_base}):")
+    rows = []
+    for pp, r in atual["resultados"].items():
+        b = base.get("resultados", {}).get(pp)
+        if not b or "erro" in b or "erro" in r:
+            continue
+        for campo in ("tipo", "data", "valor", "todos"):
+            rows.append([pp, f"acerto.{campo}", b["acerto"][campo], r["acerto"][campo],
+                         f"{r['acerto'][campo] - b['acerto'][campo]:+.2%}"])
+        for q in ("p50", "p95"):
+            vb, va = b["latencia_s"][q], r["latencia_s"][q]
+            rows.append([pp, f"latencia.{q}", vb, va, f"{(va / vb - 1) if vb else 0:+.1%}"])
+        if b.get("pico_rss_mb") and r.get("pico_rss_mb"):
+            rows.append([pp, "pico_rss_mb", b["pico_rss_mb"], r["pico_rss_mb"],
+                         f"{r['pico_rss_mb'] - b['pico_rss_mb']:+.1f}"])
+    _print(rows, ["preproc", "métrica", "base", "atual", "delta"])
+
+
+# -----------------------------
+# rescale (antes/depois da normalização de resolução)
+# -----------------------------
+def _tempo(path: str, rescale: bool, repeat: int):
+    ocr_utils._OCR_RESCALE = rescale
+    melhor, ext = None, None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        ext = ocr_utils.extrair_ocr(path)
+        dt = time.perf_counter() - t0
+        melhor = dt if melhor is None else min(melhor, dt)
+    return melhor, ext
+
+
+def cmd_rescale(args) -> int:
+    paths = [p for p in _arquivos(args.alvo) if not p.lower().endswith(".pdf")]
+    if not paths:
+        print("Nenhuma imagem encontrada.")
+        return 1
+
+    rows = []
+    antes, depois = [], []
+    for p in paths:
+        with Image.open(p) as im:
+            tam = f"{im.width}x{im.height}"
+            linha = ocr_utils._altura_linha(im.convert("L"))
+
+        t_off, e_off = _tempo(p, False, args.repeat)
+        t_on, e_on = _tempo(p, True, args.repeat)
+        antes.append(t_off)
+        depois.append(t_on)
+
+        iguais = (e_off.tipo, e_off.data, e_off.valor_centavos) == (e_on.tipo, e_on.data, e_on.valor_centavos)
+        rows.append([
+            os.path.basename(p), tam, f"{linha:.0f}" if linha else "-",
+            f"{t_off:.2f}", f"{t_on:.2f}", f"{t_off / t_on:.2f}x" if t_on else "-",
+            "sim" if iguais else "NÃO",
+        ])
+
+    _print(rows, ["arquivo", "tamanho", "linha_px", "antes_s", "depois_s", "ganho", "mesmos_campos"])
+    print()
+    print(f"imagens: {len(paths)}")
+    print(f"antes : média {statistics.mean(antes):.2f}s | mediana {statistics.median(antes):.2f}s")
+    print(f"depois: média {statistics.mean(depois):.2f}s | mediana {statistics.median(depois):.2f}s")
+    return 0
+
+
+# -----------------------------
+# stage (vazão do pool de OCR do watcher)
+# -----------------------------
+def _rodar_stage(paths: List[str], workers: int, gabarito: Dict[str, Dict[str, Any]]) -> List[Any]:
+    from ocr_stage import OcrStage
+
+    stage = OcrStage(workers, deadline=float(os.getenv("OCR_DEADLINE_SEC", "180")))
+    t0 = time.perf_counter()
+    for p in paths:
+        stage.submit(p)
+    status: Dict[str, int] = {}
+    certos = 0
+    while stage.pendentes:
+        for res in stage.concluidos():
+            status[res.status] = status.get(res.status, 0) + 1
+            g = gabarito.get(os.path.basename(res.path))
+            d = res.dados
+            if g and d and d.tipo == g.get("tipo") and d.valor_centavos == g.get("valor_centavos") \
+                    and _mesma_data(g.get("data"), d.data):
+                certos += 1
+        time.sleep(0.05)
+    total = time.perf_counter() - t0
+    stage.close()
+
+    com_gabarito = sum(1 for p in paths if os.path.basename(p) in gabarito)
+    return [
+        workers, len(paths), f"{total:.1f}", f"{len(paths) / total * 60:.1f}",
+        " ".join(f"{k}={v}" for k, v in sorted(status.items())),
+        f"{certos / com_gabarito:.0%}" if com_gabarito else "-",
+    ]
+
+
+def cmd_stage(args) -> int:
+    paths = _arquivos(args.pasta)
+    if not paths:
+        print("Nenhum arquivo encontrado.")
+        return 1
+    gabarito: Dict[str, Dict[str, Any]] = {}
+    if os.path.exists(os.path.join(args.pasta, _GABARITO)):
+        gabarito = {it["arquivo"]: it for it in _carregar_gabarito(args.pasta)}
+
+    rows = []
+    for w in args.workers:
+        # ledger novo a cada rodada: sem ocr_cache nem processed_files de antes
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ["LEDGER_DB"] = os.path.join(tmp, "ledger.sqlite3")
+            rows.append(_rodar_stage(paths, w, gabarito))
+    _print(rows, ["workers", "arquivos", "total_s", "arquivos_min", "status", "acerto"])
+    return 0
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Benchmarks de OCR (acerto/latência/memória)")
+    sub = ap.add_subparsers(dest="cmd")
+
+    p_corpus = sub.add_parser("corpus", help="Corpus rotulado: acerto por campo, p50/p95, pico de RSS")
+    p_corpus.add_argument("pasta", help=f"pasta com as imagens/PDFs e o {_GABARITO}")
+    p_corpus.add_argument("--preproc", action="append", choices=list(_PREPROCS),
+                          help="caminho(s) de pré-processamento (padrão: todos)")
+    p_corpus.add_argument("--repeat", type=int, default=1, help="repetições por arquivo (usa o menor tempo)")
+    p_corpus.add_argument("--json", help="grava os resultados neste arquivo JSON")
+    p_corpus.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+
+    p_resc = sub.add_parser("rescale", help="Tempo por imagem antes/depois da normalização de resolução")
+    p_resc.add_argument("alvo", help="imagem ou pasta de imagens")
+    p_resc.add_argument("--repeat", type=int, default=1, help="repetições por imagem (usa o menor tempo)")
+
+    p_stage = sub.add_parser("stage", help="Vazão do pool de OCR (OcrStage) por nº de workers")
+    p_stage.add_argument("pasta", help="pasta de comprovantes (ex.: gerada pelo gen_comprovantes.py)")
+    p_stage.add_argument("--workers", type=int, nargs="+", default=[max(1, (os.cpu_count() or 2) - 1)])
+
+    args = ap.parse_args()
+    if args.cmd == "corpus":
+        sys.exit(cmd_corpus(args))
+    elif args.cmd == "rescale":
+        sys.exit(cmd_rescale(args))
+    elif args.cmd == "stage":
+        sys.exit(cmd_stage(args))
+    else:
+        ap.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,18 @@
 # dedupe.py
 import os
+import zlib
 import hashlib
 import sqlite3
 from contextlib import closing
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Iterable, List, Optional, Tuple
 
 # ------------------------------------------------------------
 # Paths / DB
 # ------------------------------------------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-_DB = os.path.join(BASE_DIR, "ledger.sqlite3")
+# LEDGER_DB: ledger alternativo (ex.: benchmarks, para não misturar com o de produção)
+_DB = os.getenv("LEDGER_DB") or os.path.join(BASE_DIR, "ledger.sqlite3")
 
 
 # ------------------------------------------------------------
@@ -56,6 +58,32 @@ def _ensure_schema(con: sqlite3.Connection) -> None:
         );
         """
     )
+    # ocr_cache: resultado do OCR por hash do arquivo (evita refazer OCR em retries)
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ocr_cache (
+            hash TEXT PRIMARY KEY,
+            engine TEXT NOT NULL,
+            preproc TEXT,
+            texto_z BLOB,
+            tipo TEXT,
+            data_iso TEXT,
+            valor_centavos INTEGER,
+            created_at TEXT DEFAULT (datetime('now'))
+        );
+        """
+    )
+    # despesa_href: link /Despesa/Index visto no portal, por início do deslocamento
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS despesa_href (
+            inicio_iso TEXT PRIMARY KEY,
+            fim_iso TEXT,
+            href TEXT NOT NULL,
+            created_at TEXT DEFAULT (datetime('now'))
+        );
+        """
+    )
     # Índices úteis (no-ops se já existirem)
     con.execute(
         "CREATE INDEX IF NOT EXISTS idx_files_created_at ON processed_files(created_at);"
@@ -63,6 +91,12 @@ def _ensure_schema(con: sqlite3.Connection) -> None:
     con.execute(
         "CREATE INDEX IF NOT EXISTS idx_semantic_created_at ON processed_semantic(created_at);"
     )
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ocr_cache_created_at ON ocr_cache(created_at);"
+    )
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_despesa_href_created_at ON despesa_href(created_at);"
+    )
 
 
 # ------------------------------------------------------------
@@ -143,6 +177,11 @@ def already_done_semantic(tipo: str, data_dt: datetime, valor_centavos: int) ->
         return cur.fetchone() is not None
 
 
+def chave_semantica(tipo: str, data_dt: datetime, valor_centavos: int) -> str:
+    """Mesma identidade do dedupe semântico, como texto (ex.: trava de 'em andamento')."""
+    return f"{_norm_tipo(tipo)}|{_to_iso_min(data_dt)}|{int(valor_centavos or 0)}"
+
+
 def mark_done_semantic(tipo: str, data_dt: datetime, valor_centavos: int) -> None:
     iso_min = _to_iso_min(data_dt)
     with closing(_conn()) as con, con:
@@ -155,6 +194,136 @@ def mark_done_semantic(tipo: str, data_dt: datetime, valor_centavos: int) -> Non
         )
 
 
+# ------------------------------------------------------------
+# Cache de OCR (hash do arquivo -> texto + campos extraídos)
+# ------------------------------------------------------------
+def ocr_cache_get(hash_hex: str, engine: str) -> Optional[dict]:
+    """Retorna a entrada do cache se existir E tiver sido gerada pelo mesmo `engine`."""
+    with closing(_conn()) as con, con:
+        row = con.execute(
+            """
+            SELECT preproc, texto_z, tipo, data_iso, valor_centavos
+              FROM ocr_cache
+             WHERE hash = ? AND engine = ?
+             LIMIT 1
+            """,
+            (hash_hex, engine),
+        ).fetchone()
+    if row is None:
+        return None
+    preproc, texto_z, tipo, data_iso, valor_centavos = row
+    try:
+        texto = zlib.decompress(texto_z).decode("utf-8") if texto_z else ""
+    except Exception:
+        texto = ""
+    return {
+        "preproc": preproc or "",
+        "texto": texto,
+        "tipo": tipo or "desconhecido",
+        "data": datetime.fromisoformat(data_iso) if data_iso else None,
+        "valor_centavos": valor_centavos,
+    }
+
+
+def ocr_cache_put(
+    hash_hex: str,
+    engine: str,
+    preproc: str,
+    texto: str,
+    tipo: str,
+    data: Optional[datetime],
+    valor_centavos: Optional[int],
+) -> None:
+    with closing(_conn()) as con, con:
+        con.execute(
+            """
+            INSERT INTO ocr_cache (hash, engine, preproc, texto_z, tipo, data_iso, valor_centavos)
+            VALUES (?,?,?,?,?,?,?)
+            ON CONFLICT(hash) DO UPDATE SET
+              engine=excluded.engine,
+              preproc=excluded.preproc,
+              texto_z=excluded.texto_z,
+              tipo=excluded.tipo,
+              data_iso=excluded.data_iso,
+              valor_centavos=excluded.valor_centavos,
+              created_at=datetime('now')
+            """,
+            (
+                hash_hex,
+                engine,
+                preproc,
+                zlib.compress((texto or "").encode("utf-8"), 6),
+                _norm_tipo(tipo),
+                data.isoformat() if data else None,
+                int(valor_centavos) if valor_centavos is not None else None,
+            ),
+        )
+
+
+# ------------------------------------------------------------
+# Índice de hrefs de Despesa (por início do deslocamento)
+# ------------------------------------------------------------
+def _to_iso_seg(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat()
+
+
+def despesa_href_get(inicio: datetime) -> Optional[str]:
+    with closing(_conn()) as con, con:
+        row = con.execute(
+            "SELECT href FROM despesa_href WHERE inicio_iso = ? LIMIT 1",
+            (_to_iso_seg(inicio),),
+        ).fetchone()
+    return row[0] if row else None
+
+
+def despesa_href_put(itens: Iterable[Tuple[datetime, Optional[datetime], str]]) -> None:
+    """Grava (início, fim, href) de uma leitura da grade de uma vez só."""
+    linhas = [
+        (_to_iso_seg(ini), _to_iso_seg(fim) if fim else None, href)
+        for ini, fim, href in itens
+        if ini and href
+    ]
+    if not linhas:
+        return
+    with closing(_conn()) as con, con:
+        con.executemany(
+            """
+            INSERT INTO despesa_href (inicio_iso, fim_iso, href)
+            VALUES (?,?,?)
+            ON CONFLICT(inicio_iso) DO UPDATE SET
+              fim_iso=excluded.fim_iso,
+              href=excluded.href,
+              created_at=datetime('now')
+            """,
+            linhas,
+        )
+
+
+def despesa_href_recentes(limite: int = 50) -> List[Tuple[datetime, Optional[datetime], str]]:
+    """Últimos hrefs gravados, do mais antigo para o mais novo."""
+    with closing(_conn()) as con, con:
+        rows = con.execute(
+            """
+            SELECT inicio_iso, fim_iso, href
+              FROM despesa_href
+             ORDER BY datetime(created_at) DESC, inicio_iso DESC
+             LIMIT ?
+            """,
+            (int(limite),),
+        ).fetchall()
+    return [
+        (datetime.fromisoformat(ini), datetime.fromisoformat(fim) if fim else None, href)
+        for ini, fim, href in reversed(rows)
+    ]
+
+
+def despesa_href_esquecer(href: str) -> int:
+    """Apaga um href que não abriu a tela de despesas. Retorna qtd deletada."""
+    with closing(_conn()) as con, con:
+        cur = con.execute("DELETE FROM despesa_href WHERE href = ?", (href,))
+        return cur.rowcount or 0
+
+
 # ------------------------------------------------------------
 # Manutenção / inspeção (opcional)
 # ------------------------------------------------------------
@@ -184,6 +353,32 @@ def purge_old_semantic(days: int = 120) -> int:
         return cur.rowcount or 0
 
 
+def purge_old_ocr_cache(days: int = 120) -> int:
+    """Apaga entradas antigas de ocr_cache (por created_at). Retorna qtd deletada."""
+    with closing(_conn()) as con, con:
+        cur = con.execute(
+            """
+            DELETE FROM ocr_cache
+             WHERE datetime(created_at) < datetime('now', ?)
+            """,
+            (f"-{int(days)} days",),
+        )
+        return cur.rowcount or 0
+
+
+def purge_old_despesa_href(days: int = 120) -> int:
+    """Apaga hrefs de Despesa antigos (por created_at). Retorna qtd deletada."""
+    with closing(_conn()) as con, con:
+        cur = con.execute(
+            """
+            DELETE FROM despesa_href
+             WHERE datetime(created_at) < datetime('now', ?)
+            """,
+            (f"-{int(days)} days",),
+        )
+        return cur.rowcount or 0
+
+
 def count_files() -> int:
     with closing(_conn()) as con, con:
         cur = con.execute("SELECT COUNT(1) FROM processed_files")
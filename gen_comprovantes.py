@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# gen_comprovantes.py
+"""
+Gerador de comprovantes sintéticos (pedágio / estacionamento) para teste de carga.
+
+Desenha com PIL um comprovante por arquivo, nos layouts dos emissores que o
+ocr_utils conhece (Veloe, Sem Parar, Mercado Pago, Sigapay, Estapar...), com
+tipo/data/valor conhecidos, e grava junto um gabarito.json no formato do
+`bench_ocr.py corpus`. Ruído, rotação, desfoque e resolução são controláveis.
+
+Uso:
+    python gen_comprovantes.py corpus_sintetico/ -n 300 --ruido 12 --rotacao 3 --blur 0.6
+    python bench_ocr.py corpus corpus_sintetico/
+
+    # fim de mês no watcher (CUIDADO: o watcher vai tentar lançar no portal!)
+    python gen_comprovantes.py comprovantes/ -n 200 --intervalo 0.2
+
+As datas ficam dentro da janela aceita pelo watcher (mês corrente/anterior, nunca
+no futuro). Cada arquivo é gravado num temporário e renomeado no fim, para o
+watcher nunca ver imagem pela metade.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+_GABARITO = "gabarito.json"
+_FONTES = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationMono-Regular.ttf",
+    "C:/Windows/Fonts/consola.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+)
+
+_PRACAS = ("Campo Limpo", "Itupeva", "Valinhos", "Jundiaí", "Sumaré", "Nova Odessa", "Limeira")
+_RUAS = ("R. XV de Novembro", "Av. Paulista", "R. Barão de Jaguara", "Av. Brasil", "R. Dr. Quirino")
+
+
+def _placa(rng: random.Random) -> str:
+    L = "ABCDEFGHJKLMNPRSTUVWXYZ"
+    return f"{''.join(rng.choice(L) for _ in range(3))}{rng.randint(0, 9)}{rng.choice(L)}{rng.randint(10, 99)}"
+
+
+def _brl(centavos: int) -> str:
+    inteiro = f"{centavos // 100:,}".replace(",", ".")
+    return f"R$ {inteiro},{centavos % 100:02d}"
+
+
+def _dt(d: datetime, seg: bool = False, ano2: bool = False) -> str:
+    ano = f"{d.year % 100:02d}" if ano2 else f"{d.year}"
+    hora = d.strftime("%H:%M:%S" if seg else "%H:%M")
+    return f"{d.day:02d}/{d.month:02d}/{ano} {hora}"
+
+
+# -------------------------------
+# Layouts por emissor
+# -------------------------------
+# Cada layout recebe (data do evento, valor em centavos, rng) e devolve as linhas
+# do comprovante. A data/valor do gabarito é SEMPRE a que o parser deve achar
+# (ex.: Mercado Pago = data da passagem, não a do pagamento; Sigapay = Início).
+Layout = Callable[[datetime, int, random.Random], List[str]]
+
+
+def _veloe(d, v, rng):
+    return [
+        "veloe",
+        "Comprovante de passagem",
+        "",
+        f"Praça: {rng.choice(_PRACAS)}",
+        f"Placa: {_placa(rng)}   Categoria: 1",
+        f"Data: {_dt(d, seg=True)}",
+        f"Valor: {_brl(v)}",
+    ]
+
+
+def _sem_parar(d, v, rng):
+    return [
+        "SEM PARAR",
+        "Extrato de utilização - Pedágio",
+        f"Placa {_placa(rng)}",
+        "",
+        f"{_dt(d, ano2=True)}  Praça {rng.choice(_PRACAS)}",
+        f"Tarifa {_brl(v)}",
+    ]
+
+
+def _concessionaria(nome: str) -> Layout:
+    def _layout(d, v, rng):
+        return [
+            nome,
+            "Cupom fiscal - Pedágio",
+            f"Praça {rng.choice(_PRACAS)}  Pista {rng.randint(1, 12)}",
+            f"Cat. 1  Placa {_placa(rng)}",
+            f"{_dt(d, seg=True)}",
+            f"Total {_brl(v)}",
+            "Obrigado e boa viagem",
+        ]
+    return _layout
+
+
+def _mercado_pago(d, v, rng):
+    pago = min(d + timedelta(minutes=rng.randint(5, 600)), datetime.now())
+    return [
+        "mercado pago",
+        "Pagamento de pedágio",
+        "",
+        f"Pago em {pago.day:02d}/{pago.month:02d} às {pago:%H:%M}",
+        "",
+        "Data da passagem",
+        f"{d.day:02d}/{d.month:02d}/{d.year} - {d:%H:%M}",
+        f"Praça {rng.choice(_PRACAS)}",
+        f"Total {_brl(v)}",
+    ]
+
+
+def _sigapay(d, v, rng):
+    fim = d + timedelta(minutes=rng.choice((30, 60, 120)))
+    return [
+        "SigaPay",
+        "Estacionamento Rotativo",
+        f"Placa: {_placa(rng)}",
+        f"Início: {_dt(d)}",
+        f"Término: {_dt(fim)}",
+        f"Valor pago: {_brl(v)}",
+    ]
+
+
+def _estapar(d, v, rng):
+    saida = d + timedelta(minutes=rng.randint(15, 240))
+    return [
+        "ESTAPAR",
+        f"{rng.choice(_RUAS)}, {rng.randint(10, 2000)}",
+        f"Ticket {rng.randint(100000, 999999)}",
+        f"Entrada {_dt(d)}",
+        f"Saída   {_dt(saida)}",
+        f"Total {_brl(v)}",
+    ]
+
+
+def _zona_azul(d, v, rng):
+    return [
+        "Zona Azul Digital",
+        f"Placa {_placa(rng)}",
+        f"Ativado em {_dt(d)}",
+        f"Validade: {rng.choice((1, 2))}h",
+        f"Valor {_brl(v)}",
+    ]
+
+
+def _zul(d, v, rng):
+    return [
+        "Zul+",
+        "Estacionamento",
+        f"{rng.choice(_RUAS)}",
+        f"{_dt(d)}",
+        f"Valor {_brl(v)}",
+    ]
+
+
+def _vaga_legal(d, v, rng):
+    return [
+        "Vaga Legal",
+        "Comprovante de ativação",
+        f"Placa: {_placa(rng)}",
+        f"Data/hora: {_dt(d)}",
+        f"Total pago: {_brl(v)}",
+    ]
+
+
+# nome -> (tipo esperado, layout, faixa de valor em centavos)
+_LAYOUTS: Dict[str, Tuple[str, Layout, Tuple[int, int]]] = {
+    "veloe": ("pedagio", _veloe, (320, 2800)),
+    "sem_parar": ("pedagio", _sem_parar, (320, 2800)),
+    "autoban": ("pedagio", _concessionaria("CCR AutoBAn"), (450, 1900)),
+    "ccr": ("pedagio", _concessionaria("CCR ViaOeste"), (450, 1900)),
+    "rota_das_bandeiras": ("pedagio", _concessionaria("Rota das Bandeiras"), (450, 1900)),
+    "renovias": ("pedagio", _concessionaria("Renovias"), (450, 1900)),
+    "mercado_pago": ("pedagio", _mercado_pago, (320, 2800)),
+    "sigapay": ("estacionamento", _sigapay, (90, 1200)),
+    "estapar": ("estacionamento", _estapar, (800, 6000)),
+    "zona_azul": ("estacionamento", _zona_azul, (90, 900)),
+    "zul": ("estacionamento", _zul, (90, 900)),
+    "vaga_legal": ("estacionamento", _vaga_legal, (90, 900)),
+}
+
+
+# -------------------------------
+# Renderização
+# -------------------------------
+def _fonte(tamanho: int):
+    for caminho in _FONTES:
+        if os.path.exists(caminho):
+            return ImageFont.truetype(caminho, tamanho)
+    return ImageFont.load_default(size=tamanho)
+
+
+def _data_aleatoria(rng: random.Random) -> datetime:
+    """Algum momento entre o início do mês anterior e 1h atrás (janela do watcher)."""
+    agora = datetime.now().replace(second=0, microsecond=0)
+    ini = (agora.replace(day=1) - timedelta(days=1)).replace(day=1, hour=0, minute=0)
+    fim = agora - timedelta(hours=1)
+    minutos = max(0, int((fim - ini).total_seconds() // 60))
+    return ini + timedelta(minutes=rng.randint(0, minutos))
+
+
+def renderizar(
+    linhas: List[str],
+    rng: random.Random,
+    largura: int = 900,
+    ruido: float = 0.0,
+    rotacao: float = 0.0,
+    blur: float = 0.0,
+) -> Image.Image:
+    """
+    Desenha as linhas num papel branco de `largura` px (a fonte acompanha a largura)
+    e aplica as degradações: rotação até ±`rotacao` graus, desfoque gaussiano de raio
+    `blur` e ruído gaussiano de desvio `ruido` (0-255).
+    """
+    tam = max(8, largura // 32)
+    fonte = _fonte(tam)
+    passo = int(tam * 1.6)
+    margem = tam * 2
+    altura = margem * 2 + passo * len(linhas)
+
+    img = Image.new("L", (largura, altura), 255)
+    draw = ImageDraw.Draw(img)
+    for i, ln in enumerate(linhas):
+        draw.text((margem, margem + i * passo), ln, fill=rng.randint(0, 40), font=fonte)
+
+    if rotacao:
+        ang = rng.uniform(-rotacao, rotacao)
+        img = img.rotate(ang, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    if blur:
+        img = img.filter(ImageFilter.GaussianBlur(blur))
+    if ruido:
+        ruido_img = Image.effect_noise(img.size, ruido)
+        # effect_noise é centrado em 128: soma o desvio ao papel
+        img = Image.eval(Image.blend(img, ruido_img, 0.5), lambda p: min(255, max(0, 2 * p - 128)))
+    return img
+
+
+def _gravar(img: Image.Image, destino: str, formato: str) -> None:
+    tmp = destino + ".part"
+    if formato == "jpg":
+        img.convert("RGB").save(tmp, format="JPEG", quality=85)
+    else:
+        img.save(tmp, format="PNG")
+    os.replace(tmp, destino)
+
+
+def _carregar_gabarito(pasta: str) -> List[dict]:
+    caminho = os.path.join(pasta, _GABARITO)
+    if not os.path.exists(caminho):
+        return []
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _salvar_gabarito(pasta: str, itens: List[dict]) -> None:
+    caminho = os.path.join(pasta, _GABARITO)
+    with open(caminho + ".part", "w", encoding="utf-8") as f:
+        json.dump(itens, f, ensure_ascii=False, indent=1)
+    os.replace(caminho + ".part", caminho)
+
+
+def _checar_texto(linhas: List[str], tipo: str, data: datetime, valor: int) -> Optional[str]:
+    """Passa o TEXTO do layout pelos parsers (sem OCR). Divergência = layout ou parser mudou."""
+    import ocr_utils
+    ext = ocr_utils._extrair_de_texto("\n".join(linhas), "texto")
+    erros = []
+    if ext.tipo != tipo:
+        erros.append(f"tipo={ext.tipo}")
+    if ext.data is None or ext.data.replace(second=0) != data:
+        erros.append(f"data={ext.data}")
+    if ext.valor_centavos != valor:
+        erros.append(f"valor={ext.valor_centavos}")
+    return ", ".join(erros) or None
+
+
+# -------------------------------
+# CLI
+# -------------------------------
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Gera comprovantes sintéticos + gabarito.json")
+    ap.add_argument("pasta", help="destino (ex.: corpus_sintetico/ ou comprovantes/)")
+    ap.add_argument("-n", type=int, default=50, help="quantidade de comprovantes")
+    ap.add_argument("--emissores", nargs="+", choices=sorted(_LAYOUTS), help="padrão: todos, em rodízio")
+    ap.add_argument("--seed", type=int, default=None, help="semente (repetível)")
+    ap.add_argument("--largura", type=int, default=900, help="largura em px (resolução)")
+    ap.add_argument("--ruido", type=float, default=0.0, help="desvio do ruído gaussiano (0-255)")
+    ap.add_argument("--rotacao", type=float, default=0.0, help="rotação máxima em graus (±)")
+    ap.add_argument("--blur", type=float, default=0.0, help="raio do desfoque gaussiano")
+    ap.add_argument("--formato", choices=("jpg", "png"), default="jpg")
+    ap.add_argument("--intervalo", type=float, default=0.0, help="segundos entre arquivos (chegada gradual)")
+    ap.add_argument("--checar", action="store_true", help="valida o texto de cada layout nos parsers (sem OCR)")
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    os.makedirs(args.pasta, exist_ok=True)
+    nomes = args.emissores or sorted(_LAYOUTS)
+    gabarito = _carregar_gabarito(args.pasta)
+    prefixo = datetime.now().strftime("sint_%Y%m%d_%H%M%S")
+    divergentes = 0
+
+    for i in range(args.n):
+        nome = nomes[i % len(nomes)]
+        tipo, layout, (vmin, vmax) = _LAYOUTS[nome]
+        data = _data_aleatoria(rng)
+        valor = rng.randint(vmin, vmax)
+        linhas = layout(data, valor, rng)
+
+        if args.checar:
+            erro = _checar_texto(linhas, tipo, data, valor)
+            if erro:
+                divergentes += 1
+                print(f"[{nome}] parser divergiu do gabarito: {erro}", file=sys.stderr)
+
+        img = renderizar(linhas, rng, args.largura, args.ruido, args.rotacao, args.blur)
+        arquivo = f"{prefixo}_{i:04d}_{nome}.{args.formato}"
+        _gravar(img, os.path.join(args.pasta, arquivo), args.formato)
+        gabarito.append({
+            "arquivo": arquivo,
+            "emissor": nome,
+            "tipo": tipo,
+            "data": data.isoformat(timespec="minutes"),
+            "valor_centavos": valor,
+        })
+        if args.intervalo:
+            time.sleep(args.intervalo)
+
+    _salvar_gabarito(args.pasta, gabarito)
+    print(f"{args.n} comprovante(s) em {args.pasta} ({len(gabarito)} no {_GABARITO}).")
+    if divergentes:
+        print(f"{divergentes} layout(s) com texto que o parser não lê como o gabarito.")
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,7 @@ import argparse
 from datetime import datetime
 from typing import Optional
 
-from dedupe import _conn, purge_old_files, purge_old_semantic  # usa a conexão do módulo
+from dedupe import _conn, purge_old_files, purge_old_semantic, purge_old_ocr_cache, purge_old_despesa_href  # usa a conexão do módulo
 
 try:
     from tabulate import tabulate
@@ -162,8 +162,15 @@ def stats():
         last_s = con.execute(
             "SELECT IFNULL(MAX(datetime(created_at)), '-') FROM processed_semantic"
         ).fetchone()[0]
+        o = con.execute("SELECT COUNT(1) FROM ocr_cache").fetchone()[0]
+        last_o = con.execute(
+            "SELECT IFNULL(MAX(datetime(created_at)), '-') FROM ocr_cache"
+        ).fetchone()[0]
+        h = con.execute("SELECT COUNT(1) FROM despesa_href").fetchone()[0]
     print("processed_files:", f, "| last:", last_f)
     print("processed_semantic:", s, "| last:", last_s)
+    print("ocr_cache:", o, "| last:", last_o)
+    print("despesa_href:", h)
 
 
 def vacuum():
@@ -179,13 +186,19 @@ def purge(days: int, which: str):
     if which in ("semantic", "all"):
         n = purge_old_semantic(days)
         print(f"processed_semantic: {n} registro(s) antigos removidos (> {days}d).")
+    if which in ("ocr", "all"):
+        n = purge_old_ocr_cache(days)
+        print(f"ocr_cache: {n} registro(s) antigos removidos (> {days}d).")
+    if which in ("href", "all"):
+        n = purge_old_despesa_href(days)
+        print(f"despesa_href: {n} registro(s) antigos removidos (> {days}d).")
 
 
 # -----------------------------
 # CLI
 # -----------------------------
 def main():
-    ap = argparse.ArgumentParser(description="Gerencia o ledger (processed_files / processed_semantic)")
+    ap = argparse.ArgumentParser(description="Gerencia o ledger (processed_files / processed_semantic / ocr_cache / despesa_href)")
     sub = ap.add_subparsers(dest="cmd")
 
     # listagens
@@ -217,7 +230,7 @@ def main():
 
     p_purge = sub.add_parser("purge", help="Remove registros antigos")
     p_purge.add_argument("--days", type=int, default=180)
-    p_purge.add_argument("--which", choices=["files", "semantic", "all"], default="all")
+    p_purge.add_argument("--which", choices=["files", "semantic", "ocr", "href", "all"], default="all")
 
     args = ap.parse_args()
 
@@ -0,0 +1,237 @@
+# matching.py
+"""
+Casamento comprovante x deslocamento, sem Selenium.
+
+  - Segmento          : uma linha da grade de Deslocamentos (início, fim, href...)
+  - escolher(...)     : as regras, em varredura linear — é a especificação
+  - IndiceSegmentos   : mesmo resultado de escolher(), em O(log n) por consulta,
+                        e casamento de um lote de comprovantes contra o mês carregado
+
+Regras (segmentos ordenados por início):
+  pedágio        -> segmento que contém o evento (o mais curto, se houver sobreposição)
+  estacionamento -> 1º segmento em que o evento cai: dentro dele; OU de
+                    fim - pre_slack até fim + post_slack; OU entre o fim dele e o
+                    início do próximo (o último pega tudo depois do fim)
+
+Como o índice funciona: cada segmento vira 1-3 faixas de tempo (com a prioridade
+da regra) e todo início/fim de faixa vira um ponto de corte. Entre dois cortes
+consecutivos nenhuma regra muda de resposta; uma varredura com heap calcula a
+resposta de cada trecho (O(n log n), na 1ª consulta) e a consulta vira um bisect.
+O __main__ confere o índice contra escolher() em meses aleatórios.
+"""
+import time
+import heapq
+import random
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+PRE_SLACK_PADRAO = 900     # 15 min antes do fim
+POST_SLACK_PADRAO = 300    # 5  min depois do fim
+
+
+@dataclass
+class Segmento:
+    ini: datetime
+    fim: datetime
+    idx: int = 0                    # posição da linha na grade (após carregar tudo)
+    chave: str = ""                 # identidade da linha — confere se ainda é a mesma
+    href: Optional[str] = None      # /Despesa/Index da linha, quando já conhecido
+
+
+def _regra(tipo: str) -> str:
+    return "pedagio" if "pedag" in (tipo or "").lower() else "estacionamento"
+
+
+# -------------------------------
+# Regra linear (especificação)
+# -------------------------------
+def escolher(
+    segmentos: Sequence[Segmento],
+    dt_evento: datetime,
+    tipo: str,
+    pre_slack: int = PRE_SLACK_PADRAO,
+    post_slack: int = POST_SLACK_PADRAO,
+) -> Optional[Segmento]:
+    """Regras de casamento evento x deslocamento (segmentos ordenados por início)."""
+    # — Pedágio: dentro da janela do deslocamento (o mais curto, se houver sobreposição)
+    if _regra(tipo) == "pedagio":
+        candidatos = [sg for sg in segmentos if sg.ini <= dt_evento <= sg.fim]
+        if not candidatos:
+            return None
+        return min(candidatos, key=lambda sg: (sg.fim - sg.ini).total_seconds())
+
+    # — Estacionamento: tolerância configurável ao redor do fim
+    for i, sg in enumerate(segmentos):
+        # caiu dentro do deslocamento
+        if sg.ini <= dt_evento <= sg.fim:
+            return sg
+        # janela de tolerância em torno do fim
+        if (sg.fim - timedelta(seconds=pre_slack)) <= dt_evento <= (sg.fim + timedelta(seconds=post_slack)):
+            return sg
+        # regra “entre fim atual e início do próximo”
+        prox_ini = segmentos[i + 1].ini if i + 1 < len(segmentos) else None
+        if prox_ini:
+            if sg.fim <= dt_evento < prox_ini:
+                return sg
+        elif dt_evento >= sg.fim:
+            return sg
+    return None
+
+
+# -------------------------------
+# Índice (bisect sobre trechos)
+# -------------------------------
+class _Tabela:
+    """Resposta pré-calculada por trecho: pontos de corte + resposta em cada corte e entre cortes."""
+
+    def __init__(self, cortes: List[datetime], nos_cortes: List[Optional[int]], entre: List[Optional[int]]):
+        self.cortes = cortes            # ordenados, sem repetição
+        self.nos_cortes = nos_cortes    # len = len(cortes)
+        self.entre = entre              # len = len(cortes) + 1: antes do 1º, entre cada par, depois do último
+
+    def consultar(self, t: datetime) -> Optional[int]:
+        j = bisect_left(self.cortes, t)
+        if j < len(self.cortes) and self.cortes[j] == t:
+            return self.nos_cortes[j]
+        return self.entre[j]
+
+
+class IndiceSegmentos:
+    """
+    Segmentos de UM mês, indexados para consulta em O(log n).
+
+      idx = IndiceSegmentos(segmentos, pre_slack, post_slack)
+      idx.escolher(dt, "pedagio")                  -> Segmento | None
+      idx.escolher_lote([(dt1, tipo1), ...])       -> [Segmento | None, ...]
+    """
+
+    def __init__(
+        self,
+        segmentos: Iterable[Segmento],
+        pre_slack: int = PRE_SLACK_PADRAO,
+        post_slack: int = POST_SLACK_PADRAO,
+    ):
+        self.segmentos: List[Segmento] = sorted(segmentos, key=lambda sg: sg.ini)
+        self.pre_slack = int(pre_slack)
+        self.post_slack = int(post_slack)
+        self._tabelas: Dict[str, _Tabela] = {}   # por regra, montadas na 1ª consulta
+
+    def __len__(self) -> int:
+        return len(self.segmentos)
+
+    def _faixas(self, regra: str) -> List[Tuple[tuple, datetime, Optional[datetime], bool, int]]:
+        """Cada segmento vira 1-3 faixas de tempo: (prioridade, de, até|None=∞, até_inclusivo, posição)."""
+        pre, post = timedelta(seconds=self.pre_slack), timedelta(seconds=self.post_slack)
+        out = []
+        segs = self.segmentos
+        for i, sg in enumerate(segs):
+            if regra == "pedagio":
+                # o mais curto vence; empate -> o que começa antes
+                out.append((((sg.fim - sg.ini).total_seconds(), i), sg.ini, sg.fim, True, i))
+                continue
+            # estacionamento: o 1º segmento (por início) cujas faixas contêm o evento
+            out.append(((i,), sg.ini, sg.fim, True, i))
+            out.append(((i,), sg.fim - pre, sg.fim + post, True, i))
+            if i + 1 < len(segs):
+                out.append(((i,), sg.fim, segs[i + 1].ini, False, i))
+            else:
+                out.append(((i,), sg.fim, None, False, i))
+        return out
+
+    def _tabela(self, regra: str) -> _Tabela:
+        """
+        Varre a linha do tempo uma vez (heap com remoção preguiçosa): O(n log n).
+        Trechos em sequência: [antes do 1º corte, 1º corte, entre 1º e 2º, 2º corte, ...]
+        -> o trecho 2j+1 é o corte j, o trecho 2j é o intervalo aberto antes dele.
+        """
+        tab = self._tabelas.get(regra)
+        if tab is not None:
+            return tab
+
+        faixas = [f for f in self._faixas(regra) if f[2] is None or f[1] <= f[2]]
+        cortes = sorted({f[1] for f in faixas} | {f[2] for f in faixas if f[2] is not None})
+        pos = {c: j for j, c in enumerate(cortes)}
+        n_trechos = 2 * len(cortes) + 1
+
+        comecam: List[list] = [[] for _ in range(n_trechos)]
+        for prio, de, ate, inclusivo, i in faixas:
+            t0 = 2 * pos[de] + 1
+            t1 = n_trechos - 1 if ate is None else 2 * pos[ate] + (1 if inclusivo else 0)
+            if t0 <= t1:
+                comecam[t0].append((prio, t1, i))
+
+        resposta: List[Optional[int]] = [None] * n_trechos
+        ativos: list = []
+        for t in range(n_trechos):
+            for item in comecam[t]:
+                heapq.heappush(ativos, item)
+            while ativos and ativos[0][1] < t:
+                heapq.heappop(ativos)
+            if ativos:
+                resposta[t] = ativos[0][2]
+
+        tab = _Tabela(cortes, resposta[1::2], resposta[0::2])
+        self._tabelas[regra] = tab
+        return tab
+
+    def escolher(self, dt_evento: datetime, tipo: str) -> Optional[Segmento]:
+        if not self.segmentos or dt_evento is None:
+            return None
+        i = self._tabela(_regra(tipo)).consultar(dt_evento)
+        return None if i is None else self.segmentos[i]
+
+    def escolher_lote(self, eventos: Iterable[Tuple[datetime, str]]) -> List[Optional[Segmento]]:
+        """Vários comprovantes contra o mesmo mês: tabelas montadas uma vez, um bisect por evento."""
+        return [self.escolher(dt, tipo) for dt, tipo in eventos]
+
+
+# -------------------------------
+# Auto-verificação / benchmark rápido (sem navegador)
+# -------------------------------
+def _mes_aleatorio(rng: random.Random, n: int, inicio: datetime) -> List[Segmento]:
+    """n deslocamentos no mês, em geral sem sobreposição (às vezes com), como na grade real."""
+    segs, t = [], inicio
+    for i in range(n):
+        t += timedelta(minutes=rng.randint(20, 600))
+        dur = timedelta(minutes=rng.randint(10, 300))
+        ini = t - timedelta(minutes=rng.randint(0, 60)) if rng.random() < 0.1 else t
+        segs.append(Segmento(ini, ini + dur, idx=i, chave=f"{i}"))
+        t = ini + dur
+    rng.shuffle(segs)
+    return segs
+
+
+if __name__ == "__main__":
+    import sys
+    rng = random.Random(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    base = datetime(2025, 10, 1)
+    total, t_lin, t_idx = 0, 0.0, 0.0
+    for rodada in range(50):
+        segs = sorted(_mes_aleatorio(rng, rng.randint(1, 80), base), key=lambda sg: sg.ini)
+        pre, post = rng.choice((0, 300, 900)), rng.choice((0, 300))
+        indice = IndiceSegmentos(segs, pre, post)
+        fim = max(sg.fim for sg in segs) + timedelta(hours=2)
+        eventos = []
+        for _ in range(300):
+            if rng.random() < 0.3:   # exatamente num início/fim (bordas)
+                sg = rng.choice(segs)
+                dt = rng.choice((sg.ini, sg.fim, sg.fim - timedelta(seconds=pre), sg.fim + timedelta(seconds=post)))
+            else:
+                dt = base + timedelta(seconds=rng.randint(0, int((fim - base).total_seconds())))
+            eventos.append((dt, rng.choice(("pedagio", "estacionamento"))))
+
+        t0 = time.perf_counter()
+        esperado = [escolher(segs, dt, tp, pre, post) for dt, tp in eventos]
+        t1 = time.perf_counter()
+        obtido = indice.escolher_lote(eventos)
+        t2 = time.perf_counter()
+        t_lin += t1 - t0
+        t_idx += t2 - t1
+        for (dt, tp), a, b in zip(eventos, esperado, obtido):
+            if a is not b:
+                print(f"DIVERGÊNCIA rodada={rodada} {tp} {dt}: linear={a} índice={b}")
+                sys.exit(1)
+        total += len(eventos)
+    print(f"{total} eventos conferidos: linear {t_lin * 1e3:.0f} ms | índice (com montagem) {t_idx * 1e3:.0f} ms")
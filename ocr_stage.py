@@ -0,0 +1,228 @@
+# ocr_stage.py
+"""
+Etapa de OCR desacoplada do loop Selenium.
+
+O watcher entrega caminhos de `comprovantes/` para um pool de processos; cada
+worker espera o arquivo assentar, calcula o hash, checa o ledger e roda o OCR
+(ou reaproveita o ocr_cache do ledger, se aquele mesmo arquivo já passou por aqui).
+O loop principal só recolhe os resultados prontos e segue para o portal, então
+o Firefox nunca fica parado esperando o tesseract (e os outros núcleos do Pi
+trabalham em paralelo).
+"""
+import os
+import time
+import signal
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from ocr_utils import DadosComprovante, ExtracaoOCR, engine_id, extrair_ocr, marcar_sob_deadline
+from dedupe import file_hash, already_done, ocr_cache_get, ocr_cache_put
+
+
+# -------------------------------
+# Modelo de resultado
+# -------------------------------
+@dataclass
+class ResultadoOCR:
+    path: str
+    status: str                              # "ok" | "instavel" | "ja_processado" | "erro" | "timeout"
+    hash: Optional[str] = None
+    dados: Optional[DadosComprovante] = None
+    erro: Optional[str] = None
+    segundos: float = 0.0
+    cache: bool = False                      # True = veio do ocr_cache (sem tesseract)
+
+
+# -------------------------------
+# Job (roda dentro do worker)
+# -------------------------------
+def _wait_until_stable(p: Path, attempts: int = 6, interval: float = 0.5) -> bool:
+    """
+    Aguarda o arquivo “assentar” (ex.: Syncthing ainda gravando).
+    True = estável; False = ainda variando ou sumiu.
+    """
+    try:
+        prev = (p.stat().st_size, p.stat().st_mtime_ns)
+    except FileNotFoundError:
+        return False
+    for _ in range(attempts):
+        time.sleep(interval)
+        try:
+            cur = (p.stat().st_size, p.stat().st_mtime_ns)
+        except FileNotFoundError:
+            return False
+        if cur == prev:
+            return True
+        prev = cur
+    return False
+
+
+def _ocr_com_cache(path: str, h: str) -> Tuple[ExtracaoOCR, bool]:
+    """Consulta o ocr_cache do ledger pelo hash; em miss roda o OCR e grava."""
+    eng = engine_id()
+    try:
+        hit = ocr_cache_get(h, eng)
+    except Exception as e:
+        logging.warning(f"[ocr] Cache ilegível ({e}); refazendo OCR.")
+        hit = None
+    if hit is not None:
+        return ExtracaoOCR(
+            tipo=hit["tipo"], data=hit["data"], valor_centavos=hit["valor_centavos"],
+            texto=hit["texto"], preproc=hit["preproc"],
+        ), True
+
+    ext = extrair_ocr(path)
+    try:
+        ocr_cache_put(h, eng, ext.preproc, ext.texto, ext.tipo, ext.data, ext.valor_centavos)
+    except Exception as e:
+        logging.warning(f"[ocr] Falha ao gravar cache de OCR: {e}")
+    return ext, False
+
+
+def ocr_job(path: str, aguardar_estavel: bool = True) -> ResultadoOCR:
+    """Debounce + hash + dedupe físico + OCR (com cache) de UM arquivo. Nunca levanta exceção."""
+    t0 = time.monotonic()
+    if aguardar_estavel and not _wait_until_stable(Path(path)):
+        return ResultadoOCR(path, "instavel")
+    try:
+        h = file_hash(path)
+        if already_done(h):
+            return ResultadoOCR(path, "ja_processado", hash=h, segundos=time.monotonic() - t0)
+        ext, do_cache = _ocr_com_cache(path, h)
+        return ResultadoOCR(path, "ok", hash=h, dados=ext.para_dados(),
+                            segundos=time.monotonic() - t0, cache=do_cache)
+    except Exception as e:
+        return ResultadoOCR(path, "erro", erro=f"{type(e).__name__}: {e}", segundos=time.monotonic() - t0)
+
+
+def _init_worker():
+    marcar_sob_deadline()   # o OcrStage mata o worker que estourar o deadline
+    # grupo de processos próprio: ao reciclar o pool, matamos o worker E o tesseract filho
+    if hasattr(os, "setpgrp"):
+        try:
+            os.setpgrp()
+        except Exception:
+            pass
+
+
+# -------------------------------
+# Pool
+# -------------------------------
+class OcrStage:
+    """
+    Pool de OCR com `workers` processos.
+
+      - submit(path)      -> agenda (ignora se já pendente)
+      - concluidos()      -> lista de ResultadoOCR prontos (não bloqueia)
+      - pendentes         -> quantidade em andamento
+
+    `deadline` (s) é o limite por imagem visto de fora do worker: se estourar,
+    o pool é reciclado (workers mortos) e os demais jobs são reagendados.
+    O timeout fino de cada chamada ao tesseract fica em OCR_TIMEOUT_SEC (ocr_utils).
+
+    Só há no executor um job por worker (o resto espera na fila daqui): o
+    ProcessPoolExecutor marca como "running" também o que está só na fila de
+    chamadas dele, então o relógio do deadline começa quando o job é entregue —
+    com um worker livre para ele —, não quando foi agendado.
+    """
+
+    def __init__(self, workers: int, deadline: float = 180.0):
+        self.workers = max(1, int(workers))
+        self.deadline = float(deadline)
+        self._ex: Optional[ProcessPoolExecutor] = None
+        self._fila: Deque[str] = deque()           # agendados, ainda fora do executor
+        # path -> [future, instante em que foi entregue a um worker livre]
+        self._pend: Dict[str, List] = {}
+
+    @property
+    def pendentes(self) -> int:
+        return len(self._pend) + len(self._fila)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._ex is None:
+            # spawn: o processo principal pode ter threads/driver vivos; fork seria arriscado
+            self._ex = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            logging.info(f"[ocr] Pool iniciado com {self.workers} worker(s).")
+        return self._ex
+
+    def submit(self, path: str) -> None:
+        if path in self._pend or path in self._fila:
+            return
+        self._fila.append(path)
+        self._alimentar()
+
+    def _alimentar(self) -> None:
+        """Entrega jobs da fila enquanto houver worker livre."""
+        while self._fila and len(self._pend) < self.workers:
+            path = self._fila.popleft()
+            try:
+                fut = self._executor().submit(ocr_job, path)
+            except BrokenProcessPool:
+                self._ex = None
+                fut = self._executor().submit(ocr_job, path)
+            self._pend[path] = [fut, time.monotonic()]
+
+    def concluidos(self) -> List[ResultadoOCR]:
+        out: List[ResultadoOCR] = []
+        agora = time.monotonic()
+        estourados = []
+        quebrado = False
+
+        for path, (fut, t0) in list(self._pend.items()):
+            if fut.done():
+                self._pend.pop(path, None)
+                try:
+                    out.append(fut.result())
+                except Exception as e:
+                    # worker morreu (OOM, sinal...): o arquivo vai para 'falhos' e o pool é refeito
+                    logging.warning(f"[ocr] Worker caiu processando {path}: {e}")
+                    out.append(ResultadoOCR(path, "erro", erro=f"{type(e).__name__}: {e}"))
+                    quebrado = quebrado or isinstance(e, BrokenProcessPool)
+            elif (agora - t0) > self.deadline:
+                estourados.append(path)
+
+        for path in estourados:
+            self._pend.pop(path, None)
+            logging.error(f"[ocr] Timeout ({self.deadline:.0f}s) no OCR de {path} — matando workers.")
+            out.append(ResultadoOCR(path, "timeout", erro="timeout", segundos=self.deadline))
+        if estourados or quebrado:
+            self._reciclar()
+        self._alimentar()
+        return out
+
+    def _reciclar(self) -> None:
+        """Mata os workers (e seus tesseract) e reagenda o que estava pendente."""
+        ex, self._ex = self._ex, None
+        if ex is not None:
+            procs = list((getattr(ex, "_processes", None) or {}).values())
+            ex.shutdown(wait=False, cancel_futures=True)
+            for p in procs:
+                try:
+                    if hasattr(os, "killpg"):
+                        os.killpg(p.pid, signal.SIGKILL)
+                    else:
+                        p.terminate()
+                except Exception:
+                    pass
+
+        # os que estavam no executor voltam para a frente da fila, na mesma ordem
+        self._fila.extendleft(reversed(list(self._pend.keys())))
+        self._pend.clear()
+        self._alimentar()
+
+    def close(self) -> None:
+        if self._ex is not None:
+            self._ex.shutdown(wait=False, cancel_futures=True)
+            self._ex = None
+        self._pend.clear()
+        self._fila.clear()
@@ -1,20 +1,44 @@
 # ocr_utils.py
+import io
 import os
 import re
 import logging
+import threading
+import subprocess
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, List, Tuple
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 
-from PIL import Image, ImageOps, ImageFilter
+from PIL import Image, ImageOps, ImageFilter, ImageStat
 import pytesseract
 
+from artifacts import salvar_artefato
+
 try:
     import cv2  # opcional
     _HAS_CV2 = True
 except Exception:
     _HAS_CV2 = False
 
+try:
+    import numpy as np  # opcional (pré-processamento vetorizado sem OpenCV)
+    _HAS_NUMPY = True
+except Exception:
+    _HAS_NUMPY = False
+
+try:
+    from pypdf import PdfReader  # opcional (camada de texto de PDFs)
+    _HAS_PYPDF = True
+except Exception:
+    _HAS_PYPDF = False
+
+try:
+    import tesserocr  # opcional (C-API do tesseract, handle persistente)
+    _HAS_TESSEROCR = True
+except Exception:
+    _HAS_TESSEROCR = False
+
 
 # -------------------------------
 # Modelo de retorno
@@ -26,80 +50,200 @@ class DadosComprovante:
     valor_centavos: Optional[int]           # None se não encontrado
 
 
+@dataclass
+class ExtracaoOCR:
+    """Resultado bruto do OCR (o que vai para o cache do ledger)."""
+    tipo: str
+    data: Optional[datetime]                # SEM o filtro de janela (mês atual/anterior)
+    valor_centavos: Optional[int]
+    texto: str                              # texto cru devolvido pelo tesseract
+    preproc: str                            # caminho de pré-processamento usado
+
+    def para_dados(self) -> "DadosComprovante":
+        """Aplica a janela de meses (depende de 'hoje', por isso não é cacheada)."""
+        return DadosComprovante(
+            tipo=self.tipo,
+            data=_validar_janela_meses(self.data),
+            valor_centavos=(int(self.valor_centavos) if self.valor_centavos is not None else None),
+        )
+
+
+# Versão do pipeline (pré-processamento + config + parsers). Suba ao mudar qualquer
+# um deles: entradas antigas do cache de OCR deixam de casar e são refeitas.
+OCR_PIPELINE_VERSION = "4"
+
+
+@lru_cache(maxsize=1)
+def engine_id() -> str:
+    """Identifica pipeline + motor/versão do tesseract (chave de validade do cache de OCR)."""
+    m = _motor()
+    try:
+        tess = f"{m.nome}-{m.versao()}"
+    except Exception:
+        tess = f"{m.nome}-?"
+    modo = ("multi" if _OCR_MULTIPASS else "single") + ("+layout" if _OCR_LAYOUT else "")
+    if _OCR_RESCALE:
+        modo += f"+rescale{_ALTURA_LINHA_ALVO}"
+    return f"p{OCR_PIPELINE_VERSION}-{modo}+{_preproc_nome()}/{tess}"
+
+
 # -------------------------------
 # Debug (fora das pastas vigiadas)
 # -------------------------------
+# Com OCR_DEBUG=1 cada comprovante ganha um bundle em DEBUG_DIR (ver artifacts.py);
+# a gravação é feita por uma thread de fundo, com teto de tamanho.
 _OCR_DEBUG = os.getenv("OCR_DEBUG", "0") not in ("0", "", "false", "False", "no")
-_DEBUG_DIR = os.getenv("OCR_DEBUG_DIR", "_ocr_debug")
+
+# Tempo máximo (s) de UMA chamada ao tesseract; estourou -> o processo filho é morto
+# pelo pytesseract e a chamada levanta RuntimeError. 0 = sem limite.
+_OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT_SEC", "60") or 0)
 
 def _dump_debug(img: Image.Image, texto: str, stem: str):
     if not _OCR_DEBUG:
         return
-    os.makedirs(_DEBUG_DIR, exist_ok=True)
-    try:
-        img.save(os.path.join(_DEBUG_DIR, f"{stem}_norm.png"))
-    except Exception:
-        pass
-    try:
-        with open(os.path.join(_DEBUG_DIR, f"{stem}_ocr_debug.txt"), "w", encoding="utf-8") as f:
-            f.write(texto)
-    except Exception:
-        pass
+    salvar_artefato(stem, "norm.png", img)
+    salvar_artefato(stem, "ocr.txt", texto)
 
 
 # -------------------------------
-# Regex reutilizáveis
+# Tokenizador (uma passada no texto)
 # -------------------------------
-VALOR_RE = re.compile(
+# Uma única regex compilada percorre o texto e emite tokens tipados com posição:
+#   data    -> (d, m, y|None)     "03/11/2025", "03-11-25", "15/09"
+#   hora    -> (h, mm, ss)        "14:40", "14:40:05"
+#   quantia -> centavos           "R$ 1.234,56", "2,65"
+#   rotulo  -> chave normalizada  "passagem" | "inicio" | "termino" | "valor"
+# As regras (genérica, Sigapay, Mercado Pago... e o valor) consomem os tokens em
+# vez de rodar várias regex sobrepostas sobre o texto inteiro. Antes da passada,
+# letras que o OCR troca por dígito (O/o->0, S->5, I/l->1) são corrigidas quando
+# coladas num número — troca 1:1, as posições continuam valendo no texto original.
+# Quantia aceita dígitos separados por espaço ("1 0,50", OCR quebrando o número).
+_TOKEN_RE = re.compile(
     r"""
-    (?:R\$\s*)?               # opcional "R$"
-    (?P<val>
-        \d{1,3}(?:\.\d{3})*   # 1.234.567  OU
-        |\d+                   # 12345
-    )
-    [\.,]\s?(?P<cents>\d{2})   # separador decimal + 2 dígitos
+      (?P<data>(?P<d>\d{1,2})[/\-](?P<m>\d{1,2})(?:[/\-](?P<y>\d{2,4}))?)
+    | (?P<hora>(?P<h>\d{1,2}):(?P<mm>\d{2})(?::(?P<ss>\d{2}))?)
+    | (?P<quantia>(?:R\$\s*)?(?P<qi>\d{1,3}(?:\.\d{3})+|\d+(?:\ \d+)*)\ ?[.,]\s?(?P<qc>\d{2}))
+    | (?P<rotulo>data\s+da\s+passagem|in[ií]cio|t[ée]rmino|total|valor|pagamento|pago|tarifa)
     """,
-    re.VERBOSE,
+    re.VERBOSE | re.IGNORECASE,
 )
 
-# data + hora “bem especificadas”
-DATAH_RE = re.compile(
-    r"(?P<d>\d{1,2})[\/\-](?P<m>\d{1,2})[\/\-](?P<y>\d{2,4})\s+(?P<h>\d{1,2}):(?P<mm>\d{2})(?::(?P<ss>\d{2}))?"
-)
 
-# variação com traço: “03/11/2025 - 14:40” (Mercado Pago)
-DATAH_TRACO_RE = re.compile(
-    r"(?P<d>\d{1,2})[\/\-](?P<m>\d{1,2})[\/\-](?P<y>\d{2,4})\s*[–\-]\s*(?P<h>\d{1,2}):(?P<mm>\d{2})"
-)
+class _Token(NamedTuple):
+    tipo: str       # "data" | "hora" | "quantia" | "rotulo"
+    ini: int
+    fim: int
+    valor: object
 
-# versão FLEX: aceita QUALQUER coisa curta entre a data e a hora (OCR pode “sumir” com o traço/pontos)
-DATAH_FLEX_RE = re.compile(
-    r"(?P<d>\d{1,2})[\/\-](?P<m>\d{1,2})[\/\-](?P<y>\d{2,4}).{0,8}?(?P<h>\d{1,2}):(?P<mm>\d{2})"
-)
 
-# 15/09 às 10:41 (sem ano)
-DATAH_SEM_ANO_RE = re.compile(
-    r"(?P<d>\d{1,2})[\/\-](?P<m>\d{1,2}).{0,12}?\b(?:às|as|a[s]?)\s*(?P<h>\d{1,2}):(?P<mm>\d{2})",
-    re.IGNORECASE,
-)
+def _chave_rotulo(txt: str) -> str:
+    low = txt.lower()
+    if low.startswith("data"):
+        return "passagem"
+    if low.startswith("in"):
+        return "inicio"
+    if low.startswith("t") and low[1:2] in ("e", "é"):
+        return "termino"
+    return "valor"
+
+
+_DIGITO_TROCADO_RE = re.compile(r"(?<=\d)[OoSIl](?![A-Za-z])|(?<![A-Za-z])[OoSIl](?=\d)")
+_DIGITO_TROCADO = str.maketrans({"O": "0", "o": "0", "S": "5", "I": "1", "l": "1"})
+
+
+def _tokenizar(texto: str) -> List[_Token]:
+    corrigido = _DIGITO_TROCADO_RE.sub(lambda m: m.group(0).translate(_DIGITO_TROCADO), texto)
+    out: List[_Token] = []
+    for m in _TOKEN_RE.finditer(corrigido):
+        kind = m.lastgroup          # grupo externo fecha por último: data|hora|quantia|rotulo
+        if kind == "data":
+            y = m.group("y")
+            val = (int(m.group("d")), int(m.group("m")), int(y) if y else None)
+        elif kind == "hora":
+            val = (int(m.group("h")), int(m.group("mm")), int(m.group("ss") or 0))
+        elif kind == "quantia":
+            val = int(re.sub(r"[. ]", "", m.group("qi"))) * 100 + int(m.group("qc"))
+        else:
+            val = _chave_rotulo(m.group("rotulo"))
+        out.append(_Token(kind, m.start(), m.end(), val))
+    return out
+
 
-# “Início …” / “Término …” (Sigapay)
-SIGAPAY_INICIO_RE  = re.compile(r"(?i)in[ií]cio.*?(\d{1,2}/\d{1,2}/\d{2,4}).{0,8}?(\d{1,2}:\d{2})")
-SIGAPAY_TERMINO_RE = re.compile(r"(?i)t[ée]rmino.*?(\d{1,2}/\d{1,2}/\d{2,4}).{0,8}?(\d{1,2}:\d{2})")
+# entre data e hora: só espaços (qualquer tamanho) OU até 8 chars na mesma linha
+# (OCR pode “sumir” com o traço/pontos: “03/11/2025 - 14:40”, “03/11/2025, 14:40”)
+# data sem ano: “15/09 às 10:41”
+_SEM_ANO_GAP_RE = re.compile(r".{0,12}?\b(?:às|as|a)\s*$", re.IGNORECASE)
 
-# Palavras-chave para classificar
-KW_PEDAGIO = ("pedágio", "pedagio", "veloe", "sem parar", "semparar", "tag", "praça", "praca", "autoban", "ccr", "rota das bandeiras", "renovias")
-KW_ESTAC  = ("estac", "vaga legal", "zona azul", "zul+", "zul plus", "park", "parquímetro", "parquimetro", "estapar", "sigapay")
+
+def _datas_com_hora(texto: str, toks: List[_Token]) -> List[Tuple[int, datetime]]:
+    """Pares data+hora na ordem do texto: [(posição da data, datetime)]. Linear nos tokens."""
+    out: List[Tuple[int, datetime]] = []
+    pendentes: List[_Token] = []
+    for t in toks:
+        if t.tipo == "data":
+            pendentes.append(t)
+            continue
+        if t.tipo != "hora" or not pendentes:
+            continue
+        hh, mm, ss = t.valor
+        for dtk in pendentes:
+            d, mth, y = dtk.valor
+            gap = texto[dtk.fim:t.ini]
+            if y is not None:
+                if not (gap.isspace() or gap == "" or (len(gap) <= 8 and "\n" not in gap)):
+                    continue
+                if y < 100:
+                    y += 2000
+                dt = _to_dt(y, mth, d, hh, mm, ss)
+            else:
+                if len(gap) > 20 or not _SEM_ANO_GAP_RE.match(gap):
+                    continue
+                # datas “sem ano” — supõe o ano mais provável
+                dt = _to_dt(_inferir_ano_para_mes(mth), mth, d, hh, mm, 0)
+            if dt:
+                out.append((dtk.ini, dt))
+        pendentes = []
+    return out
 
 
 # -------------------------------
 # Pré-processamento da imagem
 # -------------------------------
-def _normalize_img(path_img: str):
-    img = Image.open(path_img).convert("L")  # escala de cinza
+# OCR_PREPROC=auto|cv2|numpy|pil — força um caminho (benchmark/comparação);
+# auto = cv2 se houver, senão numpy, senão PIL
+_PREPROC = (os.getenv("OCR_PREPROC", "auto") or "auto").strip().lower()
 
-    if _HAS_CV2:
-        import numpy as np
+_NOMES_PREPROC = {"cv2": "cv2-adaptive", "numpy": "np-adaptive-deskew", "pil": "pil-threshold"}
+
+
+@lru_cache(maxsize=None)
+def _avisar_uma_vez(msg: str) -> None:
+    logging.warning("[OCR] %s", msg)
+
+
+def _preproc_efetivo() -> str:
+    if _PREPROC == "cv2" and not _HAS_CV2:
+        _avisar_uma_vez("OCR_PREPROC=cv2 mas OpenCV não está instalado; usando o próximo disponível.")
+    elif _PREPROC == "numpy" and not _HAS_NUMPY:
+        _avisar_uma_vez("OCR_PREPROC=numpy mas NumPy não está instalado; usando PIL.")
+        return "pil"
+    elif _PREPROC in _NOMES_PREPROC:
+        return _PREPROC
+    return "cv2" if _HAS_CV2 else "numpy" if _HAS_NUMPY else "pil"
+
+
+def _preproc_nome() -> str:
+    return _NOMES_PREPROC[_preproc_efetivo()]
+
+
+def _limiarizar(img: Image.Image, endireitar: bool = True) -> Image.Image:
+    """
+    Binarização da imagem em cinza: adaptativa (cv2), adaptativa + deskew + corte de
+    bordas (NumPy) ou autocontraste + corte fixo (PIL).
+    `endireitar=False` para recortes pequenos (regiões), onde deskew não faz sentido.
+    """
+    pp = _preproc_efetivo()
+    if pp == "cv2":
         npimg = np.array(img)
         th = cv2.adaptiveThreshold(
             npimg, 255,
@@ -107,6 +251,8 @@ def _normalize_img(path_img: str):
             cv2.THRESH_BINARY, 31, 11
         )
         return Image.fromarray(th)
+    if pp == "numpy":
+        return _limiarizar_np(img, endireitar)
 
     img = ImageOps.autocontrast(img)
     img = img.filter(ImageFilter.UnsharpMask(radius=1, percent=120, threshold=3))
@@ -114,59 +260,581 @@ def _normalize_img(path_img: str):
     return img
 
 
+# -------------------------------
+# Pré-processamento NumPy (sem OpenCV)
+# -------------------------------
+# Limiar adaptativo pela média simples da vizinhança 31x31 - 11 (mesma janela e
+# constante do cv2, mas NÃO o mesmo resultado: lá a média é gaussiana e a borda é
+# replicada; aqui é média de caixa, com a janela recortada na borda). A média sai
+# de uma imagem integral: 4 leituras por pixel, tudo vetorizado. Antes de binarizar,
+# estimamos a inclinação pela projeção horizontal da tinta (linhas de texto alinhadas
+# = histograma com picos estreitos) e giramos; depois cortamos margens vazias e
+# tarjas escuras de borda, para o tesseract não gastar tempo com elas.
+_NP_JANELA = 31
+_NP_C = 11
+_DESKEW_MAX_GRAUS = 5.0
+_DESKEW_MIN_GRAUS = 0.2         # abaixo disso não vale a rotação
+_DESKEW_LARGURA = 600           # a inclinação é estimada numa cópia reduzida
+_DESKEW_PONTOS = 60_000         # amostra máxima de pixels de tinta
+_BORDA_TINTA_MIN = 0.003        # fração de tinta para a linha/coluna “ter conteúdo”
+_BORDA_TINTA_MAX = 0.5          # acima disso é tarja escura, não texto
+_BORDA_MARGEM = 10
+
+
+def _limiar_adaptativo(a: "np.ndarray", janela: int = _NP_JANELA, c: int = _NP_C) -> "np.ndarray":
+    """uint8 (h, w) -> uint8 0/255: branco onde o pixel > média de caixa local - c (não a gaussiana do cv2)."""
+    h, w = a.shape
+    r = janela // 2
+    tipo = np.int32 if h * w * 255 < 2 ** 31 else np.int64
+    ii = np.zeros((h + 1, w + 1), dtype=tipo)
+    np.cumsum(a, axis=0, dtype=tipo, out=ii[1:, 1:])
+    np.cumsum(ii[1:, 1:], axis=1, out=ii[1:, 1:])
+
+    y0 = np.clip(np.arange(h) - r, 0, h)
+    y1 = np.clip(np.arange(h) + r + 1, 0, h)
+    x0 = np.clip(np.arange(w) - r, 0, w)
+    x1 = np.clip(np.arange(w) + r + 1, 0, w)
+    # separável: diferença nas linhas, depois nas colunas (cópias contíguas, sem gather 2D)
+    faixa = np.take(ii, y1, axis=0)
+    faixa -= np.take(ii, y0, axis=0)
+    del ii
+    soma = np.take(faixa, x1, axis=1)
+    soma -= np.take(faixa, x0, axis=1)
+    del faixa
+    # a > soma/n - c  <=>  (a + c) * n > soma   (sem divisão nem float)
+    n = (y1 - y0).astype(tipo)[:, None] * (x1 - x0).astype(tipo)[None, :]
+    return np.where((a.astype(tipo) + c) * n > soma, 255, 0).astype(np.uint8)
+
+
+def _melhor_angulo(ys: "np.ndarray", xs: "np.ndarray", angulos: "np.ndarray") -> float:
+    melhor, pontos = 0.0, -1
+    for ang in angulos:
+        proj = np.rint(ys - xs * np.tan(np.radians(ang))).astype(np.int64)
+        hist = np.bincount(proj - proj.min())
+        p = int(np.dot(hist, hist))             # picos estreitos = texto alinhado
+        if p > pontos:
+            melhor, pontos = float(ang), p
+    return melhor
+
+
+def _estimar_inclinacao(img: Image.Image) -> float:
+    """Graus (sentido anti-horário do PIL) que endireitam o texto; 0.0 se não der para saber."""
+    peq = _reduzir(img, _DESKEW_LARGURA)
+    escala = peq.width / max(1, img.width)
+    janela = max(7, int(_NP_JANELA * escala) | 1)
+    ys, xs = np.nonzero(_limiar_adaptativo(np.asarray(peq, dtype=np.uint8), janela) == 0)
+    if ys.size < 200:
+        return 0.0
+    if ys.size > _DESKEW_PONTOS:
+        passo = ys.size // _DESKEW_PONTOS + 1
+        ys, xs = ys[::passo], xs[::passo]
+    ys = ys.astype(np.float64)
+    xs = xs.astype(np.float64) - xs.mean()
+
+    grosso = _melhor_angulo(ys, xs, np.arange(-_DESKEW_MAX_GRAUS, _DESKEW_MAX_GRAUS + 1e-9, 0.5))
+    return _melhor_angulo(ys, xs, np.arange(grosso - 0.5, grosso + 0.5 + 1e-9, 0.1))
+
+
+def _faixa_util(tinta_frac: "np.ndarray") -> Tuple[int, int]:
+    """[ini, fim) com conteúdo num eixo, pulando as tarjas escuras dos 10% de cada ponta."""
+    n = tinta_frac.size
+    borda = n // 10
+    pesadas = np.nonzero(tinta_frac > _BORDA_TINTA_MAX)[0]
+    antes = pesadas[pesadas < borda]
+    depois = pesadas[pesadas >= n - borda]
+    # +/- 3px: a borda serrilhada da tarja não conta como conteúdo
+    ini = int(antes[-1]) + 4 if antes.size else 0
+    fim = int(depois[0]) - 3 if depois.size else n
+    trecho = tinta_frac[ini:fim]
+    uteis = np.nonzero((trecho >= _BORDA_TINTA_MIN) & (trecho <= _BORDA_TINTA_MAX))[0]
+    if uteis.size == 0:
+        return 0, n
+    return ini + int(uteis[0]), ini + int(uteis[-1]) + 1
+
+
+def _cortar_bordas(b: "np.ndarray") -> "np.ndarray":
+    """Remove margens vazias/tarjas escuras nas bordas e deixa uma margem branca fixa."""
+    tinta = b == 0
+    h, w = tinta.shape
+    # linhas medidas só no miolo das colunas e colunas só nas linhas já aproveitadas:
+    # a moldura (foto de papel sobre a mesa, borda do scan) não “segura” o corte
+    l0, l1 = _faixa_util(tinta[:, w // 10: w - w // 10].mean(axis=1))
+    c0, c1 = _faixa_util(tinta[l0:l1].mean(axis=0))
+    recorte = b[l0:l1, c0:c1]
+    return np.pad(recorte, _BORDA_MARGEM, mode="constant", constant_values=255)
+
+
+def _limiarizar_np(img: Image.Image, endireitar: bool = True) -> Image.Image:
+    if endireitar:
+        ang = _estimar_inclinacao(img)
+        if abs(ang) >= _DESKEW_MIN_GRAUS:
+            logging.debug("[OCR] deskew %.1f°", ang)
+            img = img.rotate(ang, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=255)
+    b = _limiar_adaptativo(np.asarray(img, dtype=np.uint8))
+    if endireitar:
+        b = _cortar_bordas(b)
+    return Image.fromarray(b)
+
+
+def _abrir_cinza(fonte: Union[str, Image.Image]) -> Image.Image:
+    """Caminho de imagem ou página já rasterizada (PDF) -> escala de cinza."""
+    if isinstance(fonte, Image.Image):
+        return fonte.convert("L")
+    return Image.open(fonte).convert("L")
+
+
+def _normalize_img(fonte: Union[str, Image.Image]):
+    img = _abrir_cinza(fonte)  # escala de cinza
+    if _OCR_RESCALE:
+        img = _ajustar_resolucao(img, _altura_linha(img), _ALTURA_LINHA_ALVO)
+    return _limiarizar(img)
+
+
+def _reduzir(img: Image.Image, largura_max: int) -> Image.Image:
+    if largura_max <= 0 or img.width <= largura_max:
+        return img
+    alt = max(1, round(img.height * largura_max / img.width))
+    return img.resize((largura_max, alt), Image.Resampling.BILINEAR)
+
+
+# -------------------------------
+# Normalização de resolução
+# -------------------------------
+# Foto de 4000px e print de 1080p chegam no tesseract com letras de tamanhos
+# muito diferentes; o custo cresce com os pixels e a precisão não. Estimamos a
+# altura de linha numa miniatura (projeção horizontal) e escalamos a imagem
+# para que ela fique perto de OCR_LINE_PX.
+_OCR_RESCALE = os.getenv("OCR_RESCALE", "1") not in ("0", "", "false", "False", "no")
+_ALTURA_LINHA_ALVO = int(os.getenv("OCR_LINE_PX", "40") or 40)
+_LADO_MAX = int(os.getenv("OCR_MAX_SIDE", "2600") or 0)
+
+
+def _altura_linha(img: Image.Image, largura_amostra: int = 600) -> Optional[float]:
+    """Altura mediana das linhas de texto (px da imagem original), ou None se não der para estimar."""
+    if img.width < 50 or img.height < 50:
+        return None
+    amostra = _reduzir(img, largura_amostra)
+    fator = img.height / amostra.height
+
+    # fundo escuro (modo noturno dos apps) -> inverte para "tinta" ser escura
+    media = ImageStat.Stat(amostra).mean[0]
+    if media < 110:
+        amostra = ImageOps.invert(amostra)
+        media = 255 - media
+    corte = max(40, media * 0.75)
+    tinta = amostra.point(lambda p: 255 if p < corte else 0)
+
+    # BOX até 1px de largura = fração de tinta por linha, calculada em C
+    perfil = list(tinta.resize((1, tinta.height), Image.Resampling.BOX).getdata())
+
+    corridas: List[int] = []
+    atual = 0
+    for v in perfil:
+        if v > 6:           # > ~2% da largura com tinta
+            atual += 1
+        elif atual:
+            corridas.append(atual)
+            atual = 0
+    if atual:
+        corridas.append(atual)
+
+    corridas = [c for c in corridas if 2 <= c <= amostra.height // 4]
+    if len(corridas) < 3:
+        return None
+    corridas.sort()
+    return corridas[len(corridas) // 2] * fator
+
+
+def _ajustar_resolucao(img: Image.Image, linha_px: Optional[float], alvo_px: float) -> Image.Image:
+    """Escala para linha ~alvo_px; sem estimativa, só limita o lado maior a OCR_MAX_SIDE."""
+    if linha_px:
+        fator = min(2.5, max(0.25, alvo_px / linha_px))
+        if 0.9 <= fator <= 1.1:
+            fator = 1.0
+    else:
+        fator = 1.0
+    if _LADO_MAX > 0:
+        fator = min(fator, _LADO_MAX / max(img.size))
+    if fator >= 0.999 and fator <= 1.0:
+        return img
+    novo = (max(1, round(img.width * fator)), max(1, round(img.height * fator)))
+    return img.resize(novo, Image.Resampling.LANCZOS, reducing_gap=2.0 if fator < 1 else None)
+
+
+# -------------------------------
+# Motores de OCR
+# -------------------------------
+# pytesseract sobe um processo `tesseract` por chamada (grava a imagem em /tmp e
+# recarrega o traineddata por+eng a cada vez). Com tesserocr (binding da C-API)
+# o handle fica vivo no processo/worker e a imagem vai direto da memória.
+# OCR_ENGINE=auto|tesserocr|pytesseract
+# tesserocr não tem timeout: no `auto` só é usado em processo com deadline externo
+# (worker do ocr_stage, ver marcar_sob_deadline); OCR no próprio processo fica no
+# pytesseract, que para em OCR_TIMEOUT_SEC.
+_OCR_ENGINE = (os.getenv("OCR_ENGINE", "auto") or "auto").strip().lower()
+_SOB_DEADLINE = False
+
+
+def marcar_sob_deadline() -> None:
+    """Chamado no worker do pool: alguém de fora mata o processo se o OCR travar."""
+    global _SOB_DEADLINE
+    _SOB_DEADLINE = True
+_OCR_LANG = "por+eng"
+
+
+@dataclass
+class _Linha:
+    texto: str
+    palavras: List[Tuple[str, int, int, int, int]]   # (texto, left, top, width, height)
+
+
+def _juntar_linhas(linhas: List[_Linha]) -> str:
+    for ln in linhas:
+        ln.texto = " ".join(w[0] for w in ln.palavras)
+    return "\n".join(ln.texto for ln in linhas)
+
+
+class _MotorPytesseract:
+    nome = "pytesseract"
+
+    def versao(self) -> str:
+        return str(pytesseract.get_tesseract_version())
+
+    def _cfg(self, psm: int, whitelist: Optional[str]) -> str:
+        cfg = f"--oem 3 --psm {psm} -l {_OCR_LANG}"
+        if whitelist:
+            cfg += f" -c tessedit_char_whitelist={whitelist}"
+        return cfg
+
+    def texto(self, img: Image.Image, psm: int = 6, whitelist: Optional[str] = None) -> str:
+        return pytesseract.image_to_string(img, config=self._cfg(psm, whitelist), timeout=_OCR_TIMEOUT) or ""
+
+    def layout(self, img: Image.Image, psm: int = 6) -> Tuple[str, List[_Linha]]:
+        d = pytesseract.image_to_data(
+            img, config=self._cfg(psm, None), output_type=pytesseract.Output.DICT, timeout=_OCR_TIMEOUT
+        )
+        linhas: dict[tuple[int, int, int], _Linha] = {}
+        for i, txt in enumerate(d.get("text", [])):
+            txt = (txt or "").strip()
+            if not txt:
+                continue
+            chave = (d["block_num"][i], d["par_num"][i], d["line_num"][i])
+            ln = linhas.setdefault(chave, _Linha("", []))
+            ln.palavras.append((txt, d["left"][i], d["top"][i], d["width"][i], d["height"][i]))
+        out = list(linhas.values())
+        return _juntar_linhas(out), out
+
+
+class _MotorTesserocr:
+    """Um PyTessBaseAPI inicializado uma vez por processo. Sem timeout próprio:
+    só é escolhido no `auto` sob o deadline do pool (ocr_stage)."""
+    nome = "tesserocr"
+
+    def __init__(self):
+        self._api = tesserocr.PyTessBaseAPI(lang=_OCR_LANG, oem=tesserocr.OEM.DEFAULT)
+        self._lock = threading.Lock()
+
+    def versao(self) -> str:
+        partes = (tesserocr.tesseract_version() or "").split()   # "tesseract 5.3.0\n leptonica-..."
+        return partes[1] if len(partes) > 1 else "?"
+
+    def _preparar(self, img: Image.Image, psm: int, whitelist: Optional[str]) -> None:
+        api = self._api
+        api.SetPageSegMode(psm)
+        api.SetVariable("tessedit_char_whitelist", whitelist or "")
+        api.SetImage(img)
+
+    def texto(self, img: Image.Image, psm: int = 6, whitelist: Optional[str] = None) -> str:
+        with self._lock:
+            self._preparar(img, psm, whitelist)
+            return self._api.GetUTF8Text() or ""
+
+    def layout(self, img: Image.Image, psm: int = 6) -> Tuple[str, List[_Linha]]:
+        RIL = tesserocr.RIL
+        with self._lock:
+            self._preparar(img, psm, None)
+            self._api.Recognize()
+            it = self._api.GetIterator()
+            out: List[_Linha] = []
+            atual: Optional[_Linha] = None
+            for w in tesserocr.iterate_level(it, RIL.WORD):
+                txt = (w.GetUTF8Text(RIL.WORD) or "").strip()
+                if atual is None or w.IsAtBeginningOf(RIL.TEXTLINE):
+                    atual = _Linha("", [])
+                    out.append(atual)
+                if not txt:
+                    continue
+                bb = w.BoundingBox(RIL.WORD)
+                if not bb:
+                    continue
+                x1, y1, x2, y2 = bb
+                atual.palavras.append((txt, x1, y1, x2 - x1, y2 - y1))
+        out = [ln for ln in out if ln.palavras]
+        return _juntar_linhas(out), out
+
+
+_MOTOR = None
+
+
+def _motor():
+    """Motor do processo atual (criado na 1ª chamada e reaproveitado)."""
+    global _MOTOR
+    if _MOTOR is None:
+        # auto sem deadline externo: pytesseract (com timeout)
+        if _HAS_TESSEROCR and (_OCR_ENGINE == "tesserocr" or (_OCR_ENGINE == "auto" and _SOB_DEADLINE)):
+            if not _SOB_DEADLINE:
+                logging.warning("[OCR] OCR_ENGINE=tesserocr fora do pool de OCR: sem timeout se o tesseract travar.")
+            try:
+                _MOTOR = _MotorTesserocr()
+            except Exception as e:
+                logging.warning("[OCR] tesserocr indisponível (%s); usando pytesseract.", e)
+        elif _OCR_ENGINE == "tesserocr":
+            logging.warning("[OCR] OCR_ENGINE=tesserocr mas o módulo não está instalado; usando pytesseract.")
+        if _MOTOR is None:
+            _MOTOR = _MotorPytesseract()
+        logging.debug("[OCR] motor=%s", _MOTOR.nome)
+    return _MOTOR
+
+
 # -------------------------------
 # OCR bruto
 # -------------------------------
-def _ocr_texto(path_img: str) -> Tuple[Image.Image, str]:
-    img = _normalize_img(path_img)
-    cfg = "--oem 3 --psm 6 -l por+eng"
-    texto = pytesseract.image_to_string(img, config=cfg) or ""
+def _tesseract(img: Image.Image, psm: int = 6, whitelist: Optional[str] = None) -> str:
+    return _motor().texto(img, psm=psm, whitelist=whitelist)
+
+
+def _tesseract_layout(img: Image.Image, psm: int = 6) -> Tuple[str, List[_Linha]]:
+    """Como _tesseract, mas devolve também as linhas com as caixas das palavras."""
+    return _motor().layout(img, psm=psm)
+
+
+def _stem(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _ocr_texto(fonte: Union[str, Image.Image], stem: Optional[str] = None) -> Tuple[Image.Image, str]:
+    img = _normalize_img(fonte)
+    texto = _tesseract(img, psm=6)
     # dump de debug centralizado
-    stem = os.path.splitext(os.path.basename(path_img))[0]
-    _dump_debug(img, texto, stem)
+    _dump_debug(img, texto, stem or (_stem(fonte) if isinstance(fonte, str) else "img"))
     return img, texto
 
 
 # -------------------------------
-# Parsers de valor / data / tipo
+# OCR em passes (escalonamento)
+# -------------------------------
+# Cada passe só roda se ainda faltar algum campo (tipo/valor/data na janela).
+# O primeiro é barato (cinza reduzido, sem binarizar) e resolve a maioria dos
+# prints de app; os seguintes ficam para foto de ticket de papel.
+@dataclass(frozen=True)
+class _Passe:
+    nome: str
+    psm: int
+    limiar: bool            # False = cinza reduzido; True = imagem binarizada em resolução cheia
+
+
+_PASSES: Tuple[_Passe, ...] = (
+    _Passe("rapido", 6, False),
+    _Passe("limiar", 6, True),
+    _Passe("psm4", 4, True),
+    _Passe("esparso", 11, True),
+)
+
+_OCR_MULTIPASS = os.getenv("OCR_MULTIPASS", "1") not in ("0", "", "false", "False", "no")
+_RAPIDO_LARGURA = int(os.getenv("OCR_FAST_WIDTH", "800") or 0)
+
+
+def _ocr_em_passes(fonte: Union[str, Image.Image], stem: Optional[str] = None) -> ExtracaoOCR:
+    original = _abrir_cinza(fonte)
+    linha_px = _altura_linha(original) if _OCR_RESCALE else None
+    cinza = _ajustar_resolucao(original, linha_px, _ALTURA_LINHA_ALVO) if _OCR_RESCALE else original
+    if linha_px:
+        # passe rápido: letra menor que a dos passes cheios, mas ainda legível
+        rapida = _ajustar_resolucao(original, linha_px, _ALTURA_LINHA_ALVO * 0.6)
+    else:
+        rapida = _reduzir(cinza, _RAPIDO_LARGURA)
+    del original
+    binaria: Optional[Image.Image] = None
+
+    tipo, valor, data = "desconhecido", None, None
+    textos: List[str] = []
+    usados: List[str] = []
+    img = cinza
+
+    for passe in _PASSES:
+        if passe.limiar:
+            if binaria is None:
+                binaria = _limiarizar(cinza)
+            img = binaria
+        else:
+            img = rapida
+
+        linhas: List[_Linha] = []
+        if passe.nome == "rapido" and _OCR_LAYOUT:
+            texto, linhas = _tesseract_layout(img, psm=passe.psm)
+        else:
+            texto = _tesseract(img, psm=passe.psm)
+        textos.append(texto)
+        usados.append(passe.nome)
+
+        # cada campo fica com o primeiro passe que o encontrou
+        if tipo == "desconhecido":
+            tipo = _classifica_tipo("\n".join(textos))
+        toks = _tokenizar(texto)   # uma passada por texto: valor, data e a contagem de datas
+        if valor is None:
+            valor = _parse_valor(texto, toks)
+        if _validar_janela_meses(data) is None:
+            d = _parse_data(texto, tipo, toks=toks)
+            # uma data fora da janela fica como reserva até aparecer uma válida
+            if d is not None and (data is None or _validar_janela_meses(d) is not None):
+                data = d
+
+        # regiões ao lado dos rótulos: só para o que faltou ou ficou ambíguo no passe rápido
+        if linhas:
+            precisa_valor = valor is None
+            precisa_data = _validar_janela_meses(data) is None or len(set(_collect_all_dates(texto, toks))) > 1
+            if precisa_valor or precisa_data:
+                r_valor, r_data = _ocr_regioes(cinza, img, linhas, precisa_valor, precisa_data)
+                if r_valor is not None or r_data is not None:
+                    usados.append("regioes")
+                if r_valor is not None:
+                    valor = r_valor
+                if r_data is not None and (data is None or _validar_janela_meses(r_data) is not None):
+                    data = r_data
+
+        if tipo != "desconhecido" and valor is not None and _validar_janela_meses(data) is not None:
+            break
+
+    texto_total = "\n".join(textos)
+    _dump_debug(img, texto_total, stem or (_stem(fonte) if isinstance(fonte, str) else "img"))
+    logging.debug("[OCR] passes=%s", "+".join(usados))
+
+    return ExtracaoOCR(
+        tipo=tipo, data=data, valor_centavos=valor, texto=texto_total,
+        preproc=f"{_preproc_nome()}[{'+'.join(usados)}]",
+    )
+
+
+# -------------------------------
+# OCR por regiões (layout)
 # -------------------------------
-def _parse_valor(texto: str) -> Optional[int]:
-    # normalização leve para erros comuns de OCR em valores
-    def _fix_ocr_digits(s: str) -> str:
-        tbl = str.maketrans({
-            "O": "0", "o": "0",
-            "S": "5",
-            "I": "1", "l": "1",
-        })
-        return s.translate(tbl)
-
-    # linhas não vazias
-    linhas = [ln.strip() for ln in texto.splitlines() if ln.strip()]
-
-    # prioriza linhas que *parecem* conter o valor
-    preferidas = []
+# O passe rápido devolve as caixas das palavras; achando um rótulo conhecido,
+# reOCRamos só a faixa à direita dele e a linha de baixo, na resolução cheia e
+# com whitelist numérica. Menos pixels no tesseract e nada de pegar data/valor
+# de outra parte da tela.
+_OCR_LAYOUT = os.getenv("OCR_LAYOUT", "1") not in ("0", "", "false", "False", "no")
+
+_ANCORAS_VALOR = ("total", "valor")
+_ANCORAS_DATA = ("data da passagem", "início", "inicio", "término", "termino")
+_WHITELIST_DIGITOS = "0123456789/:,.-R$"
+
+
+def _acha_ancora(linha: _Linha, ancora: str) -> Optional[Tuple[int, int, int, int]]:
+    """Caixa (x0, y0, x1, y1) das palavras do rótulo dentro da linha, ou None."""
+    alvo = ancora.split()
+    palavras = [w[0].lower().strip(":.") for w in linha.palavras]
+    for i in range(len(palavras) - len(alvo) + 1):
+        if all(palavras[i + k].startswith(alvo[k]) for k in range(len(alvo))):
+            ws = linha.palavras[i:i + len(alvo)]
+            x0 = min(w[1] for w in ws)
+            y0 = min(w[2] for w in ws)
+            x1 = max(w[1] + w[3] for w in ws)
+            y1 = max(w[2] + w[4] for w in ws)
+            return x0, y0, x1, y1
+    return None
+
+
+def _recorte_regiao(cinza: Image.Image, escala: float, caixa: Tuple[int, int, int, int]) -> Image.Image:
+    """À direita do rótulo (mesma linha) empilhado sobre a linha de baixo, em resolução cheia."""
+    x0, y0, x1, y1 = (round(v * escala) for v in caixa)
+    h = max(8, y1 - y0)
+    W, H = cinza.size
+    direita = cinza.crop((min(x1 + 2, W - 1), max(0, y0 - h // 3), W, min(H, y1 + h // 3)))
+    abaixo = cinza.crop((x0, min(y1, H - 1), W, min(H, y1 + round(h * 2.2))))
+
+    larg = max(direita.width, abaixo.width, 1)
+    alt = direita.height + abaixo.height + h
+    tela = Image.new("L", (larg, alt), 255)
+    tela.paste(direita, (0, 0))
+    tela.paste(abaixo, (0, direita.height + h))
+    return _limiarizar(tela, endireitar=False)
+
+
+def _ocr_regioes(
+    cinza: Image.Image,
+    img_layout: Image.Image,
+    linhas: List[_Linha],
+    quer_valor: bool,
+    quer_data: bool,
+) -> Tuple[Optional[int], Optional[datetime]]:
+    escala = cinza.width / max(1, img_layout.width)
+
+    # 1ª ocorrência de cada rótulo
+    achadas: dict[str, Tuple[int, int, int, int]] = {}
     for ln in linhas:
-        ln_low = ln.lower()
-        if any(k in ln_low for k in ("total", "valor", "pago", "pagamento", "tarifa")):
-            preferidas.append(ln)
+        low = ln.texto.lower()
+        for anc in _ANCORAS_VALOR + _ANCORAS_DATA:
+            if anc in achadas or anc.split()[0] not in low:
+                continue
+            cx = _acha_ancora(ln, anc)
+            if cx:
+                achadas[anc] = cx
 
-    candidatos = preferidas + linhas
+    def _texto_regiao(anc: str) -> str:
+        reg = _recorte_regiao(cinza, escala, achadas[anc])
+        return _tesseract(reg, psm=6, whitelist=_WHITELIST_DIGITOS)
 
-    for ln in candidatos:
-        ln_fix = _fix_ocr_digits(ln)
-        m = VALOR_RE.search(ln_fix.replace(" ", "")) or VALOR_RE.search(ln_fix)
-        if not m:
-            continue
-        inteiro = m.group("val").replace(".", "")
-        cents = m.group("cents")
-        try:
-            v = int(inteiro) * 100 + int(cents)
-            # Aceita a partir de 50 centavos (ex.: Estapar R$ 0,90)
-            if v >= 50:
-                return v
-        except Exception:
-            continue
+    valor = None
+    if quer_valor:
+        for anc in _ANCORAS_VALOR:
+            if anc in achadas:
+                valor = _parse_valor(_texto_regiao(anc))
+                if valor is not None:
+                    break
+
+    data = None
+    if quer_data:
+        datas: dict[str, datetime] = {}
+        for anc in _ANCORAS_DATA:
+            if anc not in achadas:
+                continue
+            chave = "inicio" if anc.startswith("in") else "termino" if anc.startswith("t") else "passagem"
+            if chave in datas:
+                continue
+            encontradas = _collect_all_dates(_texto_regiao(anc))
+            if encontradas:
+                datas[chave] = encontradas[0]
+        # mesma precedência de _parse_data: passagem > Início > Término
+        data = datas.get("passagem") or datas.get("inicio") or datas.get("termino")
+
+    logging.debug("[OCR] regiões=%s valor=%s data=%s", list(achadas), valor, data)
+    return valor, data
+
+
+# -------------------------------
+# Parsers de valor / data / tipo
+# -------------------------------
+def _parse_valor(texto: str, toks: Optional[List[_Token]] = None) -> Optional[int]:
+    """
+    Valor em centavos a partir dos tokens `quantia`: primeiro as linhas com rótulo
+    de valor (total/valor/pago/pagamento/tarifa), depois todas, na ordem do texto;
+    vale a 1ª quantia da linha, a partir de 50 centavos (ex.: Estapar R$ 0,90).
+    """
+    if toks is None:
+        toks = _tokenizar(texto)
+
+    por_linha: Dict[int, List[_Token]] = {}
+    linha, pos = 0, 0
+    for t in toks:
+        linha += texto.count("\n", pos, t.ini)
+        pos = t.ini
+        por_linha.setdefault(linha, []).append(t)
 
+    preferidas = [n for n, ts in por_linha.items() if any(t.tipo == "rotulo" and t.valor == "valor" for t in ts)]
+    for n in preferidas + list(por_linha):
+        v = next((t.valor for t in por_linha[n] if t.tipo == "quantia"), None)
+        if v is not None and v >= 50:
+            return v
     return None
 
 
@@ -206,78 +874,159 @@ def _to_dt(y: int, m: int, d: int, hh: int, mm: int, ss: int = 0) -> Optional[da
         return None
 
 
-def _collect_all_dates(texto: str) -> List[datetime]:
-    """Coleta TODAS as datas possíveis do texto (com ano)."""
-    out: List[datetime] = []
+def _collect_all_dates(texto: str, toks: Optional[List[_Token]] = None) -> List[datetime]:
+    """Coleta TODAS as datas possíveis do texto, na ordem em que aparecem."""
+    if toks is None:
+        toks = _tokenizar(texto)
+    return [dt for _, dt in _datas_com_hora(texto, toks)]
 
-    for rx in (DATAH_RE, DATAH_TRACO_RE, DATAH_FLEX_RE):
-        for m in rx.finditer(texto):
-            d, mth, y = int(m.group("d")), int(m.group("m")), int(m.group("y"))
-            if y < 100:
-                y += 2000
-            hh, mm = int(m.group("h")), int(m.group("mm"))
-            ss = int(m.group("ss") or 0) if "ss" in m.groupdict() else 0
-            dt = _to_dt(y, mth, d, hh, mm, ss)
-            if dt:
-                out.append(dt)
-
-    # datas “sem ano” — supõe o ano mais provável
-    for m in DATAH_SEM_ANO_RE.finditer(texto):
-        d, mth = int(m.group("d")), int(m.group("m"))
-        hh, mm = int(m.group("h")), int(m.group("mm"))
-        y = _inferir_ano_para_mes(mth)
-        dt = _to_dt(y, mth, d, hh, mm, 0)
-        if dt:
-            out.append(dt)
 
-    return out
+def _primeira_data_apos(
+    texto: str,
+    pares: List[Tuple[int, datetime]],
+    toks: List[_Token],
+    rotulo: str,
+    janela: int,
+    mesma_linha: bool = False,
+) -> Optional[datetime]:
+    """Primeira data+hora até `janela` chars depois do 1º rótulo `rotulo`."""
+    pos = next((t.fim for t in toks if t.tipo == "rotulo" and t.valor == rotulo), None)
+    if pos is None:
+        return None
+    for ini, dt in pares:
+        if ini < pos:
+            continue
+        if ini - pos > janela or (mesma_linha and "\n" in texto[pos:ini]):
+            return None
+        return dt
+    return None
+
+
+# -------------------------------
+# Registro de emissores
+# -------------------------------
+# Cada emissor (Veloe, Sem Parar, Sigapay...) declara:
+#   - palavras: identificam o emissor E definem o tipo do comprovante
+#   - rotulos : só acionam o extrator do emissor (ex.: “Início”), sem definir tipo
+#   - extrator_data: regra própria de data, tentada antes da genérica
+# Todas as palavras de todos os emissores viram UMA regex; o texto é varrido uma
+# vez só, não importa quantos emissores existam.
+ExtratorData = Callable[[str, str, List[_Token], List[Tuple[int, datetime]]], Optional[datetime]]
+
+
+@dataclass(frozen=True)
+class Emissor:
+    nome: str
+    tipo: Optional[str]                     # "pedagio" | "estacionamento" | None
+    palavras: Tuple[str, ...] = ()
+    rotulos: Tuple[str, ...] = ()
+    extrator_data: Optional[ExtratorData] = None
+    prioridade: int = 100                   # menor = extrator tentado antes
+
 
+_EMISSORES: Dict[str, Emissor] = {}
+_KW_EMISSOR: Dict[str, Tuple[str, bool]] = {}      # palavra -> (emissor, define_tipo)
+_KW_RE: Optional[re.Pattern] = None
 
-def _parse_data(texto: str, tipo: str) -> Optional[datetime]:
+
+def registrar_emissor(emissor: Emissor) -> None:
+    """Adiciona/substitui um emissor e recompila a regex única de identificação."""
+    global _KW_RE
+    _EMISSORES[emissor.nome] = emissor
+    _KW_EMISSOR.clear()
+    for e in _EMISSORES.values():
+        for kw in e.rotulos:
+            _KW_EMISSOR.setdefault(kw.lower(), (e.nome, False))
+        for kw in e.palavras:
+            _KW_EMISSOR[kw.lower()] = (e.nome, True)
+    # mais longas primeiro: “sem parar” antes de “sem”, “zul plus” antes de “zul+”
+    kws = sorted(_KW_EMISSOR, key=len, reverse=True)
+    _KW_RE = re.compile("|".join(re.escape(k) for k in kws)) if kws else None
+
+
+def _identificar(texto: str) -> Tuple[str, List[Emissor]]:
+    """Uma passada no texto: (tipo, emissores encontrados em ordem de prioridade)."""
     low = texto.lower()
+    achados: Dict[str, bool] = {}
+    if _KW_RE is not None:
+        for m in _KW_RE.finditer(low):
+            nome, define_tipo = _KW_EMISSOR[m.group(0)]
+            achados[nome] = achados.get(nome, False) or define_tipo
+
+    tipos = {_EMISSORES[n].tipo for n, define in achados.items() if define}
+    if "pedagio" in tipos:
+        tipo = "pedagio"
+    elif "estacionamento" in tipos:
+        tipo = "estacionamento"
+    else:
+        tipo = "desconhecido"
+    emissores = sorted((_EMISSORES[n] for n in achados), key=lambda e: e.prioridade)
+    return tipo, emissores
+
+
+# --- extratores específicos ---
+def _data_mercado_pago(texto: str, tipo: str, toks: List[_Token], pares) -> Optional[datetime]:
+    # “Data da passagem …” -> PRIMEIRA data logo após a frase
+    return _primeira_data_apos(texto, pares, toks, "passagem", janela=120)
+
 
-    # 1) Sinalização Mercado Pago: “Data da passagem …”
-    if "data da passagem" in low:
-        # pega a PRIMEIRA data depois da frase
-        try:
-            pos = low.index("data da passagem")
-            trecho = texto[pos:pos + 120]  # janela curta após a frase
-            for rx in (DATAH_TRACO_RE, DATAH_RE, DATAH_FLEX_RE):
-                m = rx.search(trecho)
-                if m:
-                    d, mth, y = int(m.group("d")), int(m.group("m")), int(m.group("y"))
-                    if y < 100:
-                        y += 2000
-                    hh, mm = int(m.group("h")), int(m.group("mm"))
-                    ss = int(m.group("ss") or 0) if "ss" in m.groupdict() else 0
-                    return _to_dt(y, mth, d, hh, mm, ss)
-        except Exception:
-            pass
-
-    # 2) SIGAPAY (APP/WEB): preferir “Início …”; se não tiver, cair pro genérico
-    ini = None
-    m = SIGAPAY_INICIO_RE.search(texto)
-    if m:
-        d, mth, y = m.group(1).split("/")
-        hh, mm = m.group(2).split(":")
-        ini = _to_dt(int(y), int(mth), int(d), int(hh), int(mm), 0)
-
-    fim = None
-    m2 = SIGAPAY_TERMINO_RE.search(texto)
-    if m2:
-        d, mth, y = m2.group(1).split("/")
-        hh, mm = m2.group(2).split(":")
-        fim = _to_dt(int(y), int(mth), int(d), int(hh), int(mm), 0)
-
-    if ini or fim:
-        # Se for estacionamento, **sempre usar o Início**
-        if "estacion" in (tipo or "").lower() and ini:
-            return ini
-        # fallback: retorna a primeira que existir
-        return ini or fim
-
-    # 3) Genérico: coletar todas e decidir
-    todas = _collect_all_dates(texto)
+def _data_sigapay(texto: str, tipo: str, toks: List[_Token], pares) -> Optional[datetime]:
+    # APP/WEB: “Início …” / “Término …” na mesma linha do rótulo
+    ini = _primeira_data_apos(texto, pares, toks, "inicio", janela=200, mesma_linha=True)
+    fim = _primeira_data_apos(texto, pares, toks, "termino", janela=200, mesma_linha=True)
+    # Se for estacionamento, **sempre usar o Início**
+    if "estacion" in (tipo or "").lower() and ini:
+        return ini
+    # fallback: retorna a primeira que existir
+    return ini or fim
+
+
+for _e in (
+    # pedágio
+    Emissor("pedagio", "pedagio", ("pedágio", "pedagio", "tag", "praça", "praca")),
+    Emissor("veloe", "pedagio", ("veloe",)),
+    Emissor("sem_parar", "pedagio", ("sem parar", "semparar")),
+    Emissor("autoban", "pedagio", ("autoban",)),
+    Emissor("ccr", "pedagio", ("ccr",)),
+    Emissor("rota_das_bandeiras", "pedagio", ("rota das bandeiras",)),
+    Emissor("renovias", "pedagio", ("renovias",)),
+    Emissor("mercado_pago", None, ("mercado pago",), ("data da passagem",), _data_mercado_pago, 10),
+    # estacionamento
+    Emissor("estacionamento", "estacionamento", ("estac", "park", "parquímetro", "parquimetro")),
+    Emissor("vaga_legal", "estacionamento", ("vaga legal",)),
+    Emissor("zona_azul", "estacionamento", ("zona azul",)),
+    Emissor("zul", "estacionamento", ("zul+", "zul plus")),
+    Emissor("estapar", "estacionamento", ("estapar",)),
+    Emissor("sigapay", "estacionamento", ("sigapay",),
+            ("início", "inicio", "término", "termino"), _data_sigapay, 20),
+):
+    registrar_emissor(_e)
+del _e
+
+
+def _parse_data(
+    texto: str,
+    tipo: str,
+    toks: Optional[List[_Token]] = None,
+    emissores: Optional[List[Emissor]] = None,
+) -> Optional[datetime]:
+    if toks is None:
+        toks = _tokenizar(texto)
+    if emissores is None:
+        _, emissores = _identificar(texto)
+    pares = _datas_com_hora(texto, toks)
+
+    # 1) regra do emissor (Mercado Pago, Sigapay...), se houver
+    for e in emissores:
+        if e.extrator_data is None:
+            continue
+        dt = e.extrator_data(texto, tipo, toks, pares)
+        if dt:
+            logging.debug("[OCR] data via emissor=%s", e.nome)
+            return dt
+
+    # 2) Genérico: coletar todas e decidir
+    todas = [dt for _, dt in pares]
     if not todas:
         return None
 
@@ -298,17 +1047,112 @@ def _parse_data(texto: str, tipo: str) -> Optional[datetime]:
 
 
 def _classifica_tipo(texto: str) -> str:
-    low = texto.lower()
-    if any(k in low for k in KW_PEDAGIO):
-        return "pedagio"
-    if any(k in low for k in KW_ESTAC):
-        return "estacionamento"
-    return "desconhecido"
+    return _identificar(texto)[0]
+
+
+# -------------------------------
+# PDF
+# -------------------------------
+# Comprovante em PDF quase sempre tem camada de texto: lê direto (instantâneo) e
+# manda para os mesmos parsers. Só PDF escaneado (sem texto) é rasterizado —
+# apenas as primeiras OCR_PDF_PAGES páginas — e passa pelo OCR normal.
+_PDF_PAGINAS = int(os.getenv("OCR_PDF_PAGES", "2") or 2)
+_PDF_DPI = int(os.getenv("OCR_PDF_DPI", "200") or 200)
+
+
+def _texto_pdf(path_pdf: str) -> str:
+    if not _HAS_PYPDF:
+        _avisar_uma_vez("pypdf não instalado: sem camada de texto dos PDFs; todos vão para pdftoppm + OCR.")
+        return ""
+    try:
+        reader = PdfReader(path_pdf)
+        partes = []
+        for page in reader.pages[:max(1, _PDF_PAGINAS)]:
+            partes.append(page.extract_text() or "")
+        return "\n".join(partes)
+    except Exception as e:
+        logging.warning("[OCR] Falha lendo texto do PDF %s: %s", path_pdf, e)
+        return ""
+
+
+def _rasterizar_pdf(path_pdf: str, pagina: int) -> Optional[Image.Image]:
+    """Uma página (1-based) via pdftoppm (poppler-utils), PNG em memória pelo stdout."""
+    cmd = [
+        "pdftoppm", "-r", str(_PDF_DPI), "-gray", "-png", "-singlefile",
+        "-f", str(pagina), "-l", str(pagina), path_pdf,
+    ]
+    try:
+        out = subprocess.run(
+            cmd, capture_output=True, check=True, timeout=(_OCR_TIMEOUT or None),
+        ).stdout
+    except FileNotFoundError:
+        logging.error("[OCR] pdftoppm não encontrado (instale poppler-utils) — PDF escaneado sem OCR.")
+        return None
+    except Exception as e:
+        logging.warning("[OCR] Falha rasterizando %s p.%d: %s", path_pdf, pagina, e)
+        return None
+    if not out:
+        return None
+    img = Image.open(io.BytesIO(out))
+    img.load()
+    return img
+
+
+def _extrair_pdf(path_pdf: str) -> ExtracaoOCR:
+    texto = _texto_pdf(path_pdf)
+    if len(texto.strip()) >= 20:
+        ext = _extrair_de_texto(texto, "pdf-texto")
+        if ext.valor_centavos is not None or ext.data is not None:
+            return ext
+        logging.info("[OCR] Camada de texto do PDF sem valor/data; tentando OCR das páginas.")
+
+    # escaneado: OCR página a página até ter os 3 campos
+    stem = _stem(path_pdf)
+    melhor: Optional[ExtracaoOCR] = None
+    for pagina in range(1, max(1, _PDF_PAGINAS) + 1):
+        img = _rasterizar_pdf(path_pdf, pagina)
+        if img is None:
+            break
+        ext = _extrair_imagem(img, f"{stem}_p{pagina}")
+        ext.preproc = f"pdf-raster/{ext.preproc}"
+        if melhor is None:
+            melhor = ext
+        else:
+            melhor.tipo = melhor.tipo if melhor.tipo != "desconhecido" else ext.tipo
+            melhor.valor_centavos = melhor.valor_centavos if melhor.valor_centavos is not None else ext.valor_centavos
+            melhor.data = melhor.data or ext.data
+            melhor.texto += "\n" + ext.texto
+        if melhor.tipo != "desconhecido" and melhor.valor_centavos is not None and melhor.data is not None:
+            break
+
+    return melhor or ExtracaoOCR("desconhecido", None, None, texto, "pdf-vazio")
 
 
 # -------------------------------
 # Função principal (API)
 # -------------------------------
+def _extrair_de_texto(texto: str, preproc: str) -> ExtracaoOCR:
+    tipo, emissores = _identificar(texto)
+    toks = _tokenizar(texto)
+    valor = _parse_valor(texto, toks)
+    data = _parse_data(texto, tipo, toks=toks, emissores=emissores)
+    return ExtracaoOCR(tipo=tipo, data=data, valor_centavos=valor, texto=texto, preproc=preproc)
+
+
+def _extrair_imagem(fonte: Union[str, Image.Image], stem: Optional[str] = None) -> ExtracaoOCR:
+    if _OCR_MULTIPASS:
+        return _ocr_em_passes(fonte, stem)
+    img, texto = _ocr_texto(fonte, stem)
+    return _extrair_de_texto(texto, _preproc_nome())
+
+
+def extrair_ocr(path_img: str) -> ExtracaoOCR:
+    """OCR + parsers, sem a janela de meses. Base do cache de OCR (ver ocr_stage)."""
+    if path_img.lower().endswith(".pdf"):
+        return _extrair_pdf(path_img)
+    return _extrair_imagem(path_img)
+
+
 def extrair_dados_comprovante(path_img: str) -> DadosComprovante:
     """
     Lê SOMENTE o conteúdo do arquivo (sem olhar nome) e retorna:
@@ -316,18 +1160,11 @@ def extrair_dados_comprovante(path_img: str) -> DadosComprovante:
       - data (datetime | None) -> None se não achar OU se estiver fora da janela (mês atual/ anterior)
       - valor_centavos (int | None)
     """
-    img, texto = _ocr_texto(path_img)
-    tipo = _classifica_tipo(texto)
-    valor = _parse_valor(texto)
-    data = _validar_janela_meses(_parse_data(texto, tipo))
+    dados = extrair_ocr(path_img).para_dados()
 
-    logging.debug("[OCR] tipo=%s valor=%s data=%s", tipo, valor, data)
+    logging.debug("[OCR] tipo=%s valor=%s data=%s", dados.tipo, dados.valor_centavos, dados.data)
 
-    return DadosComprovante(
-        tipo=tipo,
-        data=(data if data is not None else None),
-        valor_centavos=(int(valor) if valor is not None else None),
-    )
+    return dados
 
 
 # -------------------------------
@@ -337,7 +1174,7 @@ if __name__ == "__main__":
     import sys
     logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
     if len(sys.argv) < 2:
-        print("Uso: python ocr_utils.py <caminho_da_imagem>")
+        print("Uso: python ocr_utils.py <caminho_da_imagem_ou_pdf>")
         sys.exit(1)
     img = sys.argv[1]
     dados = extrair_dados_comprovante(img)
@@ -1,9 +1,13 @@
 import os
 import re
+import json
 import time
 import logging
+import threading
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional, Tuple
+from typing import Dict, FrozenSet, List, Optional, Tuple
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
 
 import yaml
 from selenium import webdriver
@@ -14,8 +18,15 @@ from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 
+from artifacts import salvar_artefato
+from dedupe import despesa_href_esquecer, despesa_href_get, despesa_href_put, despesa_href_recentes
+from matching import IndiceSegmentos, Segmento, PRE_SLACK_PADRAO, POST_SLACK_PADRAO
+from portal_http import PortalHttp, _HAS_REQUESTS, _valor_br
+
 logger = logging.getLogger(__name__)
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 # ------------------------ Datas ------------------------
 _DATETIME_RX = re.compile(r"(\d{2}/\d{2}/\d{4})\s+(\d{2}:\d{2}:\d{2})")
 
@@ -33,15 +44,292 @@ def _br_date_to_dt(txt: str) -> Optional[datetime]:
 def _month_bounds(d: datetime) -> Tuple[datetime, datetime]:
     ini = d.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     if d.month == 12:
-        prox = d.replace(year=d.year + 1, month=1, day=1)
+        prox = ini.replace(year=d.year + 1, month=1)
     else:
-        prox = d.replace(month=d.month + 1, day=1)
+        prox = ini.replace(month=d.month + 1)
     fim = prox - timedelta(seconds=1)
     return ini, fim
 
 def _fdate(d: datetime) -> str:
     return d.strftime("%d/%m/%Y")
 
+# período pesquisado na grade: o mês inteiro (_month_bounds) ou a janela estreita em volta do evento
+Janela = Tuple[datetime, datetime]
+
+def _fjanela(j: Janela) -> str:
+    return f"{j[0]:%d/%m}–{j[1]:%d/%m/%Y}"
+
+# ------------------------ Segmentos (cache por período) ------------------------
+@dataclass
+class _MesEmCache:
+    indice: IndiceSegmentos         # segmentos do mês + regras de casamento (matching.py)
+    linhas: int                     # quantas linhas a grade tinha quando foi lida
+    criado: float                   # time.monotonic()
+
+
+# ------------------------ Grade via JS (1 round trip) ------------------------
+# Identidade da linha: id/data-id do <tr> (se houver) + textos de início|fim.
+_JS_CHAVE = """
+function __celulas(tr) {
+  const tds = tr.querySelectorAll(':scope > td');
+  const txt = (k) => tds.length > k ? (tds[k].innerText || tds[k].textContent || '').trim() : '';
+  return [txt(0), txt(1)];
+}
+function __chave(tr) {
+  const c = __celulas(tr);
+  const rid = tr.id || tr.getAttribute('data-id') || '';
+  return (rid ? rid + '#' : '') + c[0] + '|' + c[1];
+}
+"""
+
+_JS_GRADE = _JS_CHAVE + """
+const rows = document.querySelectorAll(arguments[0]);
+const out = [];
+for (let i = 0; i < rows.length; i++) {
+  const c = __celulas(rows[i]);
+  const links = [];
+  rows[i].querySelectorAll('a[href]').forEach(a => { if (a.href.indexOf('/Despesa/') >= 0) links.push(a.href); });
+  out.push({ini: c[0], fim: c[1], chave: __chave(rows[i]), links: links});
+}
+return JSON.stringify(out);
+"""
+
+_JS_LINHA = _JS_CHAVE + """
+const rows = document.querySelectorAll(arguments[0]);
+const tr = rows[arguments[1]];
+return tr ? [tr, __chave(tr)] : null;
+"""
+
+
+# ------------------------ Formulário de despesa (JS síncrono) ------------------------
+# Tipo + Valor num execute_script, com os eventos que o portal escuta; devolve os
+# elementos de arquivo e de salvar para o send_keys/clique (mesma preferência de
+# _choose_tipo_option: texto da opção, depois value 2/1).
+# -> {tipo, valor, arquivo: <input>, salvar: <button>} | {erro} | null (form diferente)
+_JS_PREENCHER_DESPESA = """
+const chave = arguments[0], valorAlvo = arguments[1], valor = arguments[2], fileSel = arguments[3];
+const norm = (s) => (s || '').normalize('NFD').replace(/[\u0300-\u036f]/g, '').toLowerCase();
+const sel = document.querySelector("select#Tipo, select[name='Tipo']");
+const inp = document.querySelector("input#Valor, input[name='Valor']");
+const arq = document.querySelector(fileSel);
+const btn = document.querySelector("button[type='submit']");
+if (!sel || !inp || !arq || !btn) return null;
+const opcoes = Array.from(sel.options);
+const opt = opcoes.find((o) => norm(o.text).indexOf(chave) >= 0) || opcoes.find((o) => o.value === valorAlvo);
+if (!opt) return {erro: 'tipo'};
+const disparar = (el, ...tipos) => tipos.forEach((t) => el.dispatchEvent(new Event(t, {bubbles: true})));
+sel.value = opt.value;
+opt.selected = true;
+disparar(sel, 'input', 'change');
+inp.focus();
+inp.value = valor;
+disparar(inp, 'input', 'change', 'blur');
+return {tipo: sel.value, valor: inp.value, arquivo: arq, salvar: btn};
+"""
+
+# Tabela de despesas inteira num execute_script: [[célula, ...], ...] (linhas sem <td> fora)
+_JS_TABELA = """
+const out = [];
+document.querySelectorAll(arguments[0]).forEach((tr) => {
+  const tds = tr.querySelectorAll('td');
+  if (tds.length) out.push(Array.from(tds, (td) => (td.innerText || td.textContent || '').trim()));
+});
+return JSON.stringify(out);
+"""
+
+
+# ------------------------ Esperas por evento (JS assíncrono) ------------------------
+# Em vez de sleep + polling pelo geckodriver: o script fica no navegador ouvindo o
+# DOM (MutationObserver) e os eventos do DataTables, e responde assim que a
+# condição vale. Cada espera é UMA ida ao driver.
+
+# Espera o DOM "assentar": `quieto` ms sem mutação (nem "Processando..." do
+# DataTables). Com `exigir`, só conta depois da 1ª mudança (ex.: após Pesquisar).
+# -> {mudou, motivo: 'quieto'|'max', ms}
+_JS_ASSENTAR = """
+const sel = arguments[0], quieto = arguments[1], maximo = arguments[2], exigir = arguments[3];
+const done = arguments[arguments.length - 1];
+const t0 = Date.now();
+let mudou = false, fim = false, tq = null, tmax = null, obs = null, jq = null;
+const el = sel ? document.querySelector(sel) : null;
+const alvo = el ? (el.closest('table') || el) : document.body;
+function ocupado() {
+  const p = document.querySelector('.dataTables_processing');
+  return !!(p && p.offsetParent !== null && getComputedStyle(p).display !== 'none');
+}
+function sair(motivo) {
+  if (fim) return;
+  fim = true;
+  if (obs) obs.disconnect();
+  if (jq) jq.off('.fmespera');
+  clearTimeout(tq); clearTimeout(tmax);
+  done({mudou: mudou, motivo: motivo, ms: Date.now() - t0});
+}
+function armar() { clearTimeout(tq); tq = setTimeout(() => ocupado() ? armar() : sair('quieto'), quieto); }
+function evento() { mudou = true; armar(); }
+obs = new MutationObserver(evento);
+obs.observe(alvo, {childList: true, subtree: true, characterData: true});
+if (window.jQuery && window.jQuery.fn && window.jQuery.fn.dataTable) {
+  jq = window.jQuery(document);
+  jq.on('draw.dt.fmespera xhr.dt.fmespera', evento);
+}
+tmax = setTimeout(() => sair('max'), maximo);
+if (!exigir) armar();
+"""
+
+# Grade pronta: há linhas ('linhas') ou o aviso de vazia ('vazio'); 'timeout' se nada.
+_JS_GRADE_PRONTA = """
+const tabSel = arguments[0], rowSel = arguments[1], vazioSel = arguments[2], maximo = arguments[3];
+const done = arguments[arguments.length - 1];
+let fim = false, tmax = null, obs = null;
+function sair(r) { if (fim) return; fim = true; if (obs) obs.disconnect(); clearTimeout(tmax); done(r); }
+function checar() {
+  if (fim || !document.querySelector(tabSel)) return;
+  if (document.querySelector(rowSel)) sair('linhas');
+  else if (document.querySelector(vazioSel)) sair('vazio');
+}
+obs = new MutationObserver(checar);
+obs.observe(document.documentElement, {childList: true, subtree: true});
+tmax = setTimeout(() => sair('timeout'), maximo);
+checar();
+"""
+
+# Alguma linha da tabela contém TODOS os termos (texto sem acento, minúsculo)? true/false.
+_JS_TERMOS_NA_TABELA = """
+const rowSel = arguments[0], termos = arguments[1], maximo = arguments[2];
+const done = arguments[arguments.length - 1];
+const norm = (s) => (s || '').normalize('NFD').replace(/[\u0300-\u036f]/g, '').toLowerCase();
+let fim = false, tmax = null, obs = null;
+function sair(v) { if (fim) return; fim = true; if (obs) obs.disconnect(); clearTimeout(tmax); done(v); }
+function checar() {
+  if (fim) return;
+  for (const tr of document.querySelectorAll(rowSel)) {
+    const tds = tr.querySelectorAll('td');
+    if (!tds.length) continue;
+    const txt = norm(Array.from(tds, (td) => td.innerText || td.textContent || '').join(' | '));
+    if (termos.every((t) => txt.indexOf(t) >= 0)) { sair(true); return; }
+  }
+}
+obs = new MutationObserver(checar);
+obs.observe(document.documentElement, {childList: true, subtree: true, characterData: true});
+tmax = setTimeout(() => sair(false), maximo);
+checar();
+"""
+
+# Grade inteira pela API do DataTables: page.len(-1) + um draw, e espera o draw
+# terminar. -> {total, linhas_dom, ja_estava} | null (página sem DataTables).
+_JS_DT_MOSTRAR_TUDO = """
+const rowSel = arguments[0], maximo = arguments[1];
+const done = arguments[arguments.length - 1];
+const $ = window.jQuery;
+if (!$ || !$.fn || !$.fn.dataTable) { done(null); return; }
+const r = document.querySelector(rowSel);
+const tab = r ? r.closest('table') : document.querySelector('table.dataTable');
+if (!tab || !$.fn.dataTable.isDataTable(tab)) { done(null); return; }
+const api = $(tab).DataTable();
+const contar = () => tab.querySelectorAll(':scope > tbody > tr').length;
+const resposta = (ja) => ({total: api.page.info().recordsDisplay, linhas_dom: contar(), ja_estava: ja});
+const info = api.page.info();
+if (info.length === -1 || info.pages <= 1) { done(resposta(true)); return; }
+let fim = false;
+const tmax = setTimeout(() => { if (!fim) { fim = true; done(null); } }, maximo);
+api.one('draw', () => { if (!fim) { fim = true; clearTimeout(tmax); done(resposta(false)); } });
+api.page.len(-1).draw(false);
+"""
+
+# teto do execute_async_script (as esperas acima sempre terminam antes, pelo próprio `maximo`)
+_SCRIPT_TIMEOUT_S = 120
+
+
+def _href_exato(hrefs: List[str], dt_ini: datetime) -> Optional[str]:
+    """Link de Despesa da linha: dataInicio com a data E a hora do início do deslocamento."""
+    enc_date = f"{dt_ini.month:02d}%2F{dt_ini.day:02d}%2F{dt_ini.year}"
+    enc_hhmm = f"{dt_ini.hour:02d}%3A{dt_ini.minute:02d}"
+    for href in hrefs:
+        if "/Despesa/" in href and "dataInicio=" in href and enc_date in href and enc_hhmm in href:
+            return href
+    return None
+
+
+# formatos em que uma data do deslocamento pode aparecer na query do link de Despesa
+_FMTS_HREF = (
+    "%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M", "%m/%d/%Y",
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y",
+    "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d",
+)
+_Param = Tuple[str, Optional[str], FrozenSet[Tuple[str, str]]]   # (nome, valor fixo | None, {(ini|fim, formato)})
+
+
+def _datas_do_valor(valor: str, ini: datetime, fim: Optional[datetime]) -> FrozenSet[Tuple[str, str]]:
+    return frozenset(
+        (campo, fmt)
+        for campo, dt in (("ini", ini), ("fim", fim)) if dt is not None
+        for fmt in _FMTS_HREF if dt.strftime(fmt) == valor
+    )
+
+
+class _PadraoHref:
+    """
+    Padrão do link de Despesa aprendido dos hrefs exatos vistos (grade ou menu):
+    mesmo endereço e mesmos parâmetros, cada um fixo ou uma data do deslocamento
+    (início/fim) num formato. Cada href visto estreita os formatos possíveis; um
+    parâmetro fixo que muda de um deslocamento para outro (um id, por ex.) invalida
+    o padrão. Só monta link depois de visto em 2 deslocamentos e sem ambiguidade.
+    """
+
+    def __init__(self):
+        self.descartar()
+
+    def descartar(self) -> None:
+        self._base: Optional[str] = None
+        self._params: List[_Param] = []
+        self._vistos: set = set()      # inícios de deslocamento que confirmaram o padrão
+        self.invalido = False
+
+    @property
+    def confirmado(self) -> bool:
+        return (self._base is not None and not self.invalido and len(self._vistos) >= 2
+                and any(fixo is None for _, fixo, _ in self._params))
+
+    def observar(self, href: str, ini: datetime, fim: Optional[datetime]) -> None:
+        u = urlsplit(href)
+        base = urlunsplit((u.scheme, u.netloc, u.path, "", ""))
+        novos = [(n, v, _datas_do_valor(v, ini, fim)) for n, v in parse_qsl(u.query, keep_blank_values=True)]
+        if base != self._base or [n for n, _, _ in novos] != [n for n, _, _ in self._params]:
+            # 1º href (ou o portal mudou o link): recomeça deste
+            self._base, self._vistos, self.invalido = base, {ini}, False
+            self._params = [(n, None if datas else v, datas) for n, v, datas in novos]
+            return
+        if self.invalido:
+            return
+        params: List[_Param] = []
+        for (n, fixo, datas), (_, v, datas_v) in zip(self._params, novos):
+            if fixo is None:
+                datas = datas & datas_v
+                self.invalido |= not datas
+            elif v != fixo:
+                self.invalido = True
+            params.append((n, fixo, datas))
+        self._params = params
+        self._vistos.add(ini)
+
+    def montar(self, ini: datetime, fim: Optional[datetime]) -> Optional[str]:
+        if not self.confirmado:
+            return None
+        query = []
+        for n, fixo, datas in self._params:
+            if fixo is not None:
+                query.append((n, fixo))
+                continue
+            if fim is None and any(c == "fim" for c, _ in datas):
+                return None
+            valores = {(ini if c == "ini" else fim).strftime(fmt) for c, fmt in datas}
+            if len(valores) != 1:
+                return None   # formatos ainda ambíguos para esta data
+            query.append((n, valores.pop()))
+        return f"{self._base}?{urlencode(query, quote_via=quote)}"
+
+
 # ------------------------ Client ------------------------
 class PortalClient:
     """
@@ -49,9 +337,13 @@ class PortalClient:
       - encontrar_linha_por_data_hora(dt, tipo) -> retorna **href** de /Despesa/Index
       - abrir_despesas_por_href(href) navega até a tela
       - preencher_e_anexar(tipo, valor_centavos, arquivo, data_evento)
+      - lancar_despesa(href, ...) -> HTTP (portal_http.py) com o Firefox de fallback
+
+    O Firefox só sobe no 1º uso de `driver` (ou em preaquecer()) e é fechado por
+    fechar_se_ocioso() depois de navegador.ocioso_seconds sem uso; close() encerra tudo.
     """
 
-    def __init__(self, config_path: str = "config.yaml", headless: bool = True):
+    def __init__(self, config_path: str = "config.yaml", headless: bool = True, worker: int = 0):
         with open(config_path, "r", encoding="utf-8") as f:
             self.cfg = yaml.safe_load(f) or {}
 
@@ -68,9 +360,89 @@ class PortalClient:
         self.row_selector = self.cfg.get("tabela", {}).get("row_selector", "table tbody tr")
         self.form_anexar_sel = self.cfg.get("form", {}).get("anexar_input_selector", "input[type='file']")
 
-        # Navegador (força geckodriver para evitar Selenium Manager no aarch64)
+        # sessão persistente: cookies em disco e/ou perfil dedicado do Firefox
+        scfg = self.cfg.get("sessao", {}) or {}
+        self._cookies_path = os.getenv("PORTAL_COOKIES") or os.path.join(
+            BASE_DIR, scfg.get("cookies_arquivo", "portal_cookies.json"))
+        self._cookies_max_idade = float(scfg.get("cookies_max_horas", 12) or 0) * 3600
+        self._keepalive_s = float(scfg.get("keepalive_seconds", 300) or 0)
+        # sessão vista viva há menos disso -> login detectado só pela URL (sem sondar o DOM)
+        self._sessao_confianca = float(scfg.get("confianca_seconds", 120) or 0)
+        self._sessao_vista = 0.0
+        self._cookies_pendentes: Optional[List[dict]] = None
+
+        # Navegador: sobe sob demanda (ver a property `driver`)
+        ncfg = self.cfg.get("navegador", {}) or {}
+        self.headless = headless
+        self._perfil = os.getenv("FIREFOX_PROFILE") or scfg.get("perfil_dir")
+        if self._perfil and worker > 0:
+            # pool: dois Firefox não abrem o mesmo perfil ("profile in use")
+            self._perfil = f"{self._perfil.rstrip(os.sep)}-{worker}"
+        self._ocioso_s = float(ncfg.get("ocioso_seconds", 900) or 0)
+        self._preaquecer = bool(ncfg.get("preaquecer", True))
+        self._driver = None
+        self._wait: Optional[WebDriverWait] = None
+        self._driver_lock = threading.RLock()
+        self._driver_uso = 0.0
+        self._aquecendo: Optional[threading.Thread] = None
+
+        # segmentos (início, fim, href de Despesas) já lidos da grade, por (ano, mês)
+        ccfg = self.cfg.get("cache_segmentos", {}) or {}
+        self._seg_ttl = float(ccfg.get("ttl_seconds", 600) or 0)
+        self._seg_invalidar_ao_lancar = bool(ccfg.get("invalidar_ao_lancar", False))
+        self._cache_mes: Dict[Janela, _MesEmCache] = {}   # por período pesquisado (mês ou janela)
+        self._estreitas_por_mes: Dict[Tuple[int, int], int] = {}   # janelas estreitas pesquisadas por (ano, mês)
+
+        # links de Despesa sem abrir o menu da linha: índice no ledger + padrão aprendido
+        self._padrao_href = _PadraoHref()
+        self._hrefs_derivados: Dict[str, str] = {}   # href -> "indice" | "padrao" (ainda não visto nesta sessão)
+        try:
+            for ini, fim, href in despesa_href_recentes():
+                self._padrao_href.observar(href, ini, fim)
+        except Exception as e:
+            logger.debug(f"[FM] Índice de hrefs indisponível: {e}")
+
+        # caminho HTTP com os cookies do Firefox (grade + lançamento); Firefox = login e fallback
+        self.http: Optional[PortalHttp] = None
+        if _HAS_REQUESTS and (self.cfg.get("http", {}) or {}).get("enabled", True):
+            self.http = PortalHttp(self.cfg, self.base_url, self.login_url)
+
+        # cookies salvos vão direto para o HTTP; o Firefox recebe quando subir
+        self._cookies_pendentes = self._cookies_salvos()
+        if self._cookies_pendentes and self.http is not None:
+            self.http.importar_cookies(self._cookies_pendentes)
+        if self.http is not None:
+            self.http.iniciar_keepalive(self.base_url, self._keepalive_s, self._cookies_renovados)
+
+    # ---------- ciclo de vida do navegador ----------
+    @property
+    def driver(self):
+        with self._driver_lock:
+            if self._driver is None:
+                self._iniciar_navegador()
+            self._driver_uso = time.monotonic()
+            return self._driver
+
+    @property
+    def wait(self) -> WebDriverWait:
+        d = self.driver
+        if self._wait is None:
+            self._wait = WebDriverWait(d, 20)
+        return self._wait
+
+    @property
+    def navegador_ativo(self) -> bool:
+        return self._driver is not None
+
+    def _iniciar_navegador(self) -> None:
+        """Sobe o Firefox (força geckodriver para evitar Selenium Manager no aarch64)."""
+        t0 = time.monotonic()
         o = FirefoxOptions()
-        if headless:
+        if self._perfil:
+            os.makedirs(self._perfil, exist_ok=True)
+            o.add_argument("-profile")
+            o.add_argument(os.path.abspath(self._perfil))
+        if self.headless:
             o.add_argument("-headless")
             o.add_argument("-width=1440")
             o.add_argument("-height=900")
@@ -79,8 +451,84 @@ class PortalClient:
             o.binary_location = firefox_bin
         gecko_path = os.getenv("GECKODRIVER", "/usr/local/bin/geckodriver")
         service = FirefoxService(executable_path=gecko_path)
-        self.driver = webdriver.Firefox(options=o, service=service)
-        self.wait = WebDriverWait(self.driver, 20)
+        self._driver = webdriver.Firefox(options=o, service=service)
+        self._driver.set_script_timeout(_SCRIPT_TIMEOUT_S)
+        self._wait = None
+        self._driver_uso = time.monotonic()
+        logger.info(f"[FM] Firefox iniciado em {time.monotonic() - t0:.1f}s.")
+
+        # sessão atual (do HTTP, se viva; senão a do arquivo) para dentro do navegador novo
+        cookies = self.http.exportar_cookies() if (self.http is not None and self.http.tem_sessao) else None
+        cookies = cookies or self._cookies_pendentes or self._cookies_salvos()
+        self._cookies_pendentes = None
+        if cookies:
+            try:
+                self._driver.get(self.login_url)   # add_cookie exige estar no domínio
+                n = self._injetar_cookies(cookies)
+                logger.info(f"[FM] Sessão restaurada no Firefox ({n} cookies).")
+            except Exception as e:
+                logger.warning(f"[FM] Não consegui restaurar a sessão no Firefox: {e}")
+
+    def preaquecer(self, em_segundo_plano: bool = True) -> None:
+        """
+        Sobe o Firefox (ex.: arquivo novo chegou, OCR ainda rodando), só se ele vai
+        ser preciso: sem navegador e sem sessão HTTP que resolva sozinha. Por padrão
+        numa thread auxiliar; o pool passa em_segundo_plano=False e sobe na própria
+        thread do worker, que é quem vai usar o driver.
+        """
+        if not self._preaquecer or self._driver is not None:
+            return
+        if self.http is not None and self.http.tem_sessao:
+            return
+        if self._aquecendo is not None and self._aquecendo.is_alive():
+            return
+
+        def _subir():
+            try:
+                self.driver
+            except Exception as e:
+                logger.warning(f"[FM] Pré-aquecimento do Firefox falhou: {e}")
+
+        if not em_segundo_plano:
+            _subir()
+            return
+        self._aquecendo = threading.Thread(target=_subir, name="firefox-preaquecer", daemon=True)
+        self._aquecendo.start()
+
+    def fechar_se_ocioso(self) -> bool:
+        """Fecha o Firefox parado há mais de navegador.ocioso_seconds (libera RAM para o OCR)."""
+        if self._driver is None or self._ocioso_s <= 0:
+            return False
+        if (time.monotonic() - self._driver_uso) < self._ocioso_s:
+            return False
+        if not self._driver_lock.acquire(blocking=False):
+            return False   # subindo/em uso agora
+        try:
+            logger.info(f"[FM] Firefox ocioso há {self._ocioso_s:.0f}s — fechando.")
+            self._fechar_navegador()
+        finally:
+            self._driver_lock.release()
+        return True
+
+    def _fechar_navegador(self) -> None:
+        d, self._driver, self._wait = self._driver, None, None
+        if d is None:
+            return
+        try:
+            if self.http is None or not self.http.tem_sessao:
+                self._salvar_cookies(d.get_cookies())
+        except Exception:
+            pass
+        try:
+            d.quit()
+        except Exception as e:
+            logger.debug(f"[FM] Erro ao fechar o Firefox: {e}")
+
+    def close(self) -> None:
+        if self.http is not None:
+            self.http.parar_keepalive()
+        with self._driver_lock:
+            self._fechar_navegador()
 
     # ---------- utils ----------
     def _scroll_center(self, el):
@@ -103,11 +551,13 @@ class PortalClient:
                 pass
 
     # ---------- login ----------
-    def _is_login_page(self) -> bool:
+    def _is_login_page(self, sondar_dom: bool = True) -> bool:
         try:
             url = (self.driver.current_url or "").rstrip("/")
             if url.endswith("/sb0121") or "/Account/Login" in url:
                 return True
+            if not sondar_dom:
+                return False
             title_ok = "login - fieldmap web" in (self.driver.title or "").lower()
             has_user = bool(self.driver.find_elements(By.CSS_SELECTOR, "input#UserName"))
             has_pass = bool(self.driver.find_elements(By.CSS_SELECTOR, "input#Password"))
@@ -133,9 +583,29 @@ class PortalClient:
         except Exception:
             self.driver.execute_script("document.querySelector(arguments[0])?.click()", self.submit_sel)
         self.wait.until(lambda d: not self._is_login_page())
+        logger.info("[FM] Login feito no Firefox.")
+        self._sessao_vista = time.monotonic()
+        self._exportar_cookies()
+        self._salvar_cookies(self.driver.get_cookies())
+
+    def _exportar_cookies(self) -> None:
+        """Copia a sessão do Firefox para o caminho HTTP."""
+        if self.http is None:
+            return
+        try:
+            ua = self.driver.execute_script("return navigator.userAgent")
+            n = self.http.importar_cookies(self.driver.get_cookies(), ua)
+            logger.debug(f"[http] {n} cookie(s) exportado(s) do Firefox.")
+        except Exception as e:
+            logger.debug(f"[http] Não consegui exportar os cookies: {e}")
+
+    def _sessao_recente(self) -> bool:
+        vista = max(self._sessao_vista, self.http.ultimo_ok if self.http is not None else 0.0)
+        return (time.monotonic() - vista) < self._sessao_confianca
 
     def ensure_logged(self):
-        if self._is_login_page():
+        self._aplicar_cookies_pendentes()
+        if self._is_login_page(sondar_dom=not self._sessao_recente()):
             self.login()
             return
         try:
@@ -204,6 +674,19 @@ class PortalClient:
         end = time.time() + timeout
         last_exc = None
         while time.time() < end:
+            # 1 script esperando no navegador (MutationObserver) até linhas ou “sem registros”
+            restante_ms = int(max(0.1, end - time.time()) * 1000)
+            try:
+                r = d.execute_async_script(_JS_GRADE_PRONTA, table_sel, row_sel, empty_sel, restante_ms)
+                if r == "linhas":
+                    return True
+                if r == "vazio":
+                    return False  # grade vazia
+                if r == "timeout":
+                    break
+            except Exception as e:
+                # página trocou no meio (submit da pesquisa) ou driver sem script assíncrono
+                last_exc = e
             try:
                 WebDriverWait(d, 8).until(
                     EC.presence_of_element_located((By.CSS_SELECTOR, table_sel))
@@ -218,19 +701,68 @@ class PortalClient:
                 last_exc = e
                 time.sleep(0.3)
 
-        # dumps opcionais de debug
-        try:
-            with open("debug_grade_timeout.html", "w", encoding="utf-8") as f:
-                f.write(d.page_source)
-            d.save_screenshot("debug_grade_timeout.png")
-        except Exception:
-            pass
+        self.salvar_debug(f"grade_timeout_{datetime.now():%Y%m%d_%H%M%S}")
         raise TimeoutException("Grade não ficou pronta.") from last_exc
 
+    def salvar_debug(self, bundle: str) -> None:
+        """
+        HTML + screenshot da página atual no bundle `bundle` (ver artifacts.py).
+        Só a captura é feita aqui (o driver não é thread-safe); gravar fica em segundo plano.
+        """
+        if self.http is not None and self.http.ultima is not None:
+            url, html = self.http.ultima
+            salvar_artefato(bundle, "http.html", f"<!-- {url} -->\n{html}")
+        d = self._driver
+        if d is None:
+            return   # Firefox não estava aberto: não sobe só para tirar print
+        try:
+            salvar_artefato(bundle, "pagina.html", f"<!-- {d.current_url} -->\n{d.page_source}")
+            salvar_artefato(bundle, "tela.png", d.get_screenshot_as_png())
+        except Exception as e:
+            logger.debug(f"[debug] Não consegui capturar a página: {e}")
+
+    def _esperar_assentar(self, sel: Optional[str], maximo_s: float, exigir_mudanca: bool = False) -> Optional[dict]:
+        """
+        Espera o DOM em volta de `sel` ficar quieto (tabela.quieto_ms) — ver _JS_ASSENTAR.
+        None = não deu para esperar por evento (página trocou, script falhou): o
+        chamador decide a pausa fixa.
+        """
+        quieto = int(self.cfg.get("tabela", {}).get("quieto_ms", 250) or 250)
+        try:
+            r = self.driver.execute_async_script(_JS_ASSENTAR, sel, quieto, int(maximo_s * 1000), bool(exigir_mudanca))
+        except Exception as e:
+            logger.debug(f"[FM] Espera por evento indisponível ({type(e).__name__}); pausa fixa.")
+            return None
+        return r if isinstance(r, dict) else None
+
+    def _mostrar_tudo_datatables(self) -> Optional[int]:
+        """
+        Se a grade é um DataTables, pede todas as linhas de uma vez (page.len(-1)).
+        Devolve o total de registros, ou None sem API (aí vale o scroll).
+        """
+        timeout = int(self.cfg.get("tabela", {}).get("wait_ready_seconds", 30) or 30)
+        try:
+            r = self.driver.execute_async_script(_JS_DT_MOSTRAR_TUDO, self.row_selector, timeout * 1000)
+        except Exception as e:
+            logger.debug(f"[FM] API do DataTables indisponível ({type(e).__name__}); usando scroll.")
+            return None
+        if not isinstance(r, dict):
+            return None
+        if int(r.get("linhas_dom") or 0) < int(r.get("total") or 0):
+            # renderização sob demanda (Scroller etc.): nem tudo vira <tr> — o scroll resolve
+            logger.debug(f"[FM] DataTables com {r.get('total')} registros mas {r.get('linhas_dom')} no DOM; usando scroll.")
+            return None
+        logger.debug(f"[FM] Grade completa pela API do DataTables ({r.get('total')} registros"
+                     f"{', já estava' if r.get('ja_estava') else ''}).")
+        return int(r.get("total") or 0)
+
     def _carregar_todas_as_linhas(self) -> list:
         """
-        Faz scroll até o fim para carregar TODAS as linhas (infinite scroll/paginação).
+        Carrega TODAS as linhas da grade. Com DataTables, é uma chamada à API
+        (_mostrar_tudo_datatables); sem, scroll até o fim (infinite scroll/paginação).
         Para quando a contagem estabilizar por N passes ou atingir max_scrolls.
+        Depois de cada scroll espera o DOM assentar (no máximo scroll_sleep): a
+        espera por evento só encurta o passe, não encerra a carga.
         """
         d = self.driver
         row_sel = self.row_selector
@@ -240,6 +772,9 @@ class PortalClient:
         stabilize_passes = int(tcfg.get("stabilize_passes", 2) or 2)
         sleep_between = float(tcfg.get("scroll_sleep", 0.35) or 0.35)
 
+        if self._mostrar_tudo_datatables() is not None:
+            return d.find_elements(By.CSS_SELECTOR, row_sel)
+
         stable_hits = 0
         last_count = -1
         for _ in range(max_scrolls):
@@ -247,15 +782,15 @@ class PortalClient:
             cur_count = len(rows)
 
             # tenta acionar “mostrar mais/seguinte” se existir
+            # (texto só por XPath — ':contains' não é CSS; paginação do DataTables fica com a API acima)
             clicked_extra = False
-            for sel in (
-                "button.load-more, .load-more button, a.load-more",
-                "button:contains('Mostrar mais')",
-                "a:contains('Próximo'), button:contains('Próximo')",
-                "ul.pagination li a[rel='next']",
+            for by, sel in (
+                (By.CSS_SELECTOR, "button.load-more, .load-more button, a.load-more"),
+                (By.XPATH, "//button[contains(normalize-space(.), 'Mostrar mais')]"),
+                (By.CSS_SELECTOR, "ul.pagination li a[rel='next']"),
             ):
                 try:
-                    btns = d.find_elements(By.CSS_SELECTOR, sel)
+                    btns = d.find_elements(by, sel)
                 except Exception:
                     btns = []
                 for b in btns:
@@ -268,7 +803,9 @@ class PortalClient:
 
             # scroll até o fim
             d.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(sleep_between)
+            r = self._esperar_assentar(row_sel, sleep_between, exigir_mudanca=True)
+            if r is None:
+                time.sleep(sleep_between)
 
             rows = d.find_elements(By.CSS_SELECTOR, row_sel)
             new_count = len(rows)
@@ -284,11 +821,79 @@ class PortalClient:
 
     def ensure_on_deslocamento_index(self):
         """Navega para a tela, garante login e o body pronto."""
+        self._aplicar_cookies_pendentes()
         self.driver.get(self.base_url)
-        if self._is_login_page():
+        if self._is_login_page(sondar_dom=not self._sessao_recente()):
             self.login()
             self.driver.get(self.base_url)
         self.wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+        self._sessao_vista = time.monotonic()
+        if self.http is not None and not self.http.tem_sessao:
+            self._exportar_cookies()
+
+    # ---------- sessão persistente ----------
+    def _salvar_cookies(self, cookies: List[dict]) -> None:
+        """Cookies da sessão em disco (0600), para o próximo start não precisar de login."""
+        if not self._cookies_path or not cookies:
+            return
+        try:
+            # tmp único: com o pool de portal, vários clientes gravam o mesmo arquivo
+            tmp = f"{self._cookies_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            fd = os.open(tmp, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"salvo_em": time.time(), "cookies": cookies}, f)
+            os.replace(tmp, self._cookies_path)
+        except Exception as e:
+            logger.warning(f"[FM] Falha ao salvar cookies da sessão: {e}")
+
+    def _cookies_salvos(self) -> Optional[List[dict]]:
+        """
+        Cookies gravados por _salvar_cookies, se ainda novos. Não valida aqui: se o
+        portal não aceitar, a 1ª navegação cai no login e segue o fluxo normal.
+        """
+        try:
+            with open(self._cookies_path, "r", encoding="utf-8") as f:
+                salvo = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"[FM] Cookies da sessão ilegíveis ({e}); login completo.")
+            return None
+        idade = time.time() - float(salvo.get("salvo_em") or 0)
+        if self._cookies_max_idade > 0 and idade > self._cookies_max_idade:
+            logger.info("[FM] Cookies salvos velhos demais (%.0f h); login completo.", idade / 3600)
+            return None
+        cookies = [c for c in (salvo.get("cookies") or []) if isinstance(c, dict) and c.get("name")]
+        if cookies:
+            logger.info("[FM] Sessão salva em %s (%d cookies, %.0f min).", self._cookies_path, len(cookies), idade / 60)
+        return cookies or None
+
+    def _injetar_cookies(self, cookies: List[dict]) -> int:
+        n = 0
+        for c in cookies:
+            ck = {k: c[k] for k in ("name", "value", "path", "domain", "secure", "httpOnly", "expiry", "sameSite") if k in c}
+            try:
+                self.driver.add_cookie(ck)
+                n += 1
+            except Exception:
+                continue
+        return n
+
+    def _cookies_renovados(self, cookies: List[dict]) -> None:
+        """Callback do keepalive (outra thread): grava em disco; o Firefox recebe no próximo uso."""
+        self._salvar_cookies(cookies)
+        self._cookies_pendentes = cookies
+
+    def _aplicar_cookies_pendentes(self) -> None:
+        if self._driver is None:
+            return   # quando subir, _iniciar_navegador aplica
+        cookies, self._cookies_pendentes = self._cookies_pendentes, None
+        if not cookies:
+            return
+        try:
+            self._injetar_cookies(cookies)   # mesmo domínio: o Firefox já está no portal
+        except Exception as e:
+            logger.debug(f"[FM] Não consegui repassar cookies renovados ao Firefox: {e}")
 
     # ---------- menu -> href 'Despesas' ----------
     def _open_menu_and_get_despesas(self, row_el, dt_ini: datetime) -> Optional[str]:
@@ -321,13 +926,11 @@ class PortalClient:
 
         links = menu.find_elements(By.CSS_SELECTOR, "a.dropdown-item, a, button")
         best, fallback = None, None
-        enc_date = f"{dt_ini.month:02d}%2F{dt_ini.day:02d}%2F{dt_ini.year}"
-        enc_hhmm = f"{dt_ini.hour:02d}%3A{dt_ini.minute:02d}"
         for a in links:
             href = (a.get_attribute("href") or "")
             text = (a.text or "").lower()
             if "/Despesa/" in href:
-                if "dataInicio=" in href and enc_date in href and enc_hhmm in href:
+                if _href_exato([href], dt_ini):
                     best = href
                     break
                 if fallback is None:
@@ -336,6 +939,65 @@ class PortalClient:
                 fallback = href
         return best or fallback
 
+    # ---------- href 'Despesas' sem o menu ----------
+    def _hrefs_vistos(self, segmentos: List[Segmento]) -> None:
+        """Hrefs exatos lidos do portal: alimentam o padrão e o índice persistido."""
+        vistos = [sg for sg in segmentos if sg.href and _href_exato([sg.href], sg.ini)]
+        for sg in vistos:
+            self._padrao_href.observar(sg.href, sg.ini, sg.fim)
+            self._hrefs_derivados.pop(sg.href, None)
+        try:
+            despesa_href_put((sg.ini, sg.fim, sg.href) for sg in vistos)
+        except Exception as e:
+            logger.debug(f"[FM] Não consegui gravar hrefs no índice: {e}")
+
+    def _href_sem_menu(self, sg: Segmento) -> Optional[str]:
+        """
+        Href de Despesas do segmento sem abrir o dropdown da linha: do índice (href já
+        visto para este início) ou montado pelo padrão aprendido — este conferido por
+        HTTP antes, quando há sessão. None = abrir o menu.
+        """
+        try:
+            href = despesa_href_get(sg.ini)
+        except Exception:
+            href = None
+        if href:
+            self._hrefs_derivados.setdefault(href, "indice")
+            return href
+
+        href = self._padrao_href.montar(sg.ini, sg.fim)
+        if not href:
+            return None
+        if self.http is not None and self.http.abre_despesas(href) is False:
+            logger.info("[FM] Href montado pelo padrão não abriu a tela de despesas — usando o menu.")
+            self._padrao_href.descartar()
+            return None
+        logger.info("[FM] Href de Despesas montado pelo padrão (%s), sem abrir o menu.",
+                    sg.ini.strftime("%d/%m %H:%M:%S"))
+        self._hrefs_derivados[href] = "padrao"
+        return href
+
+    def _href_do_segmento(self, sg: Optional[Segmento]) -> Optional[str]:
+        """sg.href; se a grade não trouxe o link, tenta _href_sem_menu (e guarda no segmento)."""
+        if sg is None:
+            return None
+        if not sg.href:
+            sg.href = self._href_sem_menu(sg)
+        return sg.href
+
+    def _esquecer_href(self, href: str) -> None:
+        """Href derivado que não abriu: sai do índice (e o padrão recomeça, se veio dele)."""
+        origem = self._hrefs_derivados.pop(href, None)
+        if origem is None:
+            return
+        logger.info(f"[FM] Href de Despesas ({origem}) não abriu — esquecido; próxima busca usa o menu.")
+        if origem == "padrao":
+            self._padrao_href.descartar()
+        try:
+            despesa_href_esquecer(href)
+        except Exception as e:
+            logger.debug(f"[FM] Não consegui apagar href do índice: {e}")
+
     # ---------- localizar por data/hora ----------
     # def encontrar_linha_por_data_hora(self, dt_evento: datetime, tipo: str) -> Optional[str]:
     #     """
@@ -497,122 +1159,289 @@ class PortalClient:
     def encontrar_linha_por_data_hora(self, dt_evento: datetime, tipo: str) -> Optional[str]:
         """
         Retorna o href da tela de Despesas da linha correta.
-        Consolidado: chama _esperar_grade_pronta() uma única vez e depois carrega todas as linhas
-        com _carregar_todas_as_linhas().
+
+        Pesquisa primeiro uma janela estreita (dia do evento ± tabela.janela_dias, dentro
+        do mês) e só amplia para o mês inteiro se ali não houver resposta confiável —
+        ver _escolher. Cada período tem seu cache (cache_segmentos.ttl_seconds); o do
+        mês, se existir, responde antes de qualquer pesquisa, e qualquer janela em cache
+        que cubra a janela do evento responde antes de uma pesquisa nova. Depois de
+        tabela.janelas_por_mes janelas pesquisadas no mesmo mês (lote de comprovantes de
+        dias diferentes), pesquisa direto o mês — uma carga da grade serve o resto.
         """
         if not dt_evento:
             return None
 
+        mes = _month_bounds(dt_evento)
+        ent = self._mes_em_cache(mes)
+        if ent is not None:
+            sg = ent.indice.escolher(dt_evento, tipo)
+            if self._href_do_segmento(sg):
+                logger.info("[FM] dt_evento=%s | cache de %s: %s–%s",
+                            dt_evento.strftime("%d/%m %H:%M:%S"), _fjanela(mes),
+                            sg.ini.strftime("%d/%m %H:%M:%S"), sg.fim.strftime("%d/%m %H:%M:%S"))
+                return sg.href
+            # sem segmento (ou sem href ainda): olha a grade do mês — pode ter deslocamento novo
+            return self._procurar(mes, dt_evento, tipo)
+
+        estreita = self._janela_estreita(dt_evento)
+        if estreita is not None:
+            href = self._href_em_janela_coberta(estreita, dt_evento, tipo)
+            if href:
+                return href
+        if estreita is not None and not self._mes_concorrido(dt_evento):
+            chave_mes = (dt_evento.year, dt_evento.month)
+            self._estreitas_por_mes[chave_mes] = self._estreitas_por_mes.get(chave_mes, 0) + 1
+            href = self._procurar(estreita, dt_evento, tipo)
+            if href:
+                return href
+            logger.info("[FM] Nada confiável em %s — ampliando para o mês.", _fjanela(estreita))
+        return self._procurar(mes, dt_evento, tipo)
+
+    def _href_em_janela_coberta(self, estreita: Janela, dt_evento: datetime, tipo: str) -> Optional[str]:
+        """Href de um período em cache que contém a janela do evento (outro dia já pesquisado)."""
+        for janela in list(self._cache_mes):
+            if not (janela[0] <= estreita[0] and estreita[1] <= janela[1]):
+                continue
+            ent = self._mes_em_cache(janela)
+            if ent is None:
+                continue
+            sg = self._escolher(ent, janela, dt_evento, tipo)
+            if self._href_do_segmento(sg):
+                logger.info("[FM] dt_evento=%s | cache de %s: %s–%s",
+                            dt_evento.strftime("%d/%m %H:%M:%S"), _fjanela(janela),
+                            sg.ini.strftime("%d/%m %H:%M:%S"), sg.fim.strftime("%d/%m %H:%M:%S"))
+                return sg.href
+        return None
+
+    def _mes_concorrido(self, dt_evento: datetime) -> bool:
+        """Já houve tabela.janelas_por_mes janelas estreitas neste mês: vale carregar o mês."""
+        limite = int(self.cfg.get("tabela", {}).get("janelas_por_mes", 2) or 0)
+        n = self._estreitas_por_mes.get((dt_evento.year, dt_evento.month), 0)
+        if limite <= 0 or n < limite:
+            return False
+        logger.info("[FM] %d janela(s) estreita(s) em %02d/%d — carregando o mês inteiro.",
+                    n, dt_evento.month, dt_evento.year)
+        return True
+
+    def _janela_estreita(self, dt_evento: datetime) -> Optional[Janela]:
+        """Dia do evento ± tabela.janela_dias, recortado ao mês; None se desligado ou = mês."""
+        dias = int(self.cfg.get("tabela", {}).get("janela_dias", 1) or 0)
+        if dias <= 0:
+            return None
+        mes = _month_bounds(dt_evento)
+        dia = dt_evento.replace(hour=0, minute=0, second=0, microsecond=0)
+        janela = (max(mes[0], dia - timedelta(days=dias)),
+                  min(mes[1], dia + timedelta(days=dias + 1, seconds=-1)))
+        return None if janela == mes else janela
+
+    def _escolher(self, ent: _MesEmCache, janela: Janela, dt_evento: datetime, tipo: str) -> Optional[Segmento]:
+        """
+        Casamento no período lido. Numa janela estreita, um deslocamento que começou
+        antes dela (e ficou de fora) pode ser o dono do evento — estacionamento entre o
+        fim dele e o início do próximo. Só confia na janela se algum segmento lido
+        começa até o evento (ou se a janela já começa no 1º dia do mês, como a busca
+        mensal); senão None, e quem chamou amplia para o mês.
+        """
+        sg = ent.indice.escolher(dt_evento, tipo)
+        if sg is None or janela[0] <= _month_bounds(dt_evento)[0]:
+            return sg
+        segs = ent.indice.segmentos
+        return sg if segs and segs[0].ini <= dt_evento else None
+
+    def _procurar(self, janela: Janela, dt_evento: datetime, tipo: str) -> Optional[str]:
+        """
+        Href no período `janela`: cache do período; grade por HTTP (portal_http.py), que
+        costuma já trazer o link; senão o Firefox carrega a grade uma vez
+        (_esperar_grade_pronta + _carregar_todas_as_linhas) e só relê as células se a
+        quantidade de linhas mudou ou a linha não confere mais. A leitura é um único
+        execute_script (_JS_GRADE); o casamento roda em Python.
+        """
+        ent = self._mes_em_cache(janela)
+        if ent is not None:
+            sg = self._escolher(ent, janela, dt_evento, tipo)
+            if self._href_do_segmento(sg):
+                logger.info("[FM] dt_evento=%s | cache de %s: %s–%s",
+                            dt_evento.strftime("%d/%m %H:%M:%S"), _fjanela(janela),
+                            sg.ini.strftime("%d/%m %H:%M:%S"), sg.fim.strftime("%d/%m %H:%M:%S"))
+                return sg.href
+
+        ent = self._segmentos_http(janela, dt_evento) or ent
+        if ent is not None:
+            sg = self._escolher(ent, janela, dt_evento, tipo)
+            if self._href_do_segmento(sg):
+                return sg.href
+            # nada casou ou linha sem link: o Firefox confere (grade pode estar paginada/no JS)
+
         self.ensure_on_deslocamento_index()
-        self._fixar_periodo_do_mes(dt_evento)
+        self._fixar_periodo(*janela)
 
         # 1) espera grade ficar pronta (sem duplicar lógica)
         ready = self._esperar_grade_pronta(
             timeout=int(self.cfg.get("tabela", {}).get("wait_ready_seconds", 30) or 30)
         )
         if not ready:
-            return None  # mês sem registros
+            self._cache_mes.pop(janela, None)
+            return None  # período sem registros
 
         # 2) carrega todas as linhas antes de analisar
         rows = self._carregar_todas_as_linhas()
         if not rows:
+            self._cache_mes.pop(janela, None)
             return None
 
-        # ---- a partir daqui, mesma lógica de parsing/segmentos que você já tem ----
-        d = self.driver
-        row_sel = self.row_selector
+        # 3) segmentos: do cache se a grade tem as mesmas linhas; senão relê tudo
+        reaproveitado = ent is not None and ent.linhas == len(rows)
+        if not reaproveitado:
+            ent = self._ler_segmentos(janela, rows, dt_evento)
+            if ent is None:
+                return None
 
-        def _safe_text(el) -> str:
-            for _ in range(2):
-                try:
-                    return (el.text or "").strip()
-                except Exception:
-                    time.sleep(0.05)
-            return ""
+        for _ in range(2):
+            sg = self._escolher(ent, janela, dt_evento, tipo)
+            if self._href_do_segmento(sg):
+                return sg.href  # link do DOM (leitura da grade), do índice ou do padrão
+            tr = self._linha_do_segmento(sg) if sg is not None else None
+            if tr is not None or not reaproveitado:
+                break
+            # cache não bate com a grade (linha editada/reordenada): relê uma vez
+            logger.info("[FM] Cache de %s não confere com a grade — relendo.", _fjanela(janela))
+            reaproveitado = False
+            ent = self._ler_segmentos(janela, self.driver.find_elements(By.CSS_SELECTOR, self.row_selector), dt_evento)
+            if ent is None:
+                return None
 
-        segmentos = []
-        for idx in range(len(rows)):
-            try:
-                rows_now = d.find_elements(By.CSS_SELECTOR, row_sel)
-                if idx >= len(rows_now):
-                    break
-                tr = rows_now[idx]
-                tds = tr.find_elements(By.TAG_NAME, "td")
-            except Exception:
-                continue
+        if sg is None or tr is None:
+            return None
+        sg.href = self._open_menu_and_get_despesas(tr, sg.ini)
+        self._hrefs_vistos([sg])
+        return sg.href
 
-            from datetime import datetime as _dt
-            ini = fim = None
-            if len(tds) >= 2:
-                # suas funções auxiliares existentes:
-                ini = _br_date_to_dt(_safe_text(tds[0]))
-                fim = _br_date_to_dt(_safe_text(tds[1]))
+    # ---------- cache de segmentos ----------
+    def _slacks(self) -> Tuple[int, int]:
+        mcfg = self.cfg.get("matching", {}) if hasattr(self, "cfg") else {}
+        pre_slack = int(mcfg.get("estacion_pre_end_slack_sec", PRE_SLACK_PADRAO))
+        post_slack = int(mcfg.get("estacion_post_end_slack_sec", POST_SLACK_PADRAO))
+        return pre_slack, post_slack
+
+    def _mes_em_cache(self, janela: Janela) -> Optional[_MesEmCache]:
+        ent = self._cache_mes.get(janela)
+        if ent is None:
+            return None
+        if self._seg_ttl <= 0 or (time.monotonic() - ent.criado) > self._seg_ttl:
+            self._cache_mes.pop(janela, None)
+            return None
+        return ent
+
+    def invalidar_cache_segmentos(self, ref: Optional[datetime] = None) -> None:
+        """Esquece os segmentos do mês de `ref` (mês e janelas dele), ou de tudo, sem `ref`."""
+        if ref is None:
+            self._cache_mes.clear()
+            return
+        for janela in [j for j in self._cache_mes if (j[0].year, j[0].month) == (ref.year, ref.month)]:
+            self._cache_mes.pop(janela, None)
+
+    def _ler_segmentos(self, janela: Janela, rows: list, dt_evento: datetime) -> Optional[_MesEmCache]:
+        """Lê início/fim de todas as linhas carregadas e guarda no cache do período."""
+        linhas = self._ler_linhas_js()
+        if linhas is None:
+            linhas = self._ler_linhas_webdriver(rows)
+        return self._montar_segmentos(janela, linhas, dt_evento)
+
+    def _segmentos_http(self, janela: Janela, dt_evento: datetime) -> Optional[_MesEmCache]:
+        """Grade do período por HTTP, sem abrir a tela; None = usar o Firefox."""
+        if self.http is None or not self.http.tem_sessao:
+            return None
+        linhas = self.http.ler_grade(*janela)
+        if not linhas:
+            return None
+        logger.info("[FM] Grade de %s lida por HTTP (%d linhas).", _fjanela(janela), len(linhas))
+        return self._montar_segmentos(janela, linhas, dt_evento)
+
+    def _montar_segmentos(self, janela: Janela, linhas: List[dict], dt_evento: datetime) -> Optional[_MesEmCache]:
+        """Linhas no formato de _JS_GRADE -> segmentos indexados no cache do período."""
+        segmentos: List[Segmento] = []
+        for idx, ln in enumerate(linhas):
+            ini = _br_date_to_dt(ln["ini"])
+            fim = _br_date_to_dt(ln["fim"])
             if ini and fim and fim < ini:
                 ini, fim = fim, ini
             if ini and fim:
-                segmentos.append((ini, fim, idx))
+                segmentos.append(Segmento(ini, fim, idx, ln["chave"], _href_exato(ln.get("links") or [], ini)))
 
         if not segmentos:
+            self._cache_mes.pop(janela, None)
             return None
 
-        segmentos.sort(key=lambda t: t[0])
+        segmentos.sort(key=lambda sg: sg.ini)
+        self._hrefs_vistos(segmentos)
 
         # log auxiliar
         try:
-            dump = [f"[{i}] {a[0].strftime('%d/%m %H:%M:%S')}–{a[1].strftime('%d/%m %H:%M:%S')}" for i, a in enumerate(segmentos)]
+            dump = [f"[{i}] {sg.ini.strftime('%d/%m %H:%M:%S')}–{sg.fim.strftime('%d/%m %H:%M:%S')}" for i, sg in enumerate(segmentos)]
             logger.info("[FM] dt_evento=%s | segmentos=%s", dt_evento.strftime("%d/%m %H:%M:%S"), ", ".join(dump))
         except Exception:
             pass
 
-        alvo_tipo = (tipo or "").lower()
+        ent = _MesEmCache(IndiceSegmentos(segmentos, *self._slacks()), len(linhas), time.monotonic())
+        self._cache_mes[janela] = ent
+        return ent
 
-        # — Pedágio: dentro da janela do deslocamento
-        if "pedag" in alvo_tipo:
-            candidatos = [(ini, fim, idx) for (ini, fim, idx) in segmentos if ini <= dt_evento <= fim]
-            if not candidatos:
-                return None
-            candidatos.sort(key=lambda t: (t[1] - t[0]).total_seconds())
-            ini, fim, idx = candidatos[0]
-            rows_now = d.find_elements(By.CSS_SELECTOR, row_sel)
-            if idx >= len(rows_now):
-                return None
-            return self._open_menu_and_get_despesas(rows_now[idx], ini)
+    def _ler_linhas_js(self) -> Optional[List[dict]]:
+        """Grade inteira num execute_script: [{ini, fim, chave, links}] na ordem do DOM."""
+        try:
+            bruto = self.driver.execute_script(_JS_GRADE, self.row_selector)
+            linhas = json.loads(bruto) if isinstance(bruto, str) else None
+        except Exception as e:
+            logger.debug(f"[FM] Leitura da grade via JS falhou ({e}); lendo célula a célula.")
+            return None
+        return linhas if isinstance(linhas, list) else None
 
-        # — Estacionamento: tolerância configurável ao redor do fim
-        mcfg = self.cfg.get("matching", {}) if hasattr(self, "cfg") else {}
-        pre_slack = int(mcfg.get("estacion_pre_end_slack_sec", 900))   # 15 min
-        post_slack = int(mcfg.get("estacion_post_end_slack_sec", 300)) # 5  min
-        for i, (ini, fim, idx) in enumerate(segmentos):
-            # caiu dentro do deslocamento
-            if ini <= dt_evento <= fim:
-                rows_now = d.find_elements(By.CSS_SELECTOR, row_sel)
-                if idx < len(rows_now):
-                    return self._open_menu_and_get_despesas(rows_now[idx], ini)
+    def _ler_linhas_webdriver(self, rows: list) -> List[dict]:
+        """Fallback: célula a célula pelo WebDriver (lento: várias idas ao geckodriver por linha)."""
+        d = self.driver
+        row_sel = self.row_selector
+
+        def _safe_text(el) -> str:
+            for _ in range(2):
+                try:
+                    return (el.text or "").strip()
+                except Exception:
+                    time.sleep(0.05)
+            return ""
 
-            # janela de tolerância em torno do fim
-            if (fim - timedelta(seconds=pre_slack)) <= dt_evento <= (fim + timedelta(seconds=post_slack)):
+        linhas: List[dict] = []
+        rows_now = d.find_elements(By.CSS_SELECTOR, row_sel)
+        for idx in range(min(len(rows), len(rows_now))):
+            t_ini = t_fim = ""
+            try:
+                tr = rows_now[idx]
+                tds = tr.find_elements(By.TAG_NAME, "td")
+                rid = tr.get_attribute("id") or tr.get_attribute("data-id") or ""
+            except StaleElementReferenceException:
                 rows_now = d.find_elements(By.CSS_SELECTOR, row_sel)
-                if idx < len(rows_now):
-                    return self._open_menu_and_get_despesas(rows_now[idx], ini)
-
-            # regra “entre fim atual e início do próximo”
-            prox_ini = segmentos[i + 1][0] if i + 1 < len(segmentos) else None
-            if prox_ini:
-                if fim <= dt_evento < prox_ini:
-                    rows_now = d.find_elements(By.CSS_SELECTOR, row_sel)
-                    if idx < len(rows_now):
-                        return self._open_menu_and_get_despesas(rows_now[idx], ini)
-            else:
-                if dt_evento >= fim:
-                    rows_now = d.find_elements(By.CSS_SELECTOR, row_sel)
-                    if idx < len(rows_now):
-                        return self._open_menu_and_get_despesas(rows_now[idx], ini)
+                tds, rid = [], ""
+            except Exception:
+                tds, rid = [], ""
+            if len(tds) >= 2:
+                t_ini, t_fim = _safe_text(tds[0]), _safe_text(tds[1])
+            chave = (f"{rid}#" if rid else "") + f"{t_ini}|{t_fim}"
+            linhas.append({"ini": t_ini, "fim": t_fim, "chave": chave, "links": []})
+        return linhas
 
-        return None
+    def _linha_do_segmento(self, sg: Segmento):
+        """<tr> do segmento na grade atual, só se a identidade da linha ainda confere."""
+        try:
+            res = self.driver.execute_script(_JS_LINHA, self.row_selector, sg.idx)
+        except Exception:
+            return None
+        if not res:
+            return None
+        tr, chave = res
+        return tr if chave == sg.chave else None
 
 
     # ---------- filtro período ----------
-    def _fixar_periodo_do_mes(self, ref: datetime):
+    def _fixar_periodo(self, ini: datetime, fim: datetime):
         d = self.driver
         try:
             inp_ini = d.find_element(By.CSS_SELECTOR, "input#dataInicialPesquisa, input[name='dataInicialPesquisa']")
@@ -620,13 +1449,14 @@ class PortalClient:
         except Exception:
             return
 
-        ini, fim = _month_bounds(ref)
         self._set_input_value_js(inp_ini, _fdate(ini))
         self._set_input_value_js(inp_fim, _fdate(fim))
         try:
             btn_p = d.find_element(By.CSS_SELECTOR, "button#btnPesquisar, button[type='submit']")
             self._robust_click(btn_p)
-            time.sleep(0.6)
+            # a grade redesenha (DataTables) ou a página recarrega (submit): _esperar_grade_pronta segue daí
+            if self._esperar_assentar(self.row_selector, 3.0, exigir_mudanca=True) is None:
+                time.sleep(0.3)
         except Exception:
             pass
 
@@ -649,6 +1479,8 @@ class PortalClient:
             self.wait.until(lambda drv: "/Despesa/Index" in (drv.current_url or ""))
             return True
         except TimeoutException:
+            self.invalidar_cache_segmentos()  # href (talvez do cache) não abriu
+            self._esquecer_href(href)
             return False
 
     def _norm(self, s: str) -> str:
@@ -691,7 +1523,31 @@ class PortalClient:
                 return True
         return False
 
+    def lancar_despesa(self, href: str, tipo: str, valor_centavos: int, arquivo: str,
+                       data_evento: Optional[datetime] = None) -> bool:
+        """
+        Abre a tela de Despesas do deslocamento e lança o comprovante: por HTTP quando
+        dá; se o HTTP não chegou a enviar nada, pelo Firefox (abrir + preencher_e_anexar).
+        """
+        if self.http is not None:
+            ok = self.http.lancar(href, tipo, valor_centavos, arquivo)
+            if ok is not None:
+                if data_evento is not None and (not ok or self._seg_invalidar_ao_lancar):
+                    self.invalidar_cache_segmentos(data_evento)
+                return ok
+        return self.abrir_despesas_por_href(href) and self.preencher_e_anexar(
+            tipo, valor_centavos, arquivo, data_evento=data_evento
+        )
+
     def preencher_e_anexar(self, tipo: str, valor_centavos: int, arquivo: str, data_evento: Optional[datetime] = None) -> bool:
+        ok = self._preencher_e_anexar(tipo, valor_centavos, arquivo)
+        # lançar despesa não mexe nos deslocamentos; mas se falhou, o href do cache
+        # pode ser o culpado — o próximo comprovante do mês relê a grade
+        if data_evento is not None and (not ok or self._seg_invalidar_ao_lancar):
+            self.invalidar_cache_segmentos(data_evento)
+        return ok
+
+    def _preencher_e_anexar(self, tipo: str, valor_centavos: int, arquivo: str) -> bool:
         d, w = self.driver, self.wait
 
         url = d.current_url or ""
@@ -708,25 +1564,12 @@ class PortalClient:
             self._robust_click(novo)
             w.until(lambda drv: "/Despesa/New" in (drv.current_url or ""))
 
-        tipo_select = w.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "select#Tipo, select[name='Tipo']")))
-        if not self._choose_tipo_option(tipo_select, tipo):
+        valor_fmt = _valor_br(valor_centavos)
+        campos = self._preencher_form_js(tipo, valor_fmt) or self._preencher_form_webdriver(tipo, valor_fmt)
+        if campos is None:
             return False
-
-        valor_input = w.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "input#Valor, input[name='Valor']")))
-        try:
-            valor_input.clear()
-        except Exception:
-            pass
-        valor_fmt = f"{valor_centavos/100:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        valor_input.send_keys(valor_fmt)
-
-        file_input = w.until(EC.presence_of_element_located((By.CSS_SELECTOR, self.form_anexar_sel)))
+        file_input, salvar = campos
         file_input.send_keys(os.path.abspath(arquivo))
-
-        try:
-            salvar = w.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button[type='submit']")))
-        except TimeoutException:
-            return False
         self._scroll_center(salvar)
         self._robust_click(salvar)
 
@@ -741,13 +1584,17 @@ class PortalClient:
             w.until(EC.presence_of_element_located((By.CSS_SELECTOR, "table, table#datatable, table.dataTable")))
             is_pedagio = "pedag" in self._norm(tipo)
             alvo_tipo_norm = "pedag" if is_pedagio else "estacion"
+            # 1 script: confere a cada mudança da tabela, até ~7 s (antes: 12 × 0,6 s de polling)
+            try:
+                achou = d.execute_async_script(
+                    _JS_TERMOS_NA_TABELA, "table tbody tr", [alvo_tipo_norm, self._norm(valor_fmt)], 7200
+                )
+                return bool(achou)
+            except Exception as e:
+                logger.debug(f"[FM] Validação por evento indisponível ({type(e).__name__}); polling.")
             for _ in range(12):
-                linhas = d.find_elements(By.CSS_SELECTOR, "table tbody tr")
-                for tr in linhas:
-                    tds = tr.find_elements(By.TAG_NAME, "td")
-                    if not tds:
-                        continue
-                    txt_norm = self._norm(" | ".join(td.text or "" for td in tds))
+                for celulas in self._ler_tabela_despesas():
+                    txt_norm = self._norm(" | ".join(celulas))
                     if (alvo_tipo_norm in txt_norm) and (self._norm(valor_fmt) in txt_norm):
                         return True
                 time.sleep(0.6)
@@ -755,3 +1602,60 @@ class PortalClient:
             pass
 
         return False
+
+    def _preencher_form_js(self, tipo: str, valor_fmt: str) -> Optional[Tuple[object, object]]:
+        """
+        Caminho rápido: Tipo + Valor num único execute_script (_JS_PREENCHER_DESPESA).
+        Devolve (input de arquivo, botão salvar), ou None para o passo a passo — form
+        diferente, tipo sem opção ou valor reescrito por máscara do campo.
+        """
+        d = self.driver
+        try:
+            self.wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "select#Tipo, select[name='Tipo']")))
+            is_pedagio = "pedag" in self._norm(tipo)
+            res = d.execute_script(
+                _JS_PREENCHER_DESPESA,
+                "pedag" if is_pedagio else "estacion", "2" if is_pedagio else "1",
+                valor_fmt, self.form_anexar_sel,
+            )
+        except Exception as e:
+            logger.debug(f"[FM] Formulário por script falhou ({type(e).__name__}); passo a passo.")
+            return None
+        if not isinstance(res, dict) or res.get("erro"):
+            logger.debug(f"[FM] Formulário por script indisponível ({res!r}); passo a passo.")
+            return None
+        if re.sub(r"\D", "", res.get("valor") or "") != re.sub(r"\D", "", valor_fmt):
+            logger.debug(f"[FM] Campo Valor ficou '{res.get('valor')}' (esperado {valor_fmt}); passo a passo.")
+            return None
+        return res["arquivo"], res["salvar"]
+
+    def _preencher_form_webdriver(self, tipo: str, valor_fmt: str) -> Optional[Tuple[object, object]]:
+        """Fallback: um comando do WebDriver por campo (várias idas ao geckodriver)."""
+        w = self.wait
+        try:
+            tipo_select = w.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "select#Tipo, select[name='Tipo']")))
+            if not self._choose_tipo_option(tipo_select, tipo):
+                return None
+
+            valor_input = w.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "input#Valor, input[name='Valor']")))
+            try:
+                valor_input.clear()
+            except Exception:
+                pass
+            valor_input.send_keys(valor_fmt)
+
+            file_input = w.until(EC.presence_of_element_located((By.CSS_SELECTOR, self.form_anexar_sel)))
+            salvar = w.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button[type='submit']")))
+        except TimeoutException:
+            return None
+        return file_input, salvar
+
+    def _ler_tabela_despesas(self) -> List[List[str]]:
+        """Células de cada linha da tabela de despesas num execute_script (_JS_TABELA)."""
+        try:
+            bruto = self.driver.execute_script(_JS_TABELA, "table tbody tr")
+            linhas = json.loads(bruto) if isinstance(bruto, str) else []
+        except Exception as e:
+            logger.debug(f"[FM] Leitura da tabela de despesas falhou: {e}")
+            return []
+        return [c for c in linhas if isinstance(c, list)]
@@ -0,0 +1,560 @@
+# portal_http.py
+"""
+Caminho rápido do portal por HTTP puro (sem navegador).
+
+O login continua no Firefox (PortalClient.login); depois dele os cookies da
+sessão são copiados para uma `requests.Session` com pool de conexões, e:
+
+  - ler_grade(ini, fim)   -> linhas da grade de Deslocamentos, no mesmo formato
+                             de _JS_GRADE ({ini, fim, chave, links}), ou None
+                             (também se a resposta for só uma página da grade)
+  - abre_despesas(href)  -> só GET: o link abre uma tela de despesas com 'Novo'?
+  - lancar(href, ...)     -> /Despesa/Index -> New -> POST do formulário com o
+                             arquivo, e a mesma validação da tela (tipo + valor
+                             na tabela de despesas)
+
+Contrato de `lancar`: None = não deu para usar HTTP e NADA foi gravado (o
+chamador segue pelo Firefox); True/False = o POST foi enviado e este é o
+resultado — não há fallback depois disso, para não lançar a despesa duas vezes.
+
+Sessão expirada (resposta cai no login) vira None: o Firefox refaz o login e
+exporta os cookies de novo.
+
+Keepalive: com `iniciar_keepalive`, uma thread faz um GET leve quando a sessão
+fica ociosa, para o portal não derrubá-la entre um comprovante e outro. Cookies
+renovados pelo portal são repassados ao callback (PortalClient grava em disco e
+devolve ao Firefox).
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+import mimetypes
+from datetime import datetime
+from html import unescape
+from html.parser import HTMLParser
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import urljoin
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    _HAS_REQUESTS = True
+except Exception:
+    _HAS_REQUESTS = False
+
+logger = logging.getLogger(__name__)
+
+_DATETIME_RX = re.compile(r"\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}(?::\d{2})?")
+_HREF_RX = re.compile(r"""href\s*=\s*["']([^"']*/Despesa/[^"']*)["']""", re.I)
+_TAG_RX = re.compile(r"<[^>]+>")
+# grade paginada no servidor: total informado ("Mostrando 1 até 10 de 57 registros")
+# ou controles de próxima página / carregar mais
+_TOTAL_RX = re.compile(
+    r"(?:mostrando|exibindo|showing)\s+\d+\s+(?:at[ée]|a|to)\s+\d+\s+(?:de|of)\s+([\d.,]+)", re.I)
+_PAGINACAO_RX = re.compile(
+    r"""rel\s*=\s*["']next["']|class\s*=\s*["'][^"']*\bload-more\b|mostrar\s+mais""", re.I)
+
+
+# -------------------------------
+# Texto
+# -------------------------------
+def _norm(s: str) -> str:
+    repl = (("á","a"),("à","a"),("â","a"),("ã","a"),
+            ("é","e"),("ê","e"),
+            ("í","i"),
+            ("ó","o"),("ô","o"),("õ","o"),
+            ("ú","u"),
+            ("ç","c"))
+    s = (s or "").lower()
+    for a, b in repl:
+        s = s.replace(a, b)
+    return s
+
+
+def _valor_br(valor_centavos: int) -> str:
+    """1234567 -> '12.345,67' (formato do campo Valor)."""
+    return f"{valor_centavos/100:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def _espacos(s: str) -> str:
+    return " ".join((s or "").split())
+
+
+# -------------------------------
+# HTML (stdlib, sem bs4)
+# -------------------------------
+class _Pagina(HTMLParser):
+    """
+    Extrai só o que o bot usa de uma página do portal:
+      linhas : [{id, celulas: [texto...], links: [href...]}] de toda <tr> com <td>
+      forms  : [{action, method, enctype, campos: [(nome, valor)], selects: {nome: [(valor, texto, selected)]},
+                 arquivos: [nome], botoes: [(nome, valor)]}]
+      links  : [(href, texto)] de todos os <a>
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.titulo = ""
+        self.linhas: List[dict] = []
+        self.forms: List[dict] = []
+        self.links: List[Tuple[str, str]] = []
+        self._em_titulo = False
+        self._trs: List[dict] = []          # pilha (tabelas aninhadas)
+        self._celula: Optional[List[str]] = None
+        self._form: Optional[dict] = None
+        self._select: Optional[Tuple[str, list]] = None
+        self._opcao: Optional[list] = None
+        self._textarea: Optional[list] = None
+        self._link: Optional[list] = None
+
+    def handle_starttag(self, tag, attrs):
+        a = {k: (v if v is not None else "") for k, v in attrs}
+        if tag == "title":
+            self._em_titulo = True
+        elif tag == "tr":
+            self._trs.append({"id": a.get("id") or a.get("data-id") or "", "celulas": [], "links": []})
+        elif tag in ("td", "th") and self._trs:
+            self._celula = []
+            if tag == "th":
+                self._trs[-1]["th"] = True
+        elif tag == "a":
+            self._link = [a.get("href", ""), []]
+            if self._trs and a.get("href"):
+                self._trs[-1]["links"].append(a["href"])
+        elif tag == "form":
+            self._form = {
+                "action": a.get("action", ""), "method": (a.get("method") or "get").lower(),
+                "enctype": a.get("enctype", ""), "campos": [], "selects": {}, "arquivos": [], "botoes": [],
+            }
+            self.forms.append(self._form)
+        elif self._form is not None and tag == "input":
+            nome, tp = a.get("name"), (a.get("type") or "text").lower()
+            if not nome:
+                return
+            if tp == "file":
+                self._form["arquivos"].append(nome)
+            elif tp in ("submit", "button", "image", "reset"):
+                if tp == "submit":
+                    self._form["botoes"].append((nome, a.get("value", "")))
+            elif tp in ("checkbox", "radio"):
+                if "checked" in a:
+                    self._form["campos"].append((nome, a.get("value") or "on"))
+            else:
+                self._form["campos"].append((nome, a.get("value", "")))
+        elif self._form is not None and tag == "button":
+            if a.get("name") and (a.get("type") or "submit").lower() == "submit":
+                self._form["botoes"].append((a["name"], a.get("value", "")))
+        elif self._form is not None and tag == "select" and a.get("name"):
+            self._select = (a["name"], [])
+            self._form["selects"][a["name"]] = self._select[1]
+        elif self._select is not None and tag == "option":
+            self._fechar_opcao()   # </option> é opcional no HTML
+            self._opcao = [a.get("value"), [], "selected" in a]
+        elif self._form is not None and tag == "textarea" and a.get("name"):
+            self._textarea = [a["name"], []]
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._em_titulo = False
+        elif tag in ("td", "th") and self._celula is not None and self._trs:
+            self._trs[-1]["celulas"].append(_espacos("".join(self._celula)))
+            self._celula = None
+        elif tag == "tr" and self._trs:
+            tr = self._trs.pop()
+            if tr["celulas"] and not tr.pop("th", False):
+                self.linhas.append(tr)
+        elif tag == "a" and self._link is not None:
+            self.links.append((self._link[0], _espacos("".join(self._link[1]))))
+            self._link = None
+        elif tag == "option":
+            self._fechar_opcao()
+        elif tag == "select":
+            self._fechar_opcao()
+            self._select = None
+        elif tag == "textarea" and self._textarea is not None and self._form is not None:
+            self._form["campos"].append((self._textarea[0], "".join(self._textarea[1])))
+            self._textarea = None
+        elif tag == "form":
+            self._form = None
+
+    def _fechar_opcao(self):
+        if self._opcao is not None and self._select is not None:
+            valor, texto, sel = self._opcao
+            texto = _espacos("".join(texto))
+            self._select[1].append((texto if valor is None else valor, texto, sel))
+        self._opcao = None
+
+    def handle_data(self, data):
+        if self._em_titulo:
+            self.titulo += data
+        if self._celula is not None:
+            self._celula.append(data)
+        if self._link is not None:
+            self._link[1].append(data)
+        if self._opcao is not None:
+            self._opcao[1].append(data)
+        if self._textarea is not None:
+            self._textarea[1].append(data)
+
+
+def _parse(html: str) -> _Pagina:
+    p = _Pagina()
+    try:
+        p.feed(html or "")
+        p.close()
+    except Exception as e:
+        logger.debug(f"[http] HTML malformado ({e}); usando o que foi lido.")
+    return p
+
+
+def _linha_grade(celulas: List[str], links: List[str], rid: str = "") -> Optional[dict]:
+    """Mesmo formato de _JS_GRADE; só linhas cujas 2 primeiras células são data/hora."""
+    if len(celulas) < 2 or not _DATETIME_RX.search(celulas[0]) or not _DATETIME_RX.search(celulas[1]):
+        return None
+    ini, fim = celulas[0].strip(), celulas[1].strip()
+    return {
+        "ini": ini, "fim": fim,
+        "chave": (f"{rid}#" if rid else "") + f"{ini}|{fim}",
+        "links": [h for h in links if "/Despesa/" in h],
+    }
+
+
+def _grade_parcial(html: str, n_linhas: int) -> bool:
+    """A página traz só parte da grade: total informado maior que as linhas, ou paginação."""
+    texto = _TAG_RX.sub(" ", html or "")
+    for m in _TOTAL_RX.finditer(texto):
+        try:
+            if int(re.sub(r"\D", "", m.group(1))) > n_linhas:
+                return True
+        except ValueError:
+            pass
+    return bool(_PAGINACAO_RX.search(html or ""))
+
+
+def _escolher_tipo(opcoes: List[Tuple[str, str, bool]], tipo: str) -> Optional[str]:
+    """Mesma preferência de PortalClient._choose_tipo_option: texto, depois value 2/1."""
+    is_pedagio = "pedag" in (tipo or "").lower()
+    chave = "pedag" if is_pedagio else "estacion"
+    for valor, texto, _ in opcoes:
+        if chave in _norm(texto):
+            return valor
+    alvo = "2" if is_pedagio else "1"
+    for valor, _, _ in opcoes:
+        if valor == alvo:
+            return valor
+    return None
+
+
+# -------------------------------
+# Cliente
+# -------------------------------
+class PortalHttp:
+    """
+    Sessão HTTP do portal, alimentada pelos cookies do Selenium.
+
+    `cfg` é o config.yaml inteiro (lê as seções `http`, `tabela` e `login`).
+    """
+
+    def __init__(self, cfg: dict, base_url: str, login_url: str):
+        hcfg = cfg.get("http", {}) or {}
+        self.base_url = base_url
+        self.login_url = login_url
+        self.timeout = float(hcfg.get("timeout_seconds", 15) or 15)
+        self.grade_json_url = (hcfg.get("grade_json_url") or "").strip() or None
+        self.tem_sessao = False     # cookies exportados e ainda aceitos pelo portal
+        self.ultimo_ok = 0.0        # time.monotonic() da última resposta autenticada
+        self.ultima: Optional[Tuple[str, str]] = None   # (url, html) da última resposta — debug
+        self._lock = threading.RLock()          # Session compartilhada com a thread de keepalive
+        self._keepalive: Optional[threading.Thread] = None
+        self._parar = threading.Event()
+
+        s = requests.Session()
+        retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset({"GET"}))
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        self.s = s
+
+    # ---------- sessão ----------
+    def importar_cookies(self, cookies: List[dict], user_agent: Optional[str] = None) -> int:
+        """Cookies no formato de driver.get_cookies()."""
+        with self._lock:
+            self.s.cookies.clear()
+            n = 0
+            for c in cookies or []:
+                try:
+                    self.s.cookies.set(
+                        c["name"], c["value"],
+                        domain=c.get("domain") or None, path=c.get("path") or "/",
+                        secure=bool(c.get("secure")),
+                    )
+                    n += 1
+                except Exception:
+                    continue
+            if user_agent:
+                self.s.headers["User-Agent"] = user_agent
+            self.tem_sessao = n > 0
+        return n
+
+    def exportar_cookies(self) -> List[dict]:
+        """Cookies atuais no formato do Selenium (add_cookie / arquivo de sessão)."""
+        with self._lock:
+            out = []
+            for c in self.s.cookies:
+                ck = {"name": c.name, "value": c.value, "path": c.path or "/", "secure": bool(c.secure)}
+                if c.domain:
+                    ck["domain"] = c.domain
+                if c.expires:
+                    ck["expiry"] = int(c.expires)
+                out.append(ck)
+            return out
+
+    def _assinatura(self) -> Tuple:
+        with self._lock:
+            return tuple(sorted((c.name, c.value) for c in self.s.cookies))
+
+    # ---------- keepalive ----------
+    def iniciar_keepalive(self, url: str, intervalo: float,
+                          ao_renovar: Optional[Callable[[List[dict]], None]] = None) -> None:
+        """GET em `url` sempre que a sessão passar `intervalo` s sem uso (thread daemon)."""
+        if intervalo <= 0 or self._keepalive is not None:
+            return
+        self._parar.clear()
+        self._keepalive = threading.Thread(
+            target=self._loop_keepalive, args=(url, float(intervalo), ao_renovar),
+            name="portal-keepalive", daemon=True,
+        )
+        self._keepalive.start()
+
+    def parar_keepalive(self) -> None:
+        self._parar.set()
+        if self._keepalive is not None:
+            self._keepalive.join(timeout=2.0)
+            self._keepalive = None
+
+    def _loop_keepalive(self, url: str, intervalo: float, ao_renovar) -> None:
+        while not self._parar.wait(min(intervalo, 60.0)):
+            if not self.tem_sessao or (time.monotonic() - self.ultimo_ok) < intervalo:
+                continue
+            antes = self._assinatura()
+            try:
+                ok = self._req("GET", url) is not None
+            except Exception as e:
+                logger.debug(f"[http] Keepalive falhou: {e}")
+                continue
+            if not ok:
+                continue   # _req já marcou a sessão como expirada
+            logger.debug("[http] Keepalive ok.")
+            if ao_renovar is not None and self._assinatura() != antes:
+                try:
+                    ao_renovar(self.exportar_cookies())
+                except Exception as e:
+                    logger.debug(f"[http] Callback de cookies renovados falhou: {e}")
+
+    def _caiu_no_login(self, r) -> bool:
+        url = (r.url or "").rstrip("/")
+        if url.endswith("/sb0121") or "/Account/Login" in url:
+            return True
+        return 'id="Password"' in r.text and 'id="UserName"' in r.text
+
+    def _req(self, metodo: str, url: str, **kw):
+        """GET/POST com timeout; None se a sessão expirou (sem exceção)."""
+        with self._lock:
+            r = self.s.request(metodo, url, timeout=self.timeout, allow_redirects=True, **kw)
+        self.ultima = (r.url, r.text)
+        if self._caiu_no_login(r):
+            logger.info("[http] Sessão expirada — volta para o Firefox.")
+            self.tem_sessao = False
+            return None
+        r.raise_for_status()
+        self.ultimo_ok = time.monotonic()
+        return r
+
+    # ---------- grade ----------
+    def ler_grade(self, ini: datetime, fim: datetime) -> Optional[List[dict]]:
+        """
+        Linhas da grade no período, ou None (sem sessão, página diferente do esperado,
+        grade montada só no navegador) — aí o chamador usa o Firefox.
+        """
+        if not self.tem_sessao:
+            return None
+        d_ini, d_fim = ini.strftime("%d/%m/%Y"), fim.strftime("%d/%m/%Y")
+        try:
+            if self.grade_json_url:
+                return self._grade_json(d_ini, d_fim)
+
+            r = self._req("GET", self.base_url)
+            if r is None:
+                return None
+            pag = _parse(r.text)
+            form = next((f for f in pag.forms
+                         if any(n == "dataInicialPesquisa" for n, _ in f["campos"])), None)
+            if form is not None:
+                campos = dict(form["campos"])
+                campos["dataInicialPesquisa"], campos["dataFinalPesquisa"] = d_ini, d_fim
+                url = urljoin(r.url, form["action"] or r.url)
+                if form["method"] == "post":
+                    r = self._req("POST", url, data=campos)
+                else:
+                    r = self._req("GET", url, params=campos)
+            else:
+                r = self._req("GET", self.base_url,
+                              params={"dataInicialPesquisa": d_ini, "dataFinalPesquisa": d_fim})
+            if r is None:
+                return None
+            pag = _parse(r.text)
+        except Exception as e:
+            logger.info(f"[http] Grade por HTTP falhou ({type(e).__name__}: {e}); usando o Firefox.")
+            return None
+
+        linhas = []
+        for tr in pag.linhas:
+            ln = _linha_grade(tr["celulas"], [urljoin(r.url, h) for h in tr["links"]], tr["id"])
+            if ln is not None:
+                linhas.append(ln)
+        if linhas and _grade_parcial(r.text, len(linhas)):
+            # só a 1ª página: "o último segmento pega tudo depois do fim" casaria errado
+            logger.info(f"[http] Grade paginada no servidor ({len(linhas)} linhas nesta página); usando o Firefox.")
+            return None
+        # sem linhas pode ser mês vazio OU grade que só o JS monta — quem decide é o Firefox
+        return linhas or None
+
+    def _grade_json(self, d_ini: str, d_fim: str) -> Optional[List[dict]]:
+        """Endpoint DataTables (http.grade_json_url): {data|aaData: [[...]|{...}]}."""
+        r = self._req("GET", self.grade_json_url, params={
+            "dataInicialPesquisa": d_ini, "dataFinalPesquisa": d_fim,
+            "start": 0, "length": -1, "draw": 1,
+        })
+        if r is None:
+            return None
+        corpo = r.json()
+        dados = corpo.get("data", corpo.get("aaData")) if isinstance(corpo, dict) else corpo
+        if not isinstance(dados, list):
+            return None
+        total = None
+        if isinstance(corpo, dict):
+            total = next((corpo[k] for k in ("recordsFiltered", "iTotalDisplayRecords") if k in corpo), None)
+        if total is not None and int(total) > len(dados):
+            logger.info(f"[http] Endpoint da grade devolveu {len(dados)} de {total} linhas; usando o Firefox.")
+            return None
+        linhas = []
+        for item in dados:
+            valores = list(item.values()) if isinstance(item, dict) else list(item or [])
+            brutos = [v if isinstance(v, str) else json.dumps(v, ensure_ascii=False) for v in valores]
+            datas = [m.group(0) for b in brutos for m in _DATETIME_RX.finditer(unescape(_TAG_RX.sub(" ", b)))]
+            links = [urljoin(r.url, unescape(h)) for b in brutos for h in _HREF_RX.findall(b)]
+            rid = str(item.get("DT_RowId") or item.get("id") or "") if isinstance(item, dict) else ""
+            ln = _linha_grade(datas[:2], links, rid)
+            if ln is not None:
+                linhas.append(ln)
+        return linhas or None
+
+    # ---------- despesa ----------
+    def abre_despesas(self, href: str) -> Optional[bool]:
+        """
+        Confere, só com GET, se `href` abre uma tela de despesas com o botão 'Novo'
+        (link montado pelo padrão aprendido). None = sem sessão / erro de rede.
+        """
+        if not self.tem_sessao:
+            return None
+        try:
+            r = self._req("GET", href)
+        except requests.HTTPError:
+            return False
+        except Exception as e:
+            logger.debug(f"[http] GET de {href} falhou: {e}")
+            return None
+        if r is None:
+            return None
+        if "/Despesa/" not in r.url:
+            return False
+        return "/Despesa/New" in r.url or any("/Despesa/New" in h for h, _ in _parse(r.text).links)
+
+    def lancar(self, href: str, tipo: str, valor_centavos: int, arquivo: str) -> Optional[bool]:
+        """
+        Lança a despesa na tela `href` (/Despesa/Index). Ver o contrato no topo do módulo:
+        None = nada foi enviado; True/False = POST enviado, resultado da validação.
+        """
+        if not self.tem_sessao or "/Despesa/" not in (href or ""):
+            return None
+
+        # 1) Index -> New -> formulário (só GETs: falha aqui não grava nada)
+        try:
+            r = self._req("GET", href)
+            if r is None:
+                return None
+            if "/Despesa/New" not in r.url:
+                novo = next((h for h, _ in _parse(r.text).links if "/Despesa/New" in h), None)
+                if not novo:
+                    logger.info("[http] Botão 'Novo' não encontrado na tela de despesas.")
+                    return None
+                r = self._req("GET", urljoin(r.url, novo))
+                if r is None:
+                    return None
+            pag = _parse(r.text)
+            form = next((f for f in pag.forms if "Tipo" in f["selects"]), None)
+            if form is None or not form["arquivos"]:
+                logger.info("[http] Formulário de despesa diferente do esperado.")
+                return None
+            tipo_valor = _escolher_tipo(form["selects"]["Tipo"], tipo)
+            if tipo_valor is None:
+                logger.info(f"[http] Tipo '{tipo}' sem opção no formulário.")
+                return None
+        except Exception as e:
+            logger.info(f"[http] Formulário por HTTP falhou ({type(e).__name__}: {e}); usando o Firefox.")
+            return None
+
+        valor_fmt = _valor_br(valor_centavos)
+        dados = [(n, v) for n, v in form["campos"] if n not in ("Tipo", "Valor")]
+        for nome, opcoes in form["selects"].items():
+            if nome == "Tipo":
+                continue
+            sel = next((v for v, _, s in opcoes if s), opcoes[0][0] if opcoes else "")
+            dados.append((nome, sel))
+        dados += [("Tipo", tipo_valor), ("Valor", valor_fmt)]
+        dados += form["botoes"][:1]
+        url_post = urljoin(r.url, form["action"] or r.url)
+
+        # 2) POST — daqui em diante nunca devolve None (pode ter gravado)
+        try:
+            with open(arquivo, "rb") as fh:
+                mime = mimetypes.guess_type(arquivo)[0] or "application/octet-stream"
+                files = {form["arquivos"][0]: (os.path.basename(arquivo), fh, mime)}
+                with self._lock:
+                    r = self.s.post(url_post, data=dados, files=files, timeout=max(self.timeout, 60),
+                                    allow_redirects=True)
+            self.ultima = (r.url, r.text)
+        except Exception as e:
+            logger.error(f"[http] POST da despesa falhou ({type(e).__name__}: {e}) — não repito para não duplicar.")
+            return False
+
+        if self._caiu_no_login(r):
+            self.tem_sessao = False
+            logger.error("[http] Sessão caiu no envio da despesa — resultado incerto, não repito.")
+            return False
+        if "/Despesa/Index" not in r.url:
+            logger.error(f"[http] Portal não voltou para a lista de despesas ({r.status_code} {r.url}).")
+            return False
+
+        # 3) mesma validação da tela: tipo + valor em alguma linha da tabela
+        alvo_tipo = "pedag" if "pedag" in _norm(tipo) else "estacion"
+        alvo_valor = _norm(valor_fmt)
+        for tentativa in range(2):
+            if tentativa:
+                try:
+                    r = self._req("GET", r.url)
+                except Exception:
+                    r = None
+                if r is None:
+                    return False
+            for tr in _parse(r.text).linhas:
+                txt = _norm(" | ".join(tr["celulas"]))
+                if alvo_tipo in txt and alvo_valor in txt:
+                    return True
+        logger.error("[http] Despesa enviada, mas a linha não apareceu na tabela.")
+        return False
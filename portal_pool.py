@@ -0,0 +1,191 @@
+# portal_pool.py
+"""
+Vários PortalClient em paralelo, alimentados por uma fila.
+
+Cada worker é uma thread dona do SEU PortalClient (Firefox sob demanda + sessão
+HTTP próprios — o driver nunca troca de thread: até o pré-aquecimento é um item
+da fila, executado pelo worker que o pegar). Com perfil dedicado do Firefox, o
+worker i > 0 usa `<perfil>-i` (PortalClient(worker=i)). O watcher entrega um job por
+comprovante já validado (OCR + dedupe) e segue varrendo a pasta.
+
+Duas travas evitam corrida entre workers:
+  - chave semântica (tipo|data|valor) em andamento: o mesmo comprovante em dois
+    arquivos não entra duas vezes ao mesmo tempo (o dedupe do ledger só vê o
+    primeiro depois que ele termina) — submit() recusa, o watcher tenta depois;
+  - trava por deslocamento (href de /Despesa/Index): dois comprovantes da mesma
+    viagem lançam em sequência, nunca na mesma tela ao mesmo tempo.
+
+Tamanho: pedido pelo usuário, limitado pela RAM livre (/proc/meminfo) — no Pi
+cada Firefox headless come algumas centenas de MB que o OCR também quer.
+"""
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+from portal_client import PortalClient
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[PortalClient], None]
+
+_AQUECER = object()   # item da fila: subir o Firefox do worker que pegar (se preciso)
+
+
+# -------------------------------
+# Dimensionamento
+# -------------------------------
+def _mem_disponivel_mb() -> Optional[float]:
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for linha in f:
+                if linha.startswith("MemAvailable:"):
+                    return int(linha.split()[1]) / 1024.0
+    except Exception:
+        pass
+    return None
+
+
+def dimensionar(pedidos: int, mb_por_worker: float = 350, reserva_mb: float = 600) -> int:
+    """Workers que cabem na RAM livre agora, sem passar de `pedidos` (mínimo 1)."""
+    pedidos = max(1, int(pedidos))
+    livre = _mem_disponivel_mb()
+    if livre is None or mb_por_worker <= 0:
+        return pedidos
+    cabem = int(max(0.0, livre - reserva_mb) // mb_por_worker)
+    n = max(1, min(pedidos, cabem))
+    if n < pedidos:
+        logger.info(f"[pool] {pedidos} worker(s) pedidos, {n} cabem ({livre:.0f} MB livres, "
+                    f"{mb_por_worker:.0f} MB cada + {reserva_mb:.0f} MB de reserva).")
+    return n
+
+
+# -------------------------------
+# Trava por chave
+# -------------------------------
+class TravasPorChave:
+    """Um Lock por chave, criado sob demanda e descartado quando ninguém mais usa."""
+
+    def __init__(self):
+        self._guarda = threading.Lock()
+        self._travas: Dict[str, List] = {}   # chave -> [Lock, quantos usando/esperando]
+
+    @contextmanager
+    def travar(self, chave: str) -> Iterator[None]:
+        with self._guarda:
+            item = self._travas.setdefault(chave, [threading.Lock(), 0])
+            item[1] += 1
+        item[0].acquire()
+        try:
+            yield
+        finally:
+            item[0].release()
+            with self._guarda:
+                item[1] -= 1
+                if item[1] == 0:
+                    self._travas.pop(chave, None)
+
+
+# -------------------------------
+# Pool
+# -------------------------------
+class PortalPool:
+    """
+    N workers de portal.
+
+      - submit(chave, job)   -> False se a chave semântica já está em andamento
+      - travar(deslocamento) -> context manager (use dentro do job)
+      - preaquecer()         -> um worker livre sobe o próprio Firefox, se for preciso
+      - close()
+    """
+
+    def __init__(self, workers: int,
+                 fabrica: Callable[[int], PortalClient] = lambda i: PortalClient(worker=i)):
+        self.workers = max(1, int(workers))
+        self._fabrica = fabrica
+        self._fila: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._em_andamento: Set[str] = set()
+        self._guarda = threading.Lock()
+        self._travas = TravasPorChave()
+        self._aquecer_pendente = False
+        self._clientes: List[Optional[PortalClient]] = [None] * self.workers
+        self._threads = [
+            threading.Thread(target=self._loop, args=(i,), name=f"portal-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+        logger.info(f"[pool] {self.workers} worker(s) de portal.")
+
+    @property
+    def pendentes(self) -> int:
+        with self._guarda:
+            return len(self._em_andamento)
+
+    def submit(self, chave: str, job: Job) -> bool:
+        with self._guarda:
+            if chave in self._em_andamento:
+                return False
+            self._em_andamento.add(chave)
+        self._fila.put((chave, job))
+        return True
+
+    def travar(self, deslocamento: str):
+        return self._travas.travar(deslocamento)
+
+    def _cliente(self, i: int) -> PortalClient:
+        with self._guarda:
+            pc = self._clientes[i]
+            if pc is None:
+                pc = self._clientes[i] = self._fabrica(i)
+            return pc
+
+    def _loop(self, i: int) -> None:
+        while True:
+            try:
+                item = self._fila.get(timeout=5.0)
+            except queue.Empty:
+                pc = self._clientes[i]
+                if pc is not None:
+                    pc.fechar_se_ocioso()   # na thread dona do driver
+                continue
+            if item is None:
+                break
+            if item is _AQUECER:
+                with self._guarda:
+                    self._aquecer_pendente = False
+                try:
+                    self._cliente(i).preaquecer(em_segundo_plano=False)
+                except Exception:
+                    logger.exception(f"[pool] Pré-aquecimento falhou no worker {i}.")
+                finally:
+                    self._fila.task_done()
+                continue
+            chave, job = item
+            try:
+                job(self._cliente(i))
+            except Exception:
+                logger.exception(f"[pool] Job {chave} falhou no worker {i}.")
+            finally:
+                with self._guarda:
+                    self._em_andamento.discard(chave)
+                self._fila.task_done()
+
+        pc = self._clientes[i]
+        if pc is not None:
+            pc.close()
+
+    def preaquecer(self) -> None:
+        """Pede a um worker livre que suba o próprio Firefox (um pedido na fila por vez)."""
+        with self._guarda:
+            if self._aquecer_pendente:
+                return
+            self._aquecer_pendente = True
+        self._fila.put(_AQUECER)
+
+    def close(self, timeout: float = 30.0) -> None:
+        for _ in self._threads:
+            self._fila.put(None)
+        for t in self._threads:
+            t.join(timeout=timeout)
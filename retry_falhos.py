@@ -65,6 +65,7 @@ def run_retry(headless: bool = True) -> None:
         logging.info("[retry] Já existe uma execução em andamento (lock). Abortando esta rodada.")
         return
 
+    w = None
     try:
         os.makedirs(FALHOS_DIR, exist_ok=True)
         os.makedirs(COMPROVANTES_DIR, exist_ok=True)
@@ -158,6 +159,8 @@ def run_retry(headless: bool = True) -> None:
                         _save_state(state)
 
     finally:
+        if w is not None:
+            w.close()  # fecha o Firefox desta passada (no --watch, cada rodada cria outro)
         _release_lock()
 
 def _setup_logging():
@@ -11,7 +11,7 @@ echo "==> [1/6] Pacotes do sistema..."
 sudo DEBIAN_FRONTEND=noninteractive apt update -y
 sudo DEBIAN_FRONTEND=noninteractive apt install -y \
   python3 python3-venv python3-pip \
-  tesseract-ocr tesseract-ocr-por libtesseract-dev \
+  tesseract-ocr tesseract-ocr-por libtesseract-dev poppler-utils \
   firefox-esr ffmpeg libsm6 libxext6 \
   ca-certificates curl wget tar gzip unzip
 
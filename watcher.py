@@ -2,11 +2,13 @@ import os
 import time
 import argparse
 import logging
+from contextlib import nullcontext
 from typing import Optional
 
 from portal_client import PortalClient
-from ocr_utils import extrair_dados_comprovante
-from dedupe import file_hash, already_done, mark_done, already_done_semantic
+from portal_pool import PortalPool, dimensionar
+from ocr_stage import OcrStage, ResultadoOCR, ocr_job
+from dedupe import mark_done, already_done_semantic, chave_semantica
 from selenium.common.exceptions import TimeoutException
 
 from pathlib import Path
@@ -19,15 +21,19 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
 )
+logger = logging.getLogger(__name__)
 
 COMPROVANTES_DIR = "comprovantes"
 PROCESSADOS_DIR = "processados"
 FALHOS_DIR = "falhos"
 
-# --- arquivos a ignorar / validações de imagem -------------------------
+# falha no portal -> HTML + screenshot no bundle do comprovante (artifacts.py, tamanho limitado)
+PORTAL_DEBUG = os.getenv("PORTAL_DEBUG", "1") not in ("0", "", "false", "False", "no")
+
+# --- arquivos a ignorar / validações de imagem/PDF ---------------------
 IGNORED_PREFIXES = ('.', '.syncthing.')
 IGNORED_SUFFIXES = ('.tmp',)
-ALLOWED_EXTS = {'.jpg', '.jpeg', '.png', '.webp'}
+ALLOWED_EXTS = {'.jpg', '.jpeg', '.png', '.webp', '.pdf'}
 
 def _should_ignore(p: Path) -> bool:
     """Ignora temporários/ocultos/sincronia e extensões não suportadas."""
@@ -40,34 +46,34 @@ def _should_ignore(p: Path) -> bool:
         return True
     return False
 
-def _wait_until_stable(p: Path, attempts: int = 6, interval: float = 0.5) -> bool:
-    """
-    Aguarda o arquivo “assentar” (ex.: Syncthing ainda gravando).
-    True = estável; False = ainda variando ou sumiu.
-    """
-    try:
-        prev = (p.stat().st_size, p.stat().st_mtime_ns)
-    except FileNotFoundError:
-        return False
-    for _ in range(attempts):
-        time.sleep(interval)
-        try:
-            cur = (p.stat().st_size, p.stat().st_mtime_ns)
-        except FileNotFoundError:
-            return False
-        if cur == prev:
-            return True
-        prev = cur
-    return False
-
 
 class Watcher:
-    def __init__(self, headless: bool, retry_interval: int):
-        self.pc = PortalClient(headless=headless)
+    def __init__(self, headless: bool, retry_interval: int, ocr_workers: int = 0, portal_workers: int = 1):
+        # portal: 1 cliente no próprio loop, ou um pool de N (cada um com seu Firefox/sessão)
+        # barato: o Firefox só sobe quando um comprovante precisa do portal (ver PortalClient)
+        self.pc: Optional[PortalClient] = None
+        self.pool: Optional[PortalPool] = None
+        if portal_workers > 1:
+            n = dimensionar(
+                portal_workers,
+                mb_por_worker=float(os.getenv("PORTAL_MB_POR_WORKER", "350") or 350),
+                reserva_mb=float(os.getenv("PORTAL_RESERVA_MB", "600") or 600),
+            )
+            self.pool = PortalPool(n, lambda i: PortalClient(headless=headless, worker=i))
+        else:
+            self.pc = PortalClient(headless=headless)
         self.retry_interval = max(0, retry_interval)
         self._last_retry = time.time() if self.retry_interval > 0 else 0
         self._known = set()  # caminhos já vistos nesta execução
 
+        # OCR em pool de processos (0 = inline, no mesmo processo do Selenium)
+        self.ocr: Optional[OcrStage] = None
+        if ocr_workers > 0:
+            self.ocr = OcrStage(
+                workers=ocr_workers,
+                deadline=float(os.getenv("OCR_DEADLINE_SEC", "180") or 180),
+            )
+
         for d in (COMPROVANTES_DIR, PROCESSADOS_DIR, FALHOS_DIR):
             os.makedirs(d, exist_ok=True)
 
@@ -82,10 +88,21 @@ class Watcher:
         except Exception as e:
             logging.warning(f"Falha ao mover '{p}' para '{pasta}': {e}")
 
+    def _debug_portal(self, pc: PortalClient, path: str):
+        if PORTAL_DEBUG:
+            pc.salvar_debug(Path(path).stem)
+
+    def _travar_deslocamento(self, href: str):
+        return self.pool.travar(href) if self.pool is not None else nullcontext()
+
     # -----------------------
     # loop de arquivos
     # -----------------------
-    def processar(self, path: str):
+    def processar(self, path: str, res: Optional[ResultadoOCR] = None):
+        """
+        Processa UM comprovante. `res` vem da etapa de OCR em pool; sem ele,
+        o debounce/hash/OCR rodam aqui mesmo (modo inline e retry_falhos).
+        """
         p = Path(path)
 
         # 0) Filtros de arquivos que não devem ser processados
@@ -93,23 +110,33 @@ class Watcher:
             logger.info("Ignorando arquivo não-processável: %s", p)
             return
 
-        # 1) Debounce: aguarda estabilizar (evita pegar .tmp do Syncthing)
-        if not _wait_until_stable(p):
+        # 1) Debounce (evita pegar .tmp do Syncthing) + hash + OCR
+        if res is None:
+            res = ocr_job(path)
+
+        if res.status == "instavel":
             logger.info("Arquivo ainda não estável (pode estar sendo gravado): %s", p)
+            self._known.discard(path)  # revisita na próxima varredura
             return
-            
+
         logging.info(f"Novo arquivo: {path}")
         try:
             # dedupe por hash físico (processados)
-            h = file_hash(path)
-            if already_done(h):
+            if res.status == "ja_processado":
                 logging.info("Arquivo já processado (hash conhecido) — ignorando.")
                 self._mover(path, PROCESSADOS_DIR)
                 return
 
-            # OCR
-            dados = extrair_dados_comprovante(path)
-            logging.info(f"OCR: tipo={dados.tipo} data={dados.data} valor_centavos={dados.valor_centavos}")
+            if res.status != "ok":
+                logging.error(f"OCR falhou ({res.status}: {res.erro}). Nada foi lançado — 'falhos'.")
+                self._mover(path, FALHOS_DIR)
+                return
+
+            h, dados = res.hash, res.dados
+            logging.info(
+                f"OCR: tipo={dados.tipo} data={dados.data} valor_centavos={dados.valor_centavos} "
+                f"({'cache' if res.cache else f'{res.segundos:.1f}s'})"
+            )
 
             # >>> BLINDAGEM: se não tiver tipo/data/valor, não segue para o portal
             if (not dados.data) or (not dados.valor_centavos) or (dados.tipo == "desconhecido"):
@@ -123,21 +150,45 @@ class Watcher:
                 self._mover(path, PROCESSADOS_DIR)
                 return
 
+            if self.pool is None:
+                self._lancar(self.pc, path, h, dados)
+                return
+
+            # pool: um worker lança; o mesmo comprovante (outro arquivo) espera este terminar
+            chave = chave_semantica(dados.tipo, dados.data, dados.valor_centavos)
+            if not self.pool.submit(chave, lambda pc: self._lancar(pc, path, h, dados)):
+                logging.info("Comprovante igual já está sendo lançado — revisito na próxima varredura.")
+                self._known.discard(path)
+
+        except Exception as e:
+            self._falhou(None, path, e)
+
+    def _lancar(self, pc: PortalClient, path: str, h: str, dados):
+        """Etapa portal de UM comprovante já validado (roda no loop ou num worker do pool)."""
+        try:
+            # no pool, outro arquivo com o mesmo conteúdo pode ter terminado depois da checagem
+            if self.pool is not None and already_done_semantic(dados.tipo, dados.data, dados.valor_centavos):
+                logging.info("Comprovante já lançado (duplicata por conteúdo OCR).")
+                self._mover(path, PROCESSADOS_DIR)
+                return
+
             # localizar a linha exata pela janela de horário (sem fallback!)
-            href = self.pc.encontrar_linha_por_data_hora(dados.data, dados.tipo)
+            href = pc.encontrar_linha_por_data_hora(dados.data, dados.tipo)
             if not href:
                 logging.error("Não encontrei deslocamento compatível (janela de horário/mês). "
                             "Nada foi lançado — ficará em 'falhos' para reprocesso.")
+                self._debug_portal(pc, path)
                 self._mover(path, FALHOS_DIR)
                 return
 
-            # abrir /Despesa/Index e lançar
-            ok = self.pc.abrir_despesas_por_href(href) and self.pc.preencher_e_anexar(
-                dados.tipo, dados.valor_centavos, path, data_evento=dados.data
-            )
+            # abrir /Despesa/Index e lançar (HTTP quando possível; Firefox de fallback)
+            # um deslocamento por vez: dois workers nunca na mesma tela de despesas
+            with self._travar_deslocamento(href):
+                ok = pc.lancar_despesa(href, dados.tipo, dados.valor_centavos, path, data_evento=dados.data)
 
             if not ok:
                 logging.error("Validação falhou ou não houve confirmação. Nada foi lançado.")
+                self._debug_portal(pc, path)
                 self._mover(path, FALHOS_DIR)
                 return
 
@@ -156,18 +207,23 @@ class Watcher:
             self._mover(path, PROCESSADOS_DIR)
 
         except Exception as e:
-            logging.exception(f"ERRO ao processar {path}: {e}")
-            try:
-                base = os.path.basename(path)
-                os.makedirs(FALHOS_DIR, exist_ok=True)
-                destino = os.path.join(FALHOS_DIR, base)
-                if os.path.abspath(path) != os.path.abspath(destino):
-                    try:
-                        os.replace(path, destino)
-                    except FileNotFoundError:
-                        pass
-            except Exception:
-                logging.warning(f"Falha ao mover '{path}' para '{FALHOS_DIR}' (talvez já tenha sido movido).")
+            self._falhou(pc, path, e)
+
+    def _falhou(self, pc: Optional[PortalClient], path: str, e: Exception):
+        logging.exception(f"ERRO ao processar {path}: {e}")
+        if pc is not None:
+            self._debug_portal(pc, path)
+        try:
+            base = os.path.basename(path)
+            os.makedirs(FALHOS_DIR, exist_ok=True)
+            destino = os.path.join(FALHOS_DIR, base)
+            if os.path.abspath(path) != os.path.abspath(destino):
+                try:
+                    os.replace(path, destino)
+                except FileNotFoundError:
+                    pass
+        except Exception:
+            logging.warning(f"Falha ao mover '{path}' para '{FALHOS_DIR}' (talvez já tenha sido movido).")
 
     # -----------------------
     # watch loop
@@ -185,7 +241,20 @@ class Watcher:
                     if p in self._known:
                         continue  # já visto nesta rodada
                     self._known.add(p)
-                    self.processar(p)
+                    if not _should_ignore(Path(p)):
+                        # Firefox sobe enquanto o OCR roda (se for preciso)
+                        (self.pool or self.pc).preaquecer()
+                    if self.ocr is None:
+                        self.processar(p)
+                    elif _should_ignore(Path(p)):
+                        logger.info("Ignorando arquivo não-processável: %s", p)
+                    else:
+                        self.ocr.submit(p)
+
+                # etapa portal: consome o que o pool de OCR já terminou
+                if self.ocr is not None:
+                    for res in self.ocr.concluidos():
+                        self.processar(res.path, res)
             except KeyboardInterrupt:
                 logging.info("Encerrado pelo usuário.")
                 break
@@ -194,7 +263,21 @@ class Watcher:
 
             # reprocesso periódico (falhos -> comprovantes)
             self._retry_falhos_tick()
-            time.sleep(2)
+            # sem comprovante na fila, o Firefox parado só ocupa RAM (no pool, cada worker fecha o seu)
+            ocupado = (self.ocr is not None and self.ocr.pendentes) or (self.pool is not None and self.pool.pendentes)
+            if self.pc is not None and not ocupado:
+                self.pc.fechar_se_ocioso()
+            time.sleep(0.5 if ocupado else 2)
+
+        self.close()
+
+    def close(self):
+        if self.ocr is not None:
+            self.ocr.close()
+        if self.pool is not None:
+            self.pool.close()
+        if self.pc is not None:
+            self.pc.close()
 
     def _retry_falhos_tick(self):
         if self.retry_interval <= 0:
@@ -231,9 +314,19 @@ def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--headless", type=int, default=int(os.getenv("HEADLESS", "0")))
     ap.add_argument("--retry-interval", type=int, default=0, help="segundos entre varreduras de 'falhos'")
+    ap.add_argument(
+        "--ocr-workers", type=int,
+        default=int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 2) - 1)))),
+        help="processos de OCR em paralelo ao Selenium (0 = OCR inline)",
+    )
+    ap.add_argument(
+        "--portal-workers", type=int, default=int(os.getenv("PORTAL_WORKERS", "1") or 1),
+        help="lançamentos em paralelo no portal (cada um com seu Firefox; limitado pela RAM livre)",
+    )
     args = ap.parse_args()
 
-    w = Watcher(headless=bool(args.headless), retry_interval=args.retry_interval)
+    w = Watcher(headless=bool(args.headless), retry_interval=args.retry_interval,
+                ocr_workers=max(0, args.ocr_workers), portal_workers=max(1, args.portal_workers))
     w.run()
 
 